@@ -0,0 +1,156 @@
+"""
+
+A module to compute for all super star markets and all agents the exact
+best response to the learned strategies of the other agents and the gain of
+best responding instead of playing the learned strategy.
+
+Other than *all_super_stars_ic_check.py*, which considers one particular
+deviation of the first agent over a finite horizon, the best response is
+optimal among all strategies over an infinite horizon.
+"""
+import json
+import sys
+
+import numpy as np
+import pandas as pd
+
+from bld.project_paths import project_paths_join as ppj
+from src.analysis.check_ic import gen_state_rewards
+from src.analysis.utils_best_response import solve_best_responses
+from src.analysis.utils_policy_evaluation import evaluate_policies
+from src.analysis.utils_simulate_play import gen_state_index_arrays
+from src.analysis.utils_simulate_play import get_all_deviation_transition_tables
+from src.analysis.utils_simulate_play import get_policy_tables
+from src.analysis.utils_simulate_play import get_transition_table
+from src.library.utils_q_table_archive import load_super_star_tuples
+
+
+def calc_best_responses_all_markets(super_star_tuples, parameter_market):
+    """
+    Calculate the best response of each agent in each super star market and
+    compare it with the learned strategy.
+
+    Args:
+        super_star_tuples (list): List of tuples, where each tuple is one
+                                  market upon convergence.
+                                  (state of convergence,
+                                  List with QLearningAgents)
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
+
+    Returns:
+        DataFrame: One row per market and agent with the value of the learned
+                   strategy and of the best response in the state of
+                   convergence, the gain of best responding in the state of
+                   convergence and the largest gain over all states.
+    """
+    state_to_price_indices, price_indices_to_state = gen_state_index_arrays(
+        parameter=parameter_market
+    )
+    all_states_of_conv, all_markets = zip(*super_star_tuples)
+    initial_int_states = np.array(all_states_of_conv, dtype=int)
+    n_markets = len(all_markets)
+    policy_tables = get_policy_tables(
+        all_markets=all_markets, n_states=state_to_price_indices.shape[0]
+    )
+    transition_tables = get_transition_table(
+        policy_table=policy_tables,
+        state_to_price_indices=state_to_price_indices,
+        price_indices_to_state=price_indices_to_state,
+    )
+    state_rewards = gen_state_rewards(
+        parameter=parameter_market, state_to_price_indices=state_to_price_indices
+    )
+
+    # Shape is (n_markets, n_agents, n_states) for both value arrays.
+    values_learned = np.swapaxes(
+        evaluate_policies(
+            transition_tables=transition_tables,
+            state_rewards=state_rewards,
+            discount_rate=parameter_market["discount_rate"],
+        ),
+        1,
+        2,
+    )
+    values_best_response = solve_best_responses(
+        deviation_transition_tables=get_all_deviation_transition_tables(
+            policy_tables=policy_tables,
+            state_to_price_indices=state_to_price_indices,
+            price_indices_to_state=price_indices_to_state,
+        ),
+        state_rewards=state_rewards,
+        discount_rate=parameter_market["discount_rate"],
+        initial_values=values_learned,
+    )["values"]
+
+    market_index = np.arange(n_markets)
+    value_learned_at_convergence = values_learned[
+        market_index, :, initial_int_states
+    ]
+    value_best_response_at_convergence = values_best_response[
+        market_index, :, initial_int_states
+    ]
+
+    best_response_table = pd.DataFrame(
+        {
+            "value_learned": value_learned_at_convergence.ravel(),
+            "value_best_response": value_best_response_at_convergence.ravel(),
+            "gain_at_convergence": (
+                value_best_response_at_convergence - value_learned_at_convergence
+            ).ravel(),
+            "max_gain": np.max(values_best_response - values_learned, axis=2).ravel(),
+        },
+        index=pd.MultiIndex.from_product(
+            [market_index, np.arange(policy_tables.shape[1])],
+            names=["market", "agent"],
+        ),
+    )
+    return best_response_table
+
+
+if __name__ == "__main__":
+    N_AGENTS = sys.argv[1]
+
+    with open(
+        ppj("IN_SIMULATION_PARAMETER", f"parameter_super_star_{N_AGENTS}_agent.json")
+    ) as f:
+        PARAMETER_MARKET = json.load(f)
+
+    SUPER_STAR_TUPLES = load_super_star_tuples(
+        archive_path=ppj("OUT_DATA", f"super_star_archive_{N_AGENTS}_agents.npz")
+    )
+
+    BEST_RESPONSE_TABLE = calc_best_responses_all_markets(
+        super_star_tuples=SUPER_STAR_TUPLES, parameter_market=PARAMETER_MARKET
+    )
+    BEST_RESPONSE_TABLE.to_pickle(
+        ppj("OUT_ANALYSIS", f"best_response_{N_AGENTS}_agents.pickle")
+    )
+
+    GAINS = BEST_RESPONSE_TABLE["gain_at_convergence"]
+    VALUES_LEARNED = BEST_RESPONSE_TABLE["value_learned"]
+
+    # Relative gains are undefined for agents whose learned value is zero,
+    # e.g. in markets that converged to the lowest price.
+    HAS_VALUE = VALUES_LEARNED != 0
+    RELATIVE_GAINS = np.divide(
+        GAINS, VALUES_LEARNED, out=np.full(len(GAINS), np.nan), where=HAS_VALUE
+    )
+    out_dict_best_response = {
+        f"share_markets_best_response_gain_{N_AGENTS}_agents": str(
+            round(np.mean(GAINS.groupby(level="market").max() > 1e-8), 3)
+        ),
+        f"share_agents_best_response_gain_{N_AGENTS}_agents": str(
+            round(np.mean(GAINS > 1e-8), 3)
+        ),
+        f"mean_best_response_gain_{N_AGENTS}_agents": str(round(GAINS.mean(), 3)),
+        f"mean_relative_best_response_gain_{N_AGENTS}_agents": str(
+            round(np.mean(RELATIVE_GAINS[HAS_VALUE]), 3)
+        ),
+        f"n_agents_without_relative_gain_{N_AGENTS}_agents": str(
+            int(np.sum(~HAS_VALUE))
+        ),
+    }
+    with open(
+        ppj("OUT_ANALYSIS", f"best_response_summary_{N_AGENTS}_agents.json"), "w"
+    ) as f:
+        json.dump(out_dict_best_response, f, indent=4)
@@ -0,0 +1,270 @@
+"""
+
+A module to audit the super star markets with the one-shot deviation
+principle: For every agent, every state that can be reached from the
+state of convergence and every price, check if deviating from the learned
+strategy for a single period and following it afterwards is profitable.
+
+As play is deterministic, the exact infinite horizon value of each state
+follows from one sparse linear solve (see *utils_policy_evaluation*).
+Hence, all (agent, state, price) combinations are evaluated as array
+operations instead of separate simulations.
+"""
+import json
+import sys
+
+import numpy as np
+import pandas as pd
+
+from bld.project_paths import project_paths_join as ppj
+from src.analysis.check_ic import gen_state_rewards
+from src.analysis.utils_policy_evaluation import evaluate_policies
+from src.analysis.utils_simulate_play import gen_state_index_arrays
+from src.analysis.utils_simulate_play import get_all_deviation_transition_tables
+from src.analysis.utils_simulate_play import get_policy_tables
+from src.analysis.utils_simulate_play import get_transition_table
+from src.library.utils_q_table_archive import load_super_star_tuples
+
+
+def find_reachable_states(deviation_transition_tables, initial_int_states):
+    """
+    Find all states that can be reached from the state of convergence if in
+    each period at most one agent deviates to an arbitrary price.
+
+    Args:
+        deviation_transition_tables (array): Next integer state for each agent,
+                                             state and price of this agent.
+                                             Shape is
+                                             (n_markets, n_agents, n_states, n_prices).
+        initial_int_states (array): Integer states of convergence.
+                                    Shape is (n_markets,).
+
+    Returns:
+        array: Boolean array which is True for the reachable states.
+               Shape is (n_markets, n_states).
+    """
+    n_markets, _, n_states, _ = deviation_transition_tables.shape
+    market_index = np.broadcast_to(
+        np.arange(n_markets)[:, np.newaxis, np.newaxis, np.newaxis],
+        deviation_transition_tables.shape,
+    )
+
+    reachable = np.zeros((n_markets, n_states), dtype=bool)
+    reachable[np.arange(n_markets), initial_int_states] = True
+    while True:
+        is_origin = np.broadcast_to(
+            reachable[:, np.newaxis, :, np.newaxis], deviation_transition_tables.shape
+        )
+        new_reachable = reachable.copy()
+        new_reachable[
+            market_index[is_origin], deviation_transition_tables[is_origin]
+        ] = True
+        if np.array_equal(new_reachable, reachable):
+            return reachable
+        reachable = new_reachable
+
+
+def audit_one_shot_deviations(
+    policy_tables,
+    transition_tables,
+    state_to_price_indices,
+    price_indices_to_state,
+    parameter_market,
+):
+    """
+    Calculate the gain of every one-shot deviation of every agent in every
+    state of every market.
+
+    The value of playing price a in state x is the reward in x plus the
+    discounted value discount_rate * W(x') of the state x' which is reached by
+    the deviation. As the reward in x is the same for all prices, the gain is
+    discount_rate * (W(x') - W(T(x))), where W(T(x)) is the value of following
+    the learned strategy.
+
+    Args:
+        policy_tables (array): Array with the price index each agent picks in each
+                               state for each market.
+                               Shape is (n_markets, n_agents, n_states).
+        transition_tables (array): Next integer state for each integer state
+                                   in each market. Shape is (n_markets, n_states).
+        state_to_price_indices (array): Price indices for each integer state
+        price_indices_to_state (array): Mapping from price indices to integer states
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
+
+    Returns:
+        dict: Dictionary with the following arrays:
+              'deviation_transition_tables' -> Next integer state for each
+                                               agent, state and price.
+                                               Shape is
+                                               (n_markets, n_agents, n_states, n_prices).
+              'gains' -> Gain of each one-shot deviation. Same shape.
+    """
+    n_markets, n_agents, _ = policy_tables.shape
+    market_index = np.arange(n_markets)[:, np.newaxis, np.newaxis]
+    discount_rate = parameter_market["discount_rate"]
+
+    state_values = evaluate_policies(
+        transition_tables=transition_tables,
+        state_rewards=gen_state_rewards(
+            parameter=parameter_market, state_to_price_indices=state_to_price_indices
+        ),
+        discount_rate=discount_rate,
+    )
+
+    deviation_transition_tables = get_all_deviation_transition_tables(
+        policy_tables=policy_tables,
+        state_to_price_indices=state_to_price_indices,
+        price_indices_to_state=price_indices_to_state,
+    )
+
+    gains = np.empty(deviation_transition_tables.shape)
+    for id_agent in range(n_agents):
+        value_policy = state_values[
+            market_index[:, :, 0], transition_tables, id_agent
+        ][:, :, np.newaxis]
+        value_deviation = state_values[
+            market_index, deviation_transition_tables[:, id_agent], id_agent
+        ]
+        gains[:, id_agent] = discount_rate * (value_deviation - value_policy)
+
+    out_dict = {}
+    out_dict["deviation_transition_tables"] = deviation_transition_tables
+    out_dict["gains"] = gains
+    return out_dict
+
+
+def make_exploitability_table(gains, reachable, initial_int_states, tolerance):
+    """
+    Summarize the gains of the one-shot deviations for each market.
+
+    Args:
+        gains (array): Gain of each one-shot deviation. Shape is
+                       (n_markets, n_agents, n_states, n_prices).
+        reachable (array): Boolean array with the reachable states.
+                           Shape is (n_markets, n_states).
+        initial_int_states (array): Integer states of convergence.
+                                    Shape is (n_markets,).
+        tolerance (float): Gains up to this value are considered as numerical
+                           noise.
+
+    Returns:
+        DataFrame: One row per market with the number of reachable states,
+                   the share of reachable states in which some agent has a
+                   profitable one-shot deviation and the largest gain
+                   together with the agent, state and price index that
+                   achieve it.
+    """
+    n_markets, n_agents, n_states, n_prices = gains.shape
+    market_index = np.arange(n_markets)
+
+    reachable_gains = np.where(reachable[:, np.newaxis, :, np.newaxis], gains, -np.inf)
+    flat_gains = reachable_gains.reshape(n_markets, -1)
+    ix_max_gain = np.argmax(flat_gains, axis=1)
+    max_gain_agent, max_gain_int_state, max_gain_price_index = np.unravel_index(
+        ix_max_gain, (n_agents, n_states, n_prices)
+    )
+    exploitable_states = np.any(reachable_gains > tolerance, axis=(1, 3))
+    gains_at_convergence = gains[market_index, :, initial_int_states, :]
+
+    exploitability_table = pd.DataFrame(
+        {
+            "n_reachable_states": np.sum(reachable, axis=1),
+            "share_exploitable_states": np.sum(exploitable_states, axis=1)
+            / np.sum(reachable, axis=1),
+            "max_gain": flat_gains[market_index, ix_max_gain],
+            "max_gain_agent": max_gain_agent,
+            "max_gain_int_state": max_gain_int_state,
+            "max_gain_price_index": max_gain_price_index,
+            "max_gain_at_convergence": np.max(gains_at_convergence, axis=(1, 2)),
+            "exploitable_at_convergence": np.any(
+                gains_at_convergence > tolerance, axis=(1, 2)
+            ),
+        }
+    )
+    exploitability_table.index.name = "market"
+    return exploitability_table
+
+
+def audit_all_markets(super_star_tuples, parameter_market, tolerance=1e-8):
+    """
+    Run the one-shot deviation audit for all super star markets.
+
+    Args:
+        super_star_tuples (list): List of tuples, where each tuple is one
+                                  market upon convergence.
+                                  (state of convergence,
+                                  List with QLearningAgents)
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
+        tolerance (float): Gains up to this value are considered as numerical
+                           noise.
+
+    Returns:
+        DataFrame: Exploitability table, see *make_exploitability_table*.
+    """
+    state_to_price_indices, price_indices_to_state = gen_state_index_arrays(
+        parameter=parameter_market
+    )
+    all_states_of_conv, all_markets = zip(*super_star_tuples)
+    initial_int_states = np.array(all_states_of_conv, dtype=int)
+    policy_tables = get_policy_tables(
+        all_markets=all_markets, n_states=state_to_price_indices.shape[0]
+    )
+    transition_tables = get_transition_table(
+        policy_table=policy_tables,
+        state_to_price_indices=state_to_price_indices,
+        price_indices_to_state=price_indices_to_state,
+    )
+
+    audit_results = audit_one_shot_deviations(
+        policy_tables=policy_tables,
+        transition_tables=transition_tables,
+        state_to_price_indices=state_to_price_indices,
+        price_indices_to_state=price_indices_to_state,
+        parameter_market=parameter_market,
+    )
+    reachable = find_reachable_states(
+        deviation_transition_tables=audit_results["deviation_transition_tables"],
+        initial_int_states=initial_int_states,
+    )
+    return make_exploitability_table(
+        gains=audit_results["gains"],
+        reachable=reachable,
+        initial_int_states=initial_int_states,
+        tolerance=tolerance,
+    )
+
+
+if __name__ == "__main__":
+    N_AGENTS = sys.argv[1]
+
+    with open(
+        ppj("IN_SIMULATION_PARAMETER", f"parameter_super_star_{N_AGENTS}_agent.json")
+    ) as f:
+        PARAMETER_MARKET = json.load(f)
+
+    SUPER_STAR_TUPLES = load_super_star_tuples(
+        archive_path=ppj("OUT_DATA", f"super_star_archive_{N_AGENTS}_agents.npz")
+    )
+
+    EXPLOITABILITY_TABLE = audit_all_markets(
+        super_star_tuples=SUPER_STAR_TUPLES, parameter_market=PARAMETER_MARKET
+    )
+    EXPLOITABILITY_TABLE.to_pickle(
+        ppj("OUT_ANALYSIS", f"deviation_audit_{N_AGENTS}_agents.pickle")
+    )
+
+    out_dict_audit = {
+        f"share_exploitable_markets_{N_AGENTS}_agents": str(
+            round(np.mean(EXPLOITABILITY_TABLE["share_exploitable_states"] > 0), 3)
+        ),
+        f"share_exploitable_at_convergence_{N_AGENTS}_agents": str(
+            round(np.mean(EXPLOITABILITY_TABLE["exploitable_at_convergence"]), 3)
+        ),
+        f"mean_share_exploitable_states_{N_AGENTS}_agents": str(
+            round(np.mean(EXPLOITABILITY_TABLE["share_exploitable_states"]), 3)
+        ),
+    }
+    with open(
+        ppj("OUT_ANALYSIS", f"deviation_audit_summary_{N_AGENTS}_agents.json"), "w"
+    ) as f:
+        json.dump(out_dict_audit, f, indent=4)
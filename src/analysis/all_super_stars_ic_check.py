@@ -11,7 +11,12 @@ import sys
 import numpy as np
 
 from bld.project_paths import project_paths_join as ppj
-from src.analysis.check_ic import check_single_market_agent_ic
+from src.analysis.check_ic import check_markets_agent_ic
+from src.analysis.check_ic import check_markets_agent_ic_exact
+from src.analysis.utils_simulate_play import gen_state_index_arrays
+from src.analysis.utils_simulate_play import get_policy_tables
+from src.analysis.utils_simulate_play import get_transition_table
+from src.library.utils_q_table_archive import load_super_star_tuples
 
 
 def check_ic_all_markets(
@@ -28,28 +33,64 @@ def check_ic_all_markets(
     Args:
         array_markets_deviation (array): Market prices in all markets without deviation
                                          Shape is (n_markets, n_periods, n_agents)
+                                         Can also be CompactTrajectories.
         array_markets_no_deviation (array): Market prices in all markets without deviation
                                             Shape is (n_markets, n_periods, n_agents)
-        parameter_market (dict): Explained somewhere else TODO
+                                            Can also be CompactTrajectories.
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
 
     Returns:
         float: Share of all markets in which the first agent learned an IC behaviour.
     """
-    n_markets = array_markets_deviation.shape[0]
-
-    n_ic_markets = 0
-    for i_market in range(n_markets):
-        bool_ic, _, _ = check_single_market_agent_ic(
-            market_prices_dev=array_markets_deviation[i_market, :, :],
-            market_prices_no_dev=array_markets_no_deviation[i_market, :, :],
-            parameter_market=parameter_market,
-        )
-        n_ic_markets += bool_ic
-
-    share_ic_markets = n_ic_markets / n_markets
+    bool_ic, _, _ = check_markets_agent_ic(
+        market_prices_dev=array_markets_deviation,
+        market_prices_no_dev=array_markets_no_deviation,
+        parameter_market=parameter_market,
+    )
+    share_ic_markets = np.sum(bool_ic) / len(bool_ic)
     return share_ic_markets
 
 
+def check_ic_all_markets_exact(super_star_tuples, parameter_market, parameter_deviation):
+    """
+    Infinite horizon counterpart to *check_ic_all_markets*. The markets do not
+    have to be simulated beforehand, see *check_markets_agent_ic_exact*.
+
+    Args:
+        super_star_tuples (list): List of tuples, where each tuple is one
+                                  market upon convergence.
+                                  (state of convergence,
+                                  List with QLearningAgents)
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
+        parameter_deviation (dict): Dictionary with the deviation simulation
+                                    parameter.
+
+    Returns:
+        dict: Output of *check_markets_agent_ic_exact* for all markets.
+    """
+    state_to_price_indices, price_indices_to_state = gen_state_index_arrays(
+        parameter=parameter_market
+    )
+    all_states_of_conv, all_markets = zip(*super_star_tuples)
+    policy_tables = get_policy_tables(
+        all_markets=all_markets, n_states=state_to_price_indices.shape[0]
+    )
+    transition_tables = get_transition_table(
+        policy_table=policy_tables,
+        state_to_price_indices=state_to_price_indices,
+        price_indices_to_state=price_indices_to_state,
+    )
+    return check_markets_agent_ic_exact(
+        policy_tables=policy_tables,
+        transition_tables=transition_tables,
+        state_to_price_indices=state_to_price_indices,
+        price_indices_to_state=price_indices_to_state,
+        initial_int_states=np.array(all_states_of_conv, dtype=int),
+        parameter_market=parameter_market,
+        parameter_deviation=parameter_deviation,
+    )
+
+
 if __name__ == "__main__":
     N_AGENTS = sys.argv[1]
 
@@ -58,6 +99,13 @@ if __name__ == "__main__":
     ) as f:
         PARAMETER_MARKET = json.load(f)
 
+    with open(ppj("IN_MODEL_SPECS", "deviation_simulation.json")) as f:
+        PARAMETER_DEVIATION = json.load(f)
+
+    SUPER_STAR_TUPLES = load_super_star_tuples(
+        archive_path=ppj("OUT_DATA", f"super_star_archive_{N_AGENTS}_agents.npz")
+    )
+
     with open(
         ppj("OUT_ANALYSIS", f"array_no_deviation_simulations_{N_AGENTS}_agents.pickle"),
         "rb",
@@ -78,6 +126,30 @@ if __name__ == "__main__":
     out_dict_all_markets = {
         f"IC_share_all_markets_{N_AGENTS}_agents": str(round(IC_SHARE, 3))
     }
+
+    # Compare to the exact infinite horizon verdict.
+    EXACT_IC = check_ic_all_markets_exact(
+        super_star_tuples=SUPER_STAR_TUPLES,
+        parameter_market=PARAMETER_MARKET,
+        parameter_deviation=PARAMETER_DEVIATION,
+    )
+    FINITE_IC, _, _ = check_markets_agent_ic(
+        market_prices_dev=ARRAY_DEVIATION,
+        market_prices_no_dev=ARRAY_NO_DEVIATION,
+        parameter_market=PARAMETER_MARKET,
+    )
+    out_dict_all_markets[f"IC_share_all_markets_exact_{N_AGENTS}_agents"] = str(
+        round(np.mean(EXACT_IC["ic"]), 3)
+    )
+    out_dict_all_markets[f"share_horizon_sensitive_{N_AGENTS}_agents"] = str(
+        round(np.mean(EXACT_IC["ic"] != FINITE_IC), 3)
+    )
+    out_dict_all_markets[f"max_truncation_error_no_dev_{N_AGENTS}_agents"] = str(
+        np.max(EXACT_IC["truncation_error_no_dev"])
+    )
+    out_dict_all_markets[f"max_truncation_error_dev_{N_AGENTS}_agents"] = str(
+        np.max(EXACT_IC["truncation_error_dev"])
+    )
     with open(
         ppj("OUT_ANALYSIS", f"ic_all_super_star_{N_AGENTS}_agents.json"), "w"
     ) as f:
@@ -0,0 +1,85 @@
+"""
+
+A module to calculate the exact value functions of all agents in all super
+star markets, given that all agents play their learned greedy strategies.
+"""
+import json
+import pickle
+import sys
+
+import numpy as np
+
+from bld.project_paths import project_paths_join as ppj
+from src.analysis.check_ic import gen_state_rewards
+from src.analysis.utils_policy_evaluation import evaluate_policies
+from src.analysis.utils_simulate_play import gen_state_index_arrays
+from src.analysis.utils_simulate_play import get_policy_tables
+from src.analysis.utils_simulate_play import get_transition_table
+from src.library.utils_q_table_archive import load_super_star_tuples
+
+
+def calc_policy_values_all_markets(super_star_tuples, parameter_market):
+    """
+    Evaluate the joint greedy policies of all super star markets.
+
+    Args:
+        super_star_tuples (list): List of tuples, where each tuple is one
+                                  market upon convergence.
+                                  (state of convergence,
+                                  List with QLearningAgents)
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
+
+    Returns:
+        dict: Dictionary with the following arrays:
+              'state_values' -> Value of each agent in each state.
+                                Shape is (n_markets, n_states, n_agents).
+              'values_at_convergence' -> Value of each agent in the state of
+                                         convergence. Shape is (n_markets, n_agents).
+    """
+    state_to_price_indices, price_indices_to_state = gen_state_index_arrays(
+        parameter=parameter_market
+    )
+    all_states_of_conv, all_markets = zip(*super_star_tuples)
+    policy_tables = get_policy_tables(
+        all_markets=all_markets, n_states=state_to_price_indices.shape[0]
+    )
+    transition_tables = get_transition_table(
+        policy_table=policy_tables,
+        state_to_price_indices=state_to_price_indices,
+        price_indices_to_state=price_indices_to_state,
+    )
+    state_values = evaluate_policies(
+        transition_tables=transition_tables,
+        state_rewards=gen_state_rewards(
+            parameter=parameter_market, state_to_price_indices=state_to_price_indices
+        ),
+        discount_rate=parameter_market["discount_rate"],
+    )
+
+    out_dict = {}
+    out_dict["state_values"] = state_values
+    out_dict["values_at_convergence"] = state_values[
+        np.arange(len(all_states_of_conv)), np.array(all_states_of_conv, dtype=int)
+    ]
+    return out_dict
+
+
+if __name__ == "__main__":
+    N_AGENTS = sys.argv[1]
+
+    with open(
+        ppj("IN_SIMULATION_PARAMETER", f"parameter_super_star_{N_AGENTS}_agent.json")
+    ) as f:
+        PARAMETER_MARKET = json.load(f)
+
+    SUPER_STAR_TUPLES = load_super_star_tuples(
+        archive_path=ppj("OUT_DATA", f"super_star_archive_{N_AGENTS}_agents.npz")
+    )
+
+    POLICY_VALUES = calc_policy_values_all_markets(
+        super_star_tuples=SUPER_STAR_TUPLES, parameter_market=PARAMETER_MARKET
+    )
+    with open(
+        ppj("OUT_ANALYSIS", f"policy_values_{N_AGENTS}_agents.pickle"), "wb"
+    ) as f:
+        pickle.dump(POLICY_VALUES, f)
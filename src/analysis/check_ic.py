@@ -3,10 +3,442 @@
 A module that collects function to check the incentive
 compatibility of the agents decision.
 """
+from functools import lru_cache
+
 import numpy as np
 
+from src.analysis import utils_numba_kernels
+from src.analysis.utils_deviation_scenarios import simulate_deviation_scenarios
+from src.analysis.utils_policy_evaluation import evaluate_policies
+from src.analysis.utils_state_graph import advance_int_states
+from src.analysis.utils_trajectory_cycles import calc_compact_trajectory_values
+from src.library.utils_compact_trajectories import CompactTrajectories
 from qpricesim.model_code.economic_environment import calc_reward
 from qpricesim.model_code.economic_environment import calc_winning_price
+from qpricesim.simulations.utils_simulation import gen_possible_prices
+
+
+@lru_cache(maxsize=None)
+def _gen_reward_table(n_agent, min_price, max_price, step, reservation_price, m_consumer):
+    """
+    Cached implementation of *gen_reward_table*, see there.
+    """
+    parameter = {"min_price": min_price, "max_price": max_price, "step": step}
+    possible_prices = gen_possible_prices(parameter=parameter)
+    n_prices = len(possible_prices)
+
+    reward_table = np.empty((n_prices,) * n_agent + (n_agent,))
+    for price_indices in np.ndindex(*(n_prices,) * n_agent):
+        prices = possible_prices[list(price_indices)]
+        winning_price, n_winning_price = calc_winning_price(prices)
+        for id_agent in range(n_agent):
+            reward_table[price_indices + (id_agent,)] = calc_reward(
+                p_i=prices[id_agent],
+                winning_price=winning_price,
+                n_winning_price=n_winning_price,
+                reservation_price=reservation_price,
+                m_consumer=m_consumer,
+            )
+    # The table is shared between all calls.
+    reward_table.flags.writeable = False
+    return reward_table
+
+
+def gen_reward_table(parameter):
+    """
+    Calculate the reward of each agent for all possible price profiles once,
+    such that rewards can be looked up instead of recalculated each period.
+
+    Args:
+        parameter (dict): Market specs as defined in *utils_state_encoding*
+
+    Returns:
+        array: Read-only array with the rewards. It has one axis of length n_prices
+               for each agent and a last axis for the agents, such that
+               reward_table[tuple(price_indices)][i] is the reward of agent i.
+    """
+    return _gen_reward_table(
+        n_agent=parameter["n_agent"],
+        min_price=parameter["min_price"],
+        max_price=parameter["max_price"],
+        step=parameter["step"],
+        reservation_price=parameter["reservation_price"],
+        m_consumer=parameter["m_consumer"],
+    )
+
+
+def gen_discount_vector(discount_rate, n_periods):
+    """
+    Generate the discount factors for the periods 0, ..., n_periods - 1.
+
+    Note that the factors are calculated with Python floats on purpose. numpy's
+    power can differ in the last digit, which would make the discounted profits
+    differ from the period by period calculation.
+
+    Args:
+        discount_rate (float): Discount rate
+        n_periods (integer): Number of periods
+
+    Returns:
+        array: Array with discount_rate ** t for all periods t.
+    """
+    return np.array([discount_rate ** t for t in range(n_periods)], dtype=float)
+
+
+def prices_to_profile_indices(market_prices, possible_prices):
+    """
+    Transform prices to the flat index of the price profile in the (flattened)
+    reward table.
+
+    Args:
+        market_prices (array): Array with prices. The last axis are the agents.
+        possible_prices (array): Array of possible prices in the market
+
+    Returns:
+        array: Flat price profile indices. Shape is market_prices.shape[:-1].
+    """
+    n_agents = market_prices.shape[-1]
+    price_indices = np.searchsorted(possible_prices, market_prices)
+    return np.ravel_multi_index(
+        tuple(np.moveaxis(price_indices, -1, 0)), (len(possible_prices),) * n_agents
+    )
+
+
+def _calc_discounted_profits_compiled(market_prices, parameter_market):
+    """
+    Calculate the discounted profits of all agents in a stack of markets with
+    the compiled kernel.
+
+    Args:
+        market_prices (array): Array with prices. Shape is
+                               (n_markets, n_periods, n_agents).
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
+
+    Returns:
+        array: Discounted profits. Shape is (n_markets, n_agents).
+    """
+    n_agents = market_prices.shape[-1]
+    n_periods = market_prices.shape[-2]
+    possible_prices = gen_possible_prices(parameter=parameter_market)
+    flat_reward_table = gen_reward_table(parameter=parameter_market).reshape(
+        -1, n_agents
+    )
+    profile_indices = prices_to_profile_indices(
+        market_prices=market_prices, possible_prices=possible_prices
+    )
+    discount_vector = gen_discount_vector(
+        discount_rate=parameter_market["discount_rate"], n_periods=n_periods
+    )
+    return utils_numba_kernels.calc_discounted_profits_kernel(
+        profile_indices, flat_reward_table, discount_vector
+    )
+
+
+def calc_winning_prices(market_prices):
+    """
+    Vectorized counterpart to *calc_winning_price*.
+
+    Args:
+        market_prices (array): Array with prices. The last axis are the agents.
+
+    Returns:
+        tuple: - Array with the winning (lowest) price
+               - Array with the number of agents that set the winning price
+               Both have the shape market_prices.shape[:-1].
+    """
+    winning_price = np.min(market_prices, axis=-1)
+    n_winning_price = np.sum(market_prices == winning_price[..., np.newaxis], axis=-1)
+    return winning_price, n_winning_price
+
+
+def evaluate_market_prices(market_prices, parameter_market):
+    """
+    Calculate winning prices, rewards and discounted profits for a whole stack of
+    markets at once. The reward of period t is discounted with
+    discount_rate ** t.
+
+    Note that the discounted profits are accumulated period by period as in
+    *check_single_market_agent_ic*, such that both give the exact same numbers.
+
+    Args:
+        market_prices (array): Array with prices. Shape is
+                               (n_markets, n_periods, n_agents).
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
+
+    Returns:
+        dict: Dictionary with the following arrays:
+              'winning_price' -> Shape (n_markets, n_periods)
+              'n_winning_price' -> Shape (n_markets, n_periods)
+              'rewards' -> Reward of each agent. Shape (n_markets, n_periods, n_agents)
+              'discounted_profits' -> Shape (n_markets, n_agents)
+    """
+    market_prices = np.asarray(market_prices)
+    n_agents = market_prices.shape[-1]
+    n_periods = market_prices.shape[-2]
+
+    winning_price, n_winning_price = calc_winning_prices(market_prices=market_prices)
+
+    # The reward table is build with *calc_reward*, hence rewards are looked up
+    # instead of recalculated.
+    flat_reward_table = gen_reward_table(parameter=parameter_market).reshape(
+        -1, n_agents
+    )
+    profile_indices = prices_to_profile_indices(
+        market_prices=market_prices,
+        possible_prices=gen_possible_prices(parameter=parameter_market),
+    )
+    rewards = flat_reward_table[profile_indices]
+
+    discount_vector = gen_discount_vector(
+        discount_rate=parameter_market["discount_rate"], n_periods=n_periods
+    )
+    discounted_profits = np.zeros(market_prices.shape[:-2] + (n_agents,))
+    for t in range(n_periods):
+        discounted_profits = (
+            discounted_profits + discount_vector[t] * rewards[..., t, :]
+        )
+
+    out_dict = {}
+    out_dict["winning_price"] = winning_price
+    out_dict["n_winning_price"] = n_winning_price
+    out_dict["rewards"] = rewards
+    out_dict["discounted_profits"] = discounted_profits
+    return out_dict
+
+
+def calc_compact_discounted_profits(trajectories, parameter_market):
+    """
+    Counterpart to the discounted profits of *evaluate_market_prices* for
+    trajectories stored as prefix plus cycle. The profits are calculated in
+    closed form, hence the cost does not grow with the number of periods.
+
+    Args:
+        trajectories (CompactTrajectories): Price trajectories of the markets
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
+
+    Returns:
+        array: Discounted profits. Shape is trajectories.batch_shape + (n_agents,).
+    """
+    n_agents = parameter_market["n_agent"]
+    flat_reward_table = gen_reward_table(parameter=parameter_market).reshape(
+        -1, n_agents
+    )
+    # The reward of a state is given by the newest prices in the state.
+    profile_indices = prices_to_profile_indices(
+        market_prices=trajectories.state_prices[:, -n_agents:],
+        possible_prices=gen_possible_prices(parameter=parameter_market),
+    )
+    return calc_compact_trajectory_values(
+        trajectories=trajectories,
+        state_rewards=flat_reward_table[profile_indices],
+        discount_rate=parameter_market["discount_rate"],
+    )
+
+
+def check_markets_agent_ic(
+    market_prices_dev, market_prices_no_dev, parameter_market, tolerance=1e-8
+):
+    """
+    Vectorized counterpart to *check_single_market_agent_ic* for a stack of
+    markets. It is assumed that the first agent (index 0) deviated.
+
+    If both price stacks are CompactTrajectories, the profits are calculated in
+    closed form with *calc_compact_discounted_profits*. Its sums are ordered
+    differently than the period by period sums of the dense arrays, hence profits
+    which are equal up to *tolerance* are considered equal.
+
+    Args:
+        market_prices_dev (array): Array with prices with a exogenously enforced
+                                   deviation. Shape is (n_markets, n_periods, n_agents).
+                                   Can also be CompactTrajectories.
+        market_prices_no_dev (array): Array with prices without a deviation.
+                                      Shape is (n_markets, n_periods, n_agents).
+                                      Can also be CompactTrajectories.
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
+        tolerance (float): Profit differences up to this value are considered
+                           as numerical noise of the closed form. Only used for
+                           CompactTrajectories.
+
+    Returns:
+        tuple: - Boolean array: True if the deviation was not profitable, else False
+               - Array with the profits without deviation
+               - Array with the profits with deviation
+               All arrays have the shape (n_markets,).
+    """
+    if isinstance(market_prices_dev, CompactTrajectories) and isinstance(
+        market_prices_no_dev, CompactTrajectories
+    ):
+        total_profit_dev = calc_compact_discounted_profits(
+            trajectories=market_prices_dev, parameter_market=parameter_market
+        )[:, 0]
+        total_profit_no_dev = calc_compact_discounted_profits(
+            trajectories=market_prices_no_dev, parameter_market=parameter_market
+        )[:, 0]
+        bool_ic = total_profit_no_dev >= total_profit_dev - tolerance
+        return (bool_ic, total_profit_no_dev, total_profit_dev)
+
+    total_profit_dev = evaluate_market_prices(
+        market_prices=market_prices_dev, parameter_market=parameter_market
+    )["discounted_profits"][:, 0]
+    total_profit_no_dev = evaluate_market_prices(
+        market_prices=market_prices_no_dev, parameter_market=parameter_market
+    )["discounted_profits"][:, 0]
+    bool_ic = total_profit_no_dev >= total_profit_dev
+    return (bool_ic, total_profit_no_dev, total_profit_dev)
+
+
+def gen_state_rewards(parameter, state_to_price_indices):
+    """
+    Look up the reward of each agent in each integer state. The reward of a
+    state is given by the newest prices in the state.
+
+    Args:
+        parameter (dict): Market specs as defined in *utils_state_encoding*
+        state_to_price_indices (array): Price indices for each integer state
+
+    Returns:
+        array: Rewards. Shape is (n_states, n_agents).
+    """
+    n_agents = parameter["n_agent"]
+    reward_table = gen_reward_table(parameter=parameter)
+    newest_price_indices = state_to_price_indices[:, -n_agents:]
+    return reward_table[tuple(newest_price_indices.T)]
+
+
+def check_markets_agent_ic_exact(
+    policy_tables,
+    transition_tables,
+    state_to_price_indices,
+    price_indices_to_state,
+    initial_int_states,
+    parameter_market,
+    parameter_deviation,
+    tolerance=1e-8,
+):
+    """
+    Check for a stack of markets if the deviation of the first agent (index 0)
+    is profitable over an infinite horizon.
+
+    The deviation is the one of *play_with_deviation*. As play is deterministic,
+    the value after the deviation period is the exact value of the state
+    reached (see *utils_policy_evaluation.evaluate_policies*). Hence, the result
+    neither depends on *parameter_deviation["total_periods"]* nor are all
+    periods simulated. The horizon is only used to report the truncation error
+    of the finite horizon profits of *check_markets_agent_ic*, which is
+    discount_rate ** total_periods * W(x_total_periods).
+
+    Args:
+        policy_tables (array): Array with the price index each agent picks in each
+                               state for each market.
+                               Shape is (n_markets, n_agents, n_states).
+        transition_tables (array): Next integer state for each integer state
+                                   in each market. Shape is (n_markets, n_states).
+        state_to_price_indices (array): Price indices for each integer state
+        price_indices_to_state (array): Mapping from price indices to integer states
+        initial_int_states (array): Integer states of convergence.
+                                    Shape is (n_markets,).
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
+        parameter_deviation (dict): Parameter for the deviation simulation
+        tolerance (float): Profit differences up to this value are considered
+                           as numerical noise of the linear solve.
+
+    Returns:
+        dict: Dictionary with the following arrays of shape (n_markets,):
+              'ic' -> True if the deviation was not profitable, else False
+              'profit_no_dev' -> Infinite horizon profit without deviation
+              'profit_dev' -> Infinite horizon profit with deviation
+              'truncation_error_no_dev' -> Profit that the finite horizon
+                                           misses without deviation
+              'truncation_error_dev' -> Profit that the finite horizon misses
+                                        with deviation
+    """
+    n_markets = transition_tables.shape[0]
+    market_index = np.arange(n_markets)
+    discount_rate = parameter_market["discount_rate"]
+    periods_before_deviation = parameter_deviation["periods_before_deviation"]
+    total_periods = parameter_deviation["total_periods"]
+
+    state_rewards = gen_state_rewards(
+        parameter=parameter_market, state_to_price_indices=state_to_price_indices
+    )[:, 0]
+    state_values = evaluate_policies(
+        transition_tables=transition_tables,
+        state_rewards=state_rewards,
+        discount_rate=discount_rate,
+    )
+
+    # Simulate up to and including the deviation period.
+    baseline_scenario = {"periods_before_deviation": periods_before_deviation}
+    int_states_dev = simulate_deviation_scenarios(
+        scenarios=[baseline_scenario],
+        total_periods=periods_before_deviation + 2,
+        policy_tables=policy_tables,
+        state_to_price_indices=state_to_price_indices,
+        price_indices_to_state=price_indices_to_state,
+        possible_prices=gen_possible_prices(parameter=parameter_market),
+        initial_int_states=initial_int_states,
+    )[0]
+    int_state_before_deviation = int_states_dev[:, periods_before_deviation]
+    int_state_deviation = int_states_dev[:, periods_before_deviation + 1]
+    int_state_no_deviation = transition_tables[
+        market_index, int_state_before_deviation
+    ]
+
+    # Both paths share the periods before the deviation. Using the same sum for
+    # both makes sure that a deviation which changes nothing gives the exact
+    # same profits.
+    discount_vector = gen_discount_vector(
+        discount_rate=discount_rate, n_periods=periods_before_deviation + 2
+    )
+    profit_before_deviation = np.zeros(n_markets)
+    for t in range(periods_before_deviation + 1):
+        profit_before_deviation = (
+            profit_before_deviation
+            + discount_vector[t] * state_rewards[int_states_dev[:, t]]
+        )
+    discount_deviation = discount_vector[periods_before_deviation + 1]
+    profit_no_dev = (
+        profit_before_deviation
+        + discount_deviation * state_values[market_index, int_state_no_deviation]
+    )
+    profit_dev = (
+        profit_before_deviation
+        + discount_deviation * state_values[market_index, int_state_deviation]
+    )
+
+    # Value of the periods after the finite horizon.
+    periods_after_deviation = total_periods - periods_before_deviation - 1
+    discount_horizon = discount_rate ** total_periods
+    truncation_error_no_dev = (
+        discount_horizon
+        * state_values[
+            market_index,
+            advance_int_states(
+                transition_tables=transition_tables,
+                int_states=int_state_no_deviation,
+                n_periods=periods_after_deviation,
+            ),
+        ]
+    )
+    truncation_error_dev = (
+        discount_horizon
+        * state_values[
+            market_index,
+            advance_int_states(
+                transition_tables=transition_tables,
+                int_states=int_state_deviation,
+                n_periods=periods_after_deviation,
+            ),
+        ]
+    )
+
+    out_dict = {}
+    out_dict["ic"] = profit_no_dev >= profit_dev - tolerance
+    out_dict["profit_no_dev"] = profit_no_dev
+    out_dict["profit_dev"] = profit_dev
+    out_dict["truncation_error_no_dev"] = truncation_error_no_dev
+    out_dict["truncation_error_dev"] = truncation_error_dev
+    return out_dict
 
 
 def check_single_market_agent_ic(
@@ -22,7 +454,7 @@ def check_single_market_agent_ic(
                                    The shape should be (simulation periods, number of agents).
         market_prices_no_dev (array): Array with prices without a deviation. The shape should
                                       be (simulation periods, number of agents).
-        parameter_market (dict): Dict with market specs explained somewhere else TODO
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
 
     Returns:
         # TODO MAKE OUTPUT DICT HERE ALREADY
@@ -30,6 +462,41 @@ def check_single_market_agent_ic(
                - Profit without deviation
                - Profit with deviation
     """
+    if utils_numba_kernels.USE_NUMBA:
+        total_profit_dev, total_profit_no_dev = _calc_discounted_profits_compiled(
+            market_prices=np.stack((market_prices_dev, market_prices_no_dev)),
+            parameter_market=parameter_market,
+        )[:, 0]
+    else:
+        total_profit_dev, total_profit_no_dev = _calc_discounted_profits_python(
+            market_prices_dev=market_prices_dev,
+            market_prices_no_dev=market_prices_no_dev,
+            parameter_market=parameter_market,
+        )
+
+    # TODO: MAKE DICT HERE ALREADY
+    if total_profit_no_dev >= total_profit_dev:
+        return (True, total_profit_no_dev, total_profit_dev)
+    else:
+        return (False, total_profit_no_dev, total_profit_dev)
+
+
+def _calc_discounted_profits_python(
+    market_prices_dev, market_prices_no_dev, parameter_market
+):
+    """
+    Interpreted fallback for the profit calculation in
+    *check_single_market_agent_ic*.
+
+    Returns:
+        tuple: Profit of the first agent with deviation, profit without deviation
+    """
+    # Prices may be stored in a narrow integer type (see utils_dtypes). Widen
+    # them before calculating rewards such that the products cannot overflow.
+    price_dtype = gen_possible_prices(parameter=parameter_market).dtype
+    market_prices_dev = np.asarray(market_prices_dev, dtype=price_dtype)
+    market_prices_no_dev = np.asarray(market_prices_no_dev, dtype=price_dtype)
+
     p_star_n_winners_dev = np.apply_along_axis(calc_winning_price, 1, market_prices_dev)
     p_star_n_winners_no_dev = np.apply_along_axis(
         calc_winning_price, 1, market_prices_no_dev
@@ -62,8 +529,4 @@ def check_single_market_agent_ic(
             total_profit_no_dev + discount_rate ** t * period_reward_no_dev
         )
 
-    # TODO: MAKE DICT HERE ALREADY
-    if total_profit_no_dev >= total_profit_dev:
-        return (True, total_profit_no_dev, total_profit_dev)
-    else:
-        return (False, total_profit_no_dev, total_profit_dev)
+    return total_profit_dev, total_profit_no_dev
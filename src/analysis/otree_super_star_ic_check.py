@@ -10,16 +10,14 @@ import sys
 import numpy as np
 
 from bld.project_paths import project_paths_join as ppj
-from src.analysis.check_ic import check_single_market_agent_ic
-from src.analysis.simulate_dev_no_dev import play_with_deviation
-from src.analysis.utils_simulate_play import play_without_deviation
-from qpricesim.simulations.utils_simulation import gen_possible_prices
-from qpricesim.simulations.utils_simulation import (
-    gen_price_combination_byte_mappings,
-)
-from qpricesim.simulations.utils_simulation import (
-    int_state_to_price_state,
-)
+from src.analysis.check_ic import check_markets_agent_ic
+from src.analysis.check_ic import check_markets_agent_ic_exact
+from src.analysis.simulate_dev_no_dev import sim_dev_no_dev_compact
+from src.analysis.utils_simulate_play import gen_state_index_arrays
+from src.analysis.utils_simulate_play import get_policy_table
+from src.analysis.utils_simulate_play import get_transition_table
+from src.library.utils_super_star_catalog import get_index_path
+from src.library.utils_super_star_catalog import load_super_star_market
 
 
 def _is_int(val):
@@ -87,16 +85,14 @@ def get_super_star_market_participants(n_agents):
     # Random Seed is the PBS index
     PBS_index = int(super_star_grid_search[-1])
 
-    # Read respective file from the super star simulation.
-    # with the PBS_index as the identifier in the file name.
-    with open(
-        ppj(
-            f"IN_SIMULATION_SUPER_STARS_{n_agents}_AGENT",
-            f"simulated_arrays_{n_agents}_agents_seed_{PBS_index}.pickle",
+    # Load the respective market from the super star catalog
+    # with the PBS_index as the seed.
+    entire_super_star_market = load_super_star_market(
+        index_path=get_index_path(
+            catalog_prefix=ppj("OUT_DATA", f"super_star_catalog_{n_agents}_agents")
         ),
-        "rb",
-    ) as f:
-        entire_super_star_market = pickle.load(f)
+        seed=PBS_index,
+    )
 
     # Check if the first agent from the entire super star market is
     # actually the same as the super star from the grid search simulation.
@@ -120,7 +116,7 @@ def check_otree_super_star(super_star_market, parameter_market, parameter_deviat
 
     Args:
         super_star_market (tuple): (index state of convergence, List of QLeaningAgents)
-        parameter_market (dict): Explained somewhere else TODO
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
         parameter_deviation (dict): Dictionary with the parameter for the deviation
                                     simulation.
 
@@ -128,39 +124,33 @@ def check_otree_super_star(super_star_market, parameter_market, parameter_deviat
         dict: Dictionary with the outputs (IC: True/False + Value-functions)
     """
 
-    # Generate the translation dicts.
-    prices_to_int_dict, int_to_prices_dict = gen_price_combination_byte_mappings(
+    # Generate the translation arrays.
+    state_to_price_indices, price_indices_to_state = gen_state_index_arrays(
         parameter=parameter_market
     )
 
-    # Generate array of possible market prices.
-    possible_prices = gen_possible_prices(parameter=parameter_market)
-
     # Unroll super star market tuple
     state_of_conv, all_agents = super_star_market
 
-    # Transform state of convergence to its market price representation
-    price_state_of_conv = int_state_to_price_state(
-        int_state=state_of_conv, int_to_prices_dict=int_to_prices_dict
+    # Extract the greedy policies of all agents
+    policy_table = get_policy_table(
+        all_agents=all_agents, n_states=state_to_price_indices.shape[0]
     )
-
-    # Get the market prices with and without deviation...
-    prices_dev = play_with_deviation(
-        parameter=parameter_deviation,
-        all_agents=all_agents,
-        prices_to_int_dict=prices_to_int_dict,
-        possible_prices=possible_prices,
-        initial_price_state=price_state_of_conv,
+    transition_table = get_transition_table(
+        policy_table=policy_table,
+        state_to_price_indices=state_to_price_indices,
+        price_indices_to_state=price_indices_to_state,
     )
-    prices_no_dev = play_without_deviation(
-        parameter=parameter_deviation,
-        all_agents=all_agents,
-        prices_to_int_dict=prices_to_int_dict,
-        possible_prices=possible_prices,
-        initial_price_state=price_state_of_conv,
+
+    # Get the market prices with and without deviation as prefix plus cycle,
+    # such that the horizon can be arbitrarily long...
+    prices_no_dev, prices_dev = sim_dev_no_dev_compact(
+        parameter_market=parameter_market,
+        parameter_deviation=parameter_deviation,
+        all_super_star_tuple=[super_star_market],
     )
     # ... check for incentive compatibility.
-    ic_output = check_single_market_agent_ic(
+    ic_output = check_markets_agent_ic(
         market_prices_dev=prices_dev,
         market_prices_no_dev=prices_no_dev,
         parameter_market=parameter_market,
@@ -168,9 +158,27 @@ def check_otree_super_star(super_star_market, parameter_market, parameter_deviat
 
     # Write the results to a dictionary and return it.
     out_dict = {}
-    out_dict["IC"] = str(ic_output[0])
-    out_dict["V_NO_DEV"] = str(ic_output[1])
-    out_dict["V_DEV"] = str(ic_output[2])
+    out_dict["IC"] = str(ic_output[0][0])
+    out_dict["V_NO_DEV"] = str(ic_output[1][0])
+    out_dict["V_DEV"] = str(ic_output[2][0])
+
+    # Exact infinite horizon check and the error of the finite horizon.
+    exact_ic_output = check_markets_agent_ic_exact(
+        policy_tables=policy_table[np.newaxis],
+        transition_tables=transition_table[np.newaxis],
+        state_to_price_indices=state_to_price_indices,
+        price_indices_to_state=price_indices_to_state,
+        initial_int_states=np.array([state_of_conv]),
+        parameter_market=parameter_market,
+        parameter_deviation=parameter_deviation,
+    )
+    out_dict["IC_EXACT"] = str(exact_ic_output["ic"][0])
+    out_dict["V_NO_DEV_EXACT"] = str(exact_ic_output["profit_no_dev"][0])
+    out_dict["V_DEV_EXACT"] = str(exact_ic_output["profit_dev"][0])
+    out_dict["TRUNCATION_ERROR_NO_DEV"] = str(
+        exact_ic_output["truncation_error_no_dev"][0]
+    )
+    out_dict["TRUNCATION_ERROR_DEV"] = str(exact_ic_output["truncation_error_dev"][0])
 
     return out_dict
 
@@ -4,10 +4,10 @@ A script to calculate the p-values and averages for Section 6.3 of the paper.
 """
 import json
 import pickle
-import numpy as np
 from scipy.stats import mannwhitneyu, ttest_1samp
 
 from bld.project_paths import project_paths_join as ppj
+from src.library.utils_metric_store import load_metric
 
 def calc_p_value_by_super_game(
         data_experiment,
@@ -134,16 +134,18 @@ if __name__ == '__main__':
 
     # Load the simulation data
     # Two firm algorithm markets
-    with open(ppj("OUT_DATA", "grid_2_agents.pickle"), "rb") as f:
-        all_output_grids_2_agents = pickle.load(f)
-    all_prices_2_agents_grid = np.array(all_output_grids_2_agents['avg_price'])
+    all_prices_2_agents_grid = load_metric(
+        manifest_path=ppj("OUT_DATA", "grid_2_agents_manifest.json"),
+        metric="avg_price",
+    )
     with open(ppj("OUT_DATA", "super_star_avg_prices_2_agents.pickle"), "rb") as f:
         super_star_avg_prices_2_agents = pickle.load(f)
 
     # Three firm algorithm markets
-    with open(ppj("OUT_DATA", "grid_3_agents.pickle"), "rb") as f:
-        all_output_grids_3_agents = pickle.load(f)
-    all_prices_3_agents_grid = np.array(all_output_grids_3_agents['avg_price'])
+    all_prices_3_agents_grid = load_metric(
+        manifest_path=ppj("OUT_DATA", "grid_3_agents_manifest.json"),
+        metric="avg_price",
+    )
     with open(ppj("OUT_DATA", "super_star_avg_prices_3_agents.pickle"), "rb") as f:
         super_star_avg_prices_3_agents = pickle.load(f)
 
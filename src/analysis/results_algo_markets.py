@@ -4,11 +4,11 @@ Calculate the p-values and other results used for the fully algorithmic market c
 """
 
 import json
-import pickle
 
 import numpy as np
 from scipy.stats import mannwhitneyu
 from bld.project_paths import project_paths_join as ppj
+from src.library.utils_metric_store import load_metric
 
 
 def share_mean_above_threshold(value_array, threshold):
@@ -66,15 +66,15 @@ def calc_all_results(price_array_3_agents, price_array_2_agents):
 
 
 if __name__ == '__main__':
-    # Load all grids
-    with open(ppj("OUT_DATA", "grid_3_agents.pickle"), "rb") as f:
-        all_grids_3_agents = pickle.load(f)
-    with open(ppj("OUT_DATA", "grid_2_agents.pickle"), "rb") as f:
-        all_grids_2_agents = pickle.load(f)
-
     # Get the avg price array for both
-    array_avg_price_3_agents = np.array(all_grids_3_agents['avg_price'])
-    array_avg_price_2_agents = np.array(all_grids_2_agents['avg_price'])
+    array_avg_price_3_agents = load_metric(
+        manifest_path=ppj("OUT_DATA", "grid_3_agents_manifest.json"),
+        metric="avg_price",
+    )
+    array_avg_price_2_agents = load_metric(
+        manifest_path=ppj("OUT_DATA", "grid_2_agents_manifest.json"),
+        metric="avg_price",
+    )
 
     # Calculate results and save to json
     all_results_fully_algo = calc_all_results(
@@ -12,19 +12,31 @@ import numpy as np
 
 from bld.project_paths import project_paths as pp
 from bld.project_paths import project_paths_join as ppj
+from src.analysis import utils_numba_kernels
+from src.analysis.utils_deviation_scenarios import play_deviation_scenarios
+from src.analysis.utils_deviation_scenarios import simulate_deviation_scenarios
+from src.analysis.utils_parallel import map_shards
+from src.analysis.utils_parallel import run_sharded
+from src.analysis.utils_simulate_play import gen_state_index_arrays
+from src.analysis.utils_simulate_play import get_market_tables
+from src.analysis.utils_simulate_play import get_policy_table
+from src.analysis.utils_simulate_play import get_policy_tables
+from src.analysis.utils_simulate_play import get_transition_table
+from src.analysis.utils_simulate_play import int_states_to_prices
 from src.analysis.utils_simulate_play import play_n_periods
 from src.analysis.utils_simulate_play import play_period
-from src.analysis.utils_simulate_play import play_without_deviation
+from src.analysis.utils_simulate_play import play_without_deviation_batched
+from src.analysis.utils_simulate_play import play_without_deviation_from_table
+from src.analysis.utils_simulate_play import simulate_int_states
+from src.analysis.utils_trajectory_cycles import compact_trajectories_from_tables
+from src.library.utils_compact_trajectories import concatenate_trajectories
+from src.library.utils_dtypes import cast_checked
+from src.library.utils_dtypes import get_possible_prices
+from src.library.utils_dtypes import get_price_dtype
+from src.library.utils_q_table_archive import load_super_star_tuples
 from qpricesim.simulations.utils_simulation import (
     concatenate_new_price_state,
 )
-from qpricesim.simulations.utils_simulation import gen_possible_prices
-from qpricesim.simulations.utils_simulation import (
-    gen_price_combination_byte_mappings,
-)
-from qpricesim.simulations.utils_simulation import (
-    int_state_to_price_state,
-)
 from qpricesim.simulations.utils_simulation import (
     price_state_to_int_state,
 )
@@ -32,7 +44,12 @@ from qpricesim.simulations.utils_simulation import (
 
 
 def play_with_deviation(
-    parameter, all_agents, prices_to_int_dict, possible_prices, initial_price_state
+    parameter,
+    all_agents,
+    prices_to_int_dict,
+    possible_prices,
+    initial_price_state,
+    price_dtype=int,
 ):
     """
     Starting from the state of convergence the agents play in the market
@@ -48,6 +65,7 @@ def play_with_deviation(
         prices_to_int_dict (dict): Mapping dict from price to index states
         possible_prices (array): Array of possible prices
         initial_price_state (array): Price state in which the simulation starts.
+        price_dtype (numpy.dtype): dtype of the returned prices
 
     Returns:
         array: Array with all simulated prices states. First state is the
@@ -55,6 +73,28 @@ def play_with_deviation(
                Note that the array is of shape
                (parameter["total_periods"], n_agents).
     """
+    # Compiled path: Extract the tables once and simulate with the kernels.
+    # The deviation is one step on the price grid, which is one integer
+    # for all markets with a step size of one.
+    if utils_numba_kernels.USE_NUMBA:
+        market_tables = get_market_tables(
+            all_agents=all_agents,
+            possible_prices=possible_prices,
+            state_length=len(initial_price_state),
+        )
+        out_array = play_with_deviation_from_table(
+            parameter=parameter,
+            policy_table=market_tables["policy_table"],
+            transition_table=market_tables["transition_table"],
+            state_to_price_indices=market_tables["state_to_price_indices"],
+            price_indices_to_state=market_tables["price_indices_to_state"],
+            possible_prices=possible_prices,
+            initial_int_state=price_state_to_int_state(
+                price_state=initial_price_state, prices_to_int_dict=prices_to_int_dict
+            ),
+        )
+        return cast_checked(array=out_array, dtype=price_dtype)
+
     #  Periods before deviation + 1 deviation period + state of convergence
     periods_after_deviation = (
         parameter["total_periods"] - parameter["periods_before_deviation"] - 1 - 1
@@ -106,20 +146,171 @@ def play_with_deviation(
     out_array = np.vstack(
         (initial_price_state, price_seq_inital, deviation_price_state, price_seq_after)
     )
-    return out_array
+    return cast_checked(array=out_array, dtype=price_dtype)
 
 
-def sim_dev_no_dev(parameter_market, parameter_deviation, all_super_star_tuple):
+def play_with_deviation_from_table(
+    parameter,
+    policy_table,
+    transition_table,
+    state_to_price_indices,
+    price_indices_to_state,
+    possible_prices,
+    initial_int_state,
+):
+    """
+    Policy table counterpart to *play_with_deviation*. Starting from the state of
+    convergence the agents play in the market for a certain amount of periods.
+    Then, the first agent deviates by playing a price one step below the price
+    he would have played, if such a price exists. From this new deviation price
+    state, the agents continue playing using the learned limit strategies.
+
+    Args:
+        parameter (dict): Parameter for the deviation simulation
+        policy_table (array): Array with the price index each agent picks in each
+                              state. Shape is (n_agents, n_states).
+        transition_table (array): Next integer state for each integer state
+        state_to_price_indices (array): Price indices for each integer state
+        price_indices_to_state (array): Mapping from price indices to integer states
+        possible_prices (array): Array of possible prices
+        initial_int_state (integer): Integer state in which the simulation starts.
+
+    Returns:
+        array: Array with all simulated prices states. First state is the
+               state of convergence.
+               Note that the array is of shape
+               (parameter["total_periods"], n_agents).
+    """
+    n_agents = policy_table.shape[0]
+    periods_before_deviation = parameter["periods_before_deviation"]
+    #  Periods before deviation + 1 deviation period + state of convergence
+    periods_after_deviation = (
+        parameter["total_periods"] - periods_before_deviation - 1 - 1
+    )
+
+    int_states = np.empty(parameter["total_periods"], dtype=transition_table.dtype)
+    int_states[0] = initial_int_state
+
+    # Play rounds after the initial state and before the deviation
+    int_states[1 : periods_before_deviation + 1] = simulate_int_states(
+        transition_table=transition_table,
+        start_int_state=initial_int_state,
+        n_periods=periods_before_deviation,
+    )
+    int_state_before_deviation = int_states[periods_before_deviation]
+
+    # Take the price indices that would have been played and induce a deviation.
+    # Note that the agent can only deviate if a smaller prices exists.
+    deviation_price_indices = policy_table[:, int_state_before_deviation].copy()
+    if deviation_price_indices[0] > 0:
+        deviation_price_indices[0] -= 1
+    deviation_price_indices = np.concatenate(
+        (
+            state_to_price_indices[int_state_before_deviation, n_agents:],
+            deviation_price_indices,
+        )
+    )
+    int_state_deviation = price_indices_to_state[tuple(deviation_price_indices)]
+    int_states[periods_before_deviation + 1] = int_state_deviation
+
+    # Continue to play for the remaining periods
+    int_states[periods_before_deviation + 2 :] = simulate_int_states(
+        transition_table=transition_table,
+        start_int_state=int_state_deviation,
+        n_periods=periods_after_deviation,
+    )
+    return int_states_to_prices(
+        int_states=int_states,
+        state_to_price_indices=state_to_price_indices,
+        possible_prices=possible_prices,
+    )
+
+
+def play_with_deviation_batched(
+    parameter,
+    policy_tables,
+    state_to_price_indices,
+    price_indices_to_state,
+    possible_prices,
+    initial_int_states,
+):
+    """
+    Batched counterpart to *play_with_deviation_from_table*. All markets are
+    simulated in lockstep, such that the number of Python iterations only
+    depends on the number of periods. This is the baseline scenario of
+    *play_deviation_scenarios*.
+
+    Args:
+        parameter (dict): Parameter for the deviation simulation
+        policy_tables (array): Array with the price index each agent picks in each
+                               state for each market.
+                               Shape is (n_markets, n_agents, n_states).
+        state_to_price_indices (array): Price indices for each integer state
+        price_indices_to_state (array): Mapping from price indices to integer states
+        possible_prices (array): Array of possible prices
+        initial_int_states (array): Integer states in which the simulation starts.
+                                    Shape is (n_markets,).
+
+    Returns:
+        array: Array with all simulated prices states. First state is the
+               state of convergence.
+               Note that the array is of shape
+               (n_markets, parameter["total_periods"], n_agents).
+    """
+    baseline_scenario = {
+        "periods_before_deviation": parameter["periods_before_deviation"]
+    }
+    return play_deviation_scenarios(
+        scenarios=[baseline_scenario],
+        total_periods=parameter["total_periods"],
+        policy_tables=policy_tables,
+        state_to_price_indices=state_to_price_indices,
+        price_indices_to_state=price_indices_to_state,
+        possible_prices=possible_prices,
+        initial_int_states=initial_int_states,
+    )[0]
+
+
+def _sim_dev_no_dev_shard(super_star_tuples, parameter_market, parameter_deviation):
+    """
+    Run *sim_dev_no_dev* on a shard of markets in a worker process.
+
+    Returns:
+        dict: Dict with the arrays with ('deviation') and without ('no_deviation')
+              deviation.
+    """
+    array_no_deviation_simulations, array_deviation_simulations = sim_dev_no_dev(
+        parameter_market=parameter_market,
+        parameter_deviation=parameter_deviation,
+        all_super_star_tuple=super_star_tuples,
+    )
+    out_dict = {}
+    out_dict["no_deviation"] = array_no_deviation_simulations
+    out_dict["deviation"] = array_deviation_simulations
+    return out_dict
+
+
+def sim_dev_no_dev(
+    parameter_market,
+    parameter_deviation,
+    all_super_star_tuple,
+    batched=True,
+    n_workers=1,
+):
     """
     Run the entire simulation for all markets with and without deviation.
 
     Args:
-        parameter_market (dict): Parameter as explained somewhere else TODO
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
         parameter_deviation (dict): Parameter for the deviation simulation
         all_super_star_tuple (list): List of tuples, where each tuple is one
                                      market upon convergence.
                                      (state of convergence,
                                      List with QLearningAgents)
+        batched (bool): If True, all markets are simulated in lockstep.
+                        Otherwise, one market after the other is simulated.
+        n_workers (integer): Number of worker processes over which the markets
+                             are sharded. If None, all available cores are used.
 
     Returns:
         tuple: Two arrays with the outputs from the simulations over
@@ -133,43 +324,94 @@ def sim_dev_no_dev(parameter_market, parameter_deviation, all_super_star_tuple):
     total_periods = parameter_deviation["total_periods"]
     n_agents = parameter_market["n_agent"]
 
-    # Generate the translation dicts
-    prices_to_int_dict, int_to_prices_dict = gen_price_combination_byte_mappings(
+    if n_workers != 1:
+        price_dtype = get_price_dtype(parameter=parameter_market)
+        out_dict = run_sharded(
+            function=_sim_dev_no_dev_shard,
+            items=all_super_star_tuple,
+            output_shapes={
+                "no_deviation": ((total_periods, n_agents), price_dtype),
+                "deviation": ((total_periods, n_agents), price_dtype),
+            },
+            n_workers=n_workers,
+            parameter_market=parameter_market,
+            parameter_deviation=parameter_deviation,
+        )
+        return out_dict["no_deviation"], out_dict["deviation"]
+
+    # Generate the translation arrays
+    possible_prices = get_possible_prices(parameter=parameter_market)
+    state_to_price_indices, price_indices_to_state = gen_state_index_arrays(
         parameter=parameter_market
     )
-    possible_prices = gen_possible_prices(parameter=parameter_market)
+    n_states = state_to_price_indices.shape[0]
 
     n_super_star_simulations = len(all_super_star_tuple)
 
+    if batched:
+        all_states_of_conv, all_markets = zip(*all_super_star_tuple)
+        initial_int_states = np.array(all_states_of_conv, dtype=int)
+        policy_tables = get_policy_tables(all_markets=all_markets, n_states=n_states)
+        transition_tables = get_transition_table(
+            policy_table=policy_tables,
+            state_to_price_indices=state_to_price_indices,
+            price_indices_to_state=price_indices_to_state,
+        )
+        array_deviation_simulations = play_with_deviation_batched(
+            parameter=parameter_deviation,
+            policy_tables=policy_tables,
+            state_to_price_indices=state_to_price_indices,
+            price_indices_to_state=price_indices_to_state,
+            possible_prices=possible_prices,
+            initial_int_states=initial_int_states,
+        )
+        array_no_deviation_simulations = play_without_deviation_batched(
+            parameter=parameter_deviation,
+            transition_tables=transition_tables,
+            state_to_price_indices=state_to_price_indices,
+            possible_prices=possible_prices,
+            initial_int_states=initial_int_states,
+        )
+        return array_no_deviation_simulations, array_deviation_simulations
+
     # Initialize the output arrays
     array_deviation_simulations = np.empty(
-        (n_super_star_simulations, total_periods, n_agents), dtype=int
+        (n_super_star_simulations, total_periods, n_agents),
+        dtype=possible_prices.dtype,
     )
     array_no_deviation_simulations = np.empty(
-        (n_super_star_simulations, total_periods, n_agents), dtype=int
+        (n_super_star_simulations, total_periods, n_agents),
+        dtype=possible_prices.dtype,
     )
 
     # Loop over all markets and simulate the prices with and without
     # deviation as specified in the settings.
+    # The greedy policies are extracted once per market such that the
+    # simulation itself only consists of array lookups.
     for ix_tuple, super_star_tuple in enumerate(all_super_star_tuple):
         state_of_conv, all_agents = super_star_tuple
-        price_state_of_conv = int_state_to_price_state(
-            int_state=state_of_conv, int_to_prices_dict=int_to_prices_dict
+        policy_table = get_policy_table(all_agents=all_agents, n_states=n_states)
+        transition_table = get_transition_table(
+            policy_table=policy_table,
+            state_to_price_indices=state_to_price_indices,
+            price_indices_to_state=price_indices_to_state,
         )
 
-        price_seq_deviation = play_with_deviation(
+        price_seq_deviation = play_with_deviation_from_table(
             parameter=parameter_deviation,
-            all_agents=all_agents,
-            prices_to_int_dict=prices_to_int_dict,
+            policy_table=policy_table,
+            transition_table=transition_table,
+            state_to_price_indices=state_to_price_indices,
+            price_indices_to_state=price_indices_to_state,
             possible_prices=possible_prices,
-            initial_price_state=price_state_of_conv,
+            initial_int_state=state_of_conv,
         )
-        price_seq_no_deviation = play_without_deviation(
+        price_seq_no_deviation = play_without_deviation_from_table(
             parameter=parameter_deviation,
-            all_agents=all_agents,
-            prices_to_int_dict=prices_to_int_dict,
+            transition_table=transition_table,
+            state_to_price_indices=state_to_price_indices,
             possible_prices=possible_prices,
-            initial_price_state=price_state_of_conv,
+            initial_int_state=state_of_conv,
         )
 
         array_deviation_simulations[ix_tuple, :, :] = price_seq_deviation
@@ -177,8 +419,111 @@ def sim_dev_no_dev(parameter_market, parameter_deviation, all_super_star_tuple):
     return array_no_deviation_simulations, array_deviation_simulations
 
 
+def _sim_dev_no_dev_compact_shard(
+    super_star_tuples, parameter_market, parameter_deviation
+):
+    """
+    Run *sim_dev_no_dev_compact* on a shard of markets in a worker process.
+    """
+    return sim_dev_no_dev_compact(
+        parameter_market=parameter_market,
+        parameter_deviation=parameter_deviation,
+        all_super_star_tuple=super_star_tuples,
+    )
+
+
+def sim_dev_no_dev_compact(
+    parameter_market, parameter_deviation, all_super_star_tuple, n_workers=1
+):
+    """
+    Counterpart to *sim_dev_no_dev* that stores the trajectories as prefix plus
+    cycle. Only the periods up to the deviation are simulated, hence the cost
+    does not grow with *parameter_deviation["total_periods"]*.
+
+    Args:
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
+        parameter_deviation (dict): Parameter for the deviation simulation
+        all_super_star_tuple (list): List of tuples, where each tuple is one
+                                     market upon convergence.
+                                     (state of convergence,
+                                     List with QLearningAgents)
+        n_workers (integer): Number of worker processes over which the markets
+                             are sharded. If None, all available cores are used.
+
+    Returns:
+        tuple: Two CompactTrajectories of shape
+               (number of market, number of periods, number of agents)
+               without and with deviation (compact_no_deviation_simulations,
+               compact_deviation_simulations).
+    """
+    if n_workers != 1:
+        all_shard_results = map_shards(
+            function=_sim_dev_no_dev_compact_shard,
+            items=all_super_star_tuple,
+            n_workers=n_workers,
+            parameter_market=parameter_market,
+            parameter_deviation=parameter_deviation,
+        )
+        all_no_deviation_shards, all_deviation_shards = zip(*all_shard_results)
+        return (
+            concatenate_trajectories(all_trajectories=all_no_deviation_shards),
+            concatenate_trajectories(all_trajectories=all_deviation_shards),
+        )
+
+    possible_prices = get_possible_prices(parameter=parameter_market)
+    state_to_price_indices, price_indices_to_state = gen_state_index_arrays(
+        parameter=parameter_market
+    )
+    all_states_of_conv, all_markets = zip(*all_super_star_tuple)
+    initial_int_states = np.array(all_states_of_conv, dtype=int)
+    policy_tables = get_policy_tables(
+        all_markets=all_markets, n_states=state_to_price_indices.shape[0]
+    )
+    transition_tables = get_transition_table(
+        policy_table=policy_tables,
+        state_to_price_indices=state_to_price_indices,
+        price_indices_to_state=price_indices_to_state,
+    )
+
+    compact_no_deviation_simulations = compact_trajectories_from_tables(
+        transition_tables=transition_tables,
+        head_int_states=initial_int_states[:, np.newaxis],
+        n_periods=parameter_deviation["total_periods"],
+        state_to_price_indices=state_to_price_indices,
+        possible_prices=possible_prices,
+    )
+
+    # Simulate up to and including the period of the deviation. Afterwards
+    # the play follows the transition table again.
+    baseline_scenario = {
+        "periods_before_deviation": parameter_deviation["periods_before_deviation"]
+    }
+    deviation_head_int_states = simulate_deviation_scenarios(
+        scenarios=[baseline_scenario],
+        total_periods=parameter_deviation["periods_before_deviation"] + 2,
+        policy_tables=policy_tables,
+        state_to_price_indices=state_to_price_indices,
+        price_indices_to_state=price_indices_to_state,
+        possible_prices=possible_prices,
+        initial_int_states=initial_int_states,
+    )[0]
+    compact_deviation_simulations = compact_trajectories_from_tables(
+        transition_tables=transition_tables,
+        head_int_states=deviation_head_int_states,
+        n_periods=parameter_deviation["total_periods"],
+        state_to_price_indices=state_to_price_indices,
+        possible_prices=possible_prices,
+    )
+    return compact_no_deviation_simulations, compact_deviation_simulations
+
+
 def run_and_save_simulation(
-    n_agents, parameter_market, parameter_deviation, super_star_tuples
+    n_agents,
+    parameter_market,
+    parameter_deviation,
+    super_star_tuples,
+    n_workers=1,
+    compact_storage=False,
 ):
     """
     Load the needed data, run the simulation and save the simulation
@@ -186,19 +531,35 @@ def run_and_save_simulation(
 
     Args:
         n_agents (integer): Number of agents in the markets.
-        parameter_market (dict): Explained somewhere else TODO
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
         parameter_deviation (dict): Dictionary with the deviation simulation
                                     parameter.
         super_star_tuples (list): List of tuples, where each tuple is one
                                   market upon convergence.
                                   (state of convergence,
                                   List with QLearningAgents)
+        n_workers (integer): Number of worker processes. If None, all available
+                             cores are used.
+        compact_storage (bool): If True, the simulations are saved as
+                                CompactTrajectories instead of dense arrays.
     """
-    (array_no_deviation_simulations, array_deviation_simulations) = sim_dev_no_dev(
-        parameter_market=parameter_market,
-        parameter_deviation=parameter_deviation,
-        all_super_star_tuple=super_star_tuples,
-    )
+    if compact_storage:
+        (
+            array_no_deviation_simulations,
+            array_deviation_simulations,
+        ) = sim_dev_no_dev_compact(
+            parameter_market=parameter_market,
+            parameter_deviation=parameter_deviation,
+            all_super_star_tuple=super_star_tuples,
+            n_workers=n_workers,
+        )
+    else:
+        (array_no_deviation_simulations, array_deviation_simulations) = sim_dev_no_dev(
+            parameter_market=parameter_market,
+            parameter_deviation=parameter_deviation,
+            all_super_star_tuple=super_star_tuples,
+            n_workers=n_workers,
+        )
 
     with open(
         ppj("OUT_ANALYSIS", f"array_no_deviation_simulations_{n_agents}_agents.pickle"),
@@ -223,12 +584,15 @@ if __name__ == "__main__":
     with open(ppj("IN_MODEL_SPECS", "deviation_simulation.json")) as f:
         PARAMETER_DEVIATION = json.load(f)
 
-    with open(ppj("OUT_DATA", f"all_super_stars_{N_AGENTS}_agents.pickle"), "rb") as f:
-        SUPER_STAR_TUPLES = pickle.load(f)
+    SUPER_STAR_TUPLES = load_super_star_tuples(
+        archive_path=ppj("OUT_DATA", f"super_star_archive_{N_AGENTS}_agents.npz")
+    )
 
     run_and_save_simulation(
         n_agents=N_AGENTS,
         parameter_market=PARAMETER_MARKET,
         parameter_deviation=PARAMETER_DEVIATION,
         super_star_tuples=SUPER_STAR_TUPLES,
+        n_workers=PARAMETER_DEVIATION["n_workers"],
+        compact_storage=PARAMETER_DEVIATION["compact_storage"],
     )
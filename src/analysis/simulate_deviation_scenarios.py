@@ -0,0 +1,249 @@
+"""
+
+A module which simulates the market prices played by the
+agents starting from the states of convergence under a
+batch of deviation scenarios.
+
+With *compact_storage*, only the periods up to the last deviation are
+simulated and the trajectories are stored as prefix plus cycle. Hence, the
+cost does not grow with the number of periods.
+"""
+import json
+import pickle
+import sys
+
+import numpy as np
+
+from bld.project_paths import project_paths_join as ppj
+from src.analysis.utils_deviation_scenarios import play_deviation_scenarios
+from src.analysis.utils_deviation_scenarios import scenarios_to_arrays
+from src.analysis.utils_deviation_scenarios import simulate_deviation_scenarios
+from src.analysis.utils_parallel import map_shards
+from src.analysis.utils_parallel import run_sharded
+from src.analysis.utils_simulate_play import gen_state_index_arrays
+from src.analysis.utils_simulate_play import get_policy_tables
+from src.analysis.utils_simulate_play import get_transition_table
+from src.analysis.utils_trajectory_cycles import compact_trajectories_from_tables
+from src.library.utils_compact_trajectories import concatenate_trajectories
+from src.library.utils_dtypes import get_price_dtype
+from src.library.utils_dtypes import get_possible_prices
+from src.library.utils_q_table_archive import load_super_star_tuples
+
+
+def _sim_deviation_scenarios_shard(
+    super_star_tuples, parameter_market, parameter_scenarios
+):
+    """
+    Simulate all deviation scenarios for a shard of markets.
+
+    Args:
+        super_star_tuples (list): List of tuples, where each tuple is one
+                                  market upon convergence.
+                                  (state of convergence,
+                                  List with QLearningAgents)
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
+        parameter_scenarios (dict): Dictionary with the deviation scenarios
+                                    and the number of periods to simulate.
+
+    Returns:
+        dict: 'prices' -> Simulated prices with the markets on the first axis.
+              Shape is (n_markets, n_scenarios, total_periods, n_agents).
+    """
+    possible_prices = get_possible_prices(parameter=parameter_market)
+    state_to_price_indices, price_indices_to_state = gen_state_index_arrays(
+        parameter=parameter_market
+    )
+    all_states_of_conv, all_markets = zip(*super_star_tuples)
+    policy_tables = get_policy_tables(
+        all_markets=all_markets, n_states=state_to_price_indices.shape[0]
+    )
+    prices = play_deviation_scenarios(
+        scenarios=parameter_scenarios["scenarios"],
+        total_periods=parameter_scenarios["total_periods"],
+        policy_tables=policy_tables,
+        state_to_price_indices=state_to_price_indices,
+        price_indices_to_state=price_indices_to_state,
+        possible_prices=possible_prices,
+        initial_int_states=np.array(all_states_of_conv, dtype=int),
+    )
+    return {"prices": np.swapaxes(prices, 0, 1)}
+
+
+def sim_deviation_scenarios(
+    parameter_market, parameter_scenarios, all_super_star_tuple, n_workers=1
+):
+    """
+    Simulate the play of all markets under all deviation scenarios.
+
+    Args:
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
+        parameter_scenarios (dict): Dictionary with the deviation scenarios
+                                    and the number of periods to simulate.
+        all_super_star_tuple (list): List of tuples, where each tuple is one
+                                     market upon convergence.
+                                     (state of convergence,
+                                     List with QLearningAgents)
+        n_workers (integer): Number of worker processes. If None, all available
+                             cores are used.
+
+    Returns:
+        array: Simulated prices. First state is the state of convergence.
+               Shape is (n_scenarios, n_markets, total_periods, n_agents).
+    """
+    n_scenarios = len(parameter_scenarios["scenarios"])
+    item_shape = (
+        n_scenarios,
+        parameter_scenarios["total_periods"],
+        parameter_market["n_agent"],
+    )
+    out_dict = run_sharded(
+        function=_sim_deviation_scenarios_shard,
+        items=all_super_star_tuple,
+        output_shapes={
+            "prices": (item_shape, get_price_dtype(parameter=parameter_market))
+        },
+        n_workers=n_workers,
+        parameter_market=parameter_market,
+        parameter_scenarios=parameter_scenarios,
+    )
+    return np.swapaxes(out_dict["prices"], 0, 1)
+
+
+def _sim_deviation_scenarios_compact_shard(
+    super_star_tuples, parameter_market, parameter_scenarios
+):
+    """
+    Counterpart to *_sim_deviation_scenarios_shard* that stores the trajectories
+    as prefix plus cycle. Only the periods up to the last deviation are
+    simulated, afterwards the play follows the transition table of the market.
+
+    Args:
+        super_star_tuples (list): List of tuples, where each tuple is one
+                                  market upon convergence.
+                                  (state of convergence,
+                                  List with QLearningAgents)
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
+        parameter_scenarios (dict): Dictionary with the deviation scenarios
+                                    and the number of periods to simulate.
+
+    Returns:
+        CompactTrajectories: Simulated prices with the markets on the first axis.
+                             Shape is (n_markets, n_scenarios, total_periods, n_agents).
+    """
+    possible_prices = get_possible_prices(parameter=parameter_market)
+    state_to_price_indices, price_indices_to_state = gen_state_index_arrays(
+        parameter=parameter_market
+    )
+    all_states_of_conv, all_markets = zip(*super_star_tuples)
+    policy_tables = get_policy_tables(
+        all_markets=all_markets, n_states=state_to_price_indices.shape[0]
+    )
+    transition_tables = get_transition_table(
+        policy_table=policy_tables,
+        state_to_price_indices=state_to_price_indices,
+        price_indices_to_state=price_indices_to_state,
+    )
+
+    # Simulate up to and including the last deviation period of all scenarios.
+    scenario_arrays = scenarios_to_arrays(
+        scenarios=parameter_scenarios["scenarios"],
+        n_agents=parameter_market["n_agent"],
+        possible_prices=possible_prices,
+    )
+    n_head_periods = min(
+        int(np.max(scenario_arrays["last_period"])) + 1,
+        parameter_scenarios["total_periods"],
+    )
+    head_int_states = simulate_deviation_scenarios(
+        scenarios=parameter_scenarios["scenarios"],
+        total_periods=n_head_periods,
+        policy_tables=policy_tables,
+        state_to_price_indices=state_to_price_indices,
+        price_indices_to_state=price_indices_to_state,
+        possible_prices=possible_prices,
+        initial_int_states=np.array(all_states_of_conv, dtype=int),
+    )
+    return compact_trajectories_from_tables(
+        transition_tables=transition_tables,
+        head_int_states=np.swapaxes(head_int_states, 0, 1),
+        n_periods=parameter_scenarios["total_periods"],
+        state_to_price_indices=state_to_price_indices,
+        possible_prices=possible_prices,
+    )
+
+
+def sim_deviation_scenarios_compact(
+    parameter_market, parameter_scenarios, all_super_star_tuple, n_workers=1
+):
+    """
+    Counterpart to *sim_deviation_scenarios* that stores the trajectories as
+    prefix plus cycle. Note that the markets are on the first axis, as
+    CompactTrajectories are concatenated along it.
+
+    Args:
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
+        parameter_scenarios (dict): Dictionary with the deviation scenarios
+                                    and the number of periods to simulate.
+        all_super_star_tuple (list): List of tuples, where each tuple is one
+                                     market upon convergence.
+                                     (state of convergence,
+                                     List with QLearningAgents)
+        n_workers (integer): Number of worker processes. If None, all available
+                             cores are used.
+
+    Returns:
+        CompactTrajectories: Simulated prices. First state is the state of
+                             convergence. Shape is
+                             (n_markets, n_scenarios, total_periods, n_agents).
+    """
+    return concatenate_trajectories(
+        all_trajectories=map_shards(
+            function=_sim_deviation_scenarios_compact_shard,
+            items=all_super_star_tuple,
+            n_workers=n_workers,
+            parameter_market=parameter_market,
+            parameter_scenarios=parameter_scenarios,
+        )
+    )
+
+
+if __name__ == "__main__":
+    N_AGENTS = sys.argv[1]
+
+    with open(
+        ppj("IN_SIMULATION_PARAMETER", f"parameter_{N_AGENTS}_agent_base.json")
+    ) as f:
+        PARAMETER_MARKET = json.load(f)
+    with open(ppj("IN_MODEL_SPECS", "deviation_scenarios.json")) as f:
+        PARAMETER_SCENARIOS = json.load(f)
+
+    SUPER_STAR_TUPLES = load_super_star_tuples(
+        archive_path=ppj("OUT_DATA", f"super_star_archive_{N_AGENTS}_agents.npz")
+    )
+
+    if PARAMETER_SCENARIOS["compact_storage"]:
+        ARRAY_DEVIATION_SCENARIOS = sim_deviation_scenarios_compact(
+            parameter_market=PARAMETER_MARKET,
+            parameter_scenarios=PARAMETER_SCENARIOS,
+            all_super_star_tuple=SUPER_STAR_TUPLES,
+            n_workers=PARAMETER_SCENARIOS["n_workers"],
+        )
+    else:
+        ARRAY_DEVIATION_SCENARIOS = sim_deviation_scenarios(
+            parameter_market=PARAMETER_MARKET,
+            parameter_scenarios=PARAMETER_SCENARIOS,
+            all_super_star_tuple=SUPER_STAR_TUPLES,
+            n_workers=PARAMETER_SCENARIOS["n_workers"],
+        )
+
+    with open(
+        ppj("OUT_ANALYSIS", f"array_deviation_scenarios_{N_AGENTS}_agents.pickle"),
+        "wb",
+    ) as f:
+        pickle.dump(
+            {
+                "scenarios": PARAMETER_SCENARIOS["scenarios"],
+                "prices": ARRAY_DEVIATION_SCENARIOS,
+            },
+            f,
+        )
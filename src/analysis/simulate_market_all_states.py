@@ -11,73 +11,248 @@ import numpy as np
 
 from bld.project_paths import project_paths as pp
 from bld.project_paths import project_paths_join as ppj
-from src.analysis.utils_simulate_play import play_without_deviation
-from qpricesim.simulations.utils_simulation import gen_possible_prices
-from qpricesim.simulations.utils_simulation import (
-    gen_price_combination_byte_mappings,
-)
-from qpricesim.simulations.utils_simulation import (
-    int_state_to_price_state,
-)
+from src.analysis.utils_parallel import map_shards
+from src.analysis.utils_parallel import run_sharded
+from src.analysis.utils_simulate_play import gen_state_index_arrays
+from src.analysis.utils_simulate_play import get_policy_tables
+from src.analysis.utils_simulate_play import get_transition_table
+from src.analysis.utils_simulate_play import int_states_to_prices
+from src.analysis.utils_state_graph import analyse_state_graph
+from src.analysis.utils_state_graph import simulate_all_int_states
+from src.analysis.utils_trajectory_cycles import compact_trajectories_from_tables
+from src.library.utils_compact_trajectories import concatenate_trajectories
+from src.library.utils_dtypes import get_possible_prices
+from src.library.utils_dtypes import get_price_dtype
+from src.library.utils_q_table_archive import load_super_star_tuples
+from src.library.utils_state_encoding import get_n_states
 
 
+def get_all_transition_tables(super_star_markets, parameter_market):
+    """
+    Build the transition table of each market in *super_star_markets*.
 
-def play_from_all_states(
+    Args:
+        super_star_markets (list): List of all simulated super star markets with all agents.
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
+
+    Returns:
+        tuple: - Array with the transition tables. Shape is (n_markets, n_states).
+               - Array with the price indices for each integer state.
+               - Array of possible prices in the market.
+    """
+    possible_prices = get_possible_prices(parameter=parameter_market)
+    state_to_price_indices, price_indices_to_state = gen_state_index_arrays(
+        parameter=parameter_market
+    )
+    policy_tables = get_policy_tables(
+        all_markets=super_star_markets, n_states=state_to_price_indices.shape[0]
+    )
+    transition_tables = get_transition_table(
+        policy_table=policy_tables,
+        state_to_price_indices=state_to_price_indices,
+        price_indices_to_state=price_indices_to_state,
+    )
+    return transition_tables, state_to_price_indices, possible_prices
+
+
+def _analyse_all_states_shard(super_star_markets, parameter_market):
+    """
+    Run *analyse_all_states* on a shard of markets in a worker process.
+    """
+    return analyse_all_states(
+        super_star_markets=super_star_markets, parameter_market=parameter_market
+    )
+
+
+def _play_from_all_states_shard(
     super_star_markets, n_agents, parameter_deviation, parameter_market
 ):
     """
+    Run *play_from_all_states* on a shard of markets in a worker process.
+    """
+    out_dict = {}
+    out_dict["prices"] = play_from_all_states(
+        super_star_markets=super_star_markets,
+        n_agents=n_agents,
+        parameter_deviation=parameter_deviation,
+        parameter_market=parameter_market,
+    )
+    return out_dict
+
+
+def _play_from_all_states_compact_shard(
+    super_star_markets, parameter_deviation, parameter_market
+):
+    """
+    Run *play_from_all_states_compact* on a shard of markets in a worker process.
+    """
+    return play_from_all_states_compact(
+        super_star_markets=super_star_markets,
+        parameter_deviation=parameter_deviation,
+        parameter_market=parameter_market,
+    )
+
+
+def analyse_all_states(super_star_markets, parameter_market, n_workers=1):
+    """
+
+    For each market in the list *super_star_markets* analyse where
+    the market play ends up starting from all possible states. We do
+    this to test how sensitive the agents are to the initial
+    state.
+
+    In contrast to *play_from_all_states* nothing is simulated period by
+    period. Instead, all results are derived from the state graph of each
+    market.
+
+    Args:
+        super_star_markets (list): List of all simulated super star markets with all agents.
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
+        n_workers (integer): Number of worker processes over which the markets
+                             are sharded. If None, all available cores are used.
+
+    Returns:
+        dict: Dictionary with arrays of shape (n_markets, n_states) as returned
+              by *analyse_state_graph*.
+    """
+    if n_workers != 1:
+        n_states = get_n_states(parameter=parameter_market)
+        return run_sharded(
+            function=_analyse_all_states_shard,
+            items=super_star_markets,
+            output_shapes={
+                "cycle_id": ((n_states,), int),
+                "on_cycle": ((n_states,), bool),
+                "cycle_length": ((n_states,), int),
+                "time_to_absorption": ((n_states,), int),
+                "n_cycles": ((), int),
+            },
+            n_workers=n_workers,
+            parameter_market=parameter_market,
+        )
+
+    transition_tables, _, _ = get_all_transition_tables(
+        super_star_markets=super_star_markets, parameter_market=parameter_market
+    )
+    return analyse_state_graph(transition_tables=transition_tables)
+
+
+def play_from_all_states(
+    super_star_markets, n_agents, parameter_deviation, parameter_market, n_workers=1
+):
+    """
 
     For each market in the list *super_star_markets* simulate
     the market play starting from all possible states. We do
     this to test how sensitive the agents are to the initial
     state.
 
+    Note that the dense output array is large. Use *analyse_all_states*
+    if only the long run behaviour is of interest.
+
     Args:
         super_star_markets (list): List of all simulated super star markets with all agents.
         n_agents (integer): Number of agents in the market.
         parameter_deviation (dict): Parameter for the deviation simulation. Note that we use it
                                     here to get the number of periods we should simulate.
-        parameter_market (dict): Explained somewhere else TODO
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
+        n_workers (integer): Number of worker processes over which the markets
+                             are sharded. If None, all available cores are used.
 
     Returns:
         array: Array with all play simulations
                Shape: (n_markets, n_states, n_periods, n_agents)
     """
+    if n_workers != 1:
+        n_states = get_n_states(parameter=parameter_market)
+        n_periods = parameter_deviation["total_periods"]
+        out_dict = run_sharded(
+            function=_play_from_all_states_shard,
+            items=super_star_markets,
+            output_shapes={
+                "prices": (
+                    (n_states, n_periods, n_agents),
+                    get_price_dtype(parameter=parameter_market),
+                )
+            },
+            n_workers=n_workers,
+            n_agents=n_agents,
+            parameter_deviation=parameter_deviation,
+            parameter_market=parameter_market,
+        )
+        return out_dict["prices"]
 
-    possible_prices = gen_possible_prices(parameter=parameter_market)
-    prices_to_int_dict, int_to_prices_dict = gen_price_combination_byte_mappings(
-        parameter=parameter_market
+    (
+        transition_tables,
+        state_to_price_indices,
+        possible_prices,
+    ) = get_all_transition_tables(
+        super_star_markets=super_star_markets, parameter_market=parameter_market
+    )
+    all_int_states = simulate_all_int_states(
+        transition_tables=transition_tables,
+        n_periods=parameter_deviation["total_periods"],
+    )
+    return int_states_to_prices(
+        int_states=all_int_states,
+        state_to_price_indices=state_to_price_indices,
+        possible_prices=possible_prices,
     )
-    all_int_states = int_to_prices_dict.keys()
 
-    n_states = len(all_int_states)
-    n_markets = len(super_star_markets)
-    n_periods = parameter_deviation["total_periods"]
 
-    all_state_simulations = np.empty(
-        (n_markets, n_states, n_periods, n_agents), dtype=int
-    )
-    # Loop over all states and markets for the play simulation
-    for current_int_state in all_int_states:
-        for i_current_market, current_market in enumerate(super_star_markets):
-            current_price_state = int_state_to_price_state(
-                int_state=current_int_state, int_to_prices_dict=int_to_prices_dict
-            )
-            played_prices = play_without_deviation(
-                parameter=parameter_deviation,
-                all_agents=current_market,
-                prices_to_int_dict=prices_to_int_dict,
-                possible_prices=possible_prices,
-                initial_price_state=current_price_state,
+def play_from_all_states_compact(
+    super_star_markets, parameter_deviation, parameter_market, n_workers=1
+):
+    """
+    Counterpart to *play_from_all_states* that stores the trajectories as
+    prefix plus cycle instead of a dense array.
+
+    Args:
+        super_star_markets (list): List of all simulated super star markets with all agents.
+        parameter_deviation (dict): Parameter for the deviation simulation. Note that we use it
+                                    here to get the number of periods we should simulate.
+        parameter_market (dict): Market specs as defined in *utils_state_encoding*
+        n_workers (integer): Number of worker processes over which the markets
+                             are sharded. If None, all available cores are used.
+
+    Returns:
+        CompactTrajectories: All play simulations
+                             Shape: (n_markets, n_states, n_periods, n_agents)
+    """
+    if n_workers != 1:
+        return concatenate_trajectories(
+            all_trajectories=map_shards(
+                function=_play_from_all_states_compact_shard,
+                items=super_star_markets,
+                n_workers=n_workers,
+                parameter_deviation=parameter_deviation,
+                parameter_market=parameter_market,
             )
-            all_state_simulations[
-                i_current_market, current_int_state, :, :
-            ] = played_prices
-    return all_state_simulations
+        )
+
+    (
+        transition_tables,
+        state_to_price_indices,
+        possible_prices,
+    ) = get_all_transition_tables(
+        super_star_markets=super_star_markets, parameter_market=parameter_market
+    )
+    n_markets, n_states = transition_tables.shape
+    head_int_states = np.broadcast_to(
+        np.arange(n_states)[:, np.newaxis], (n_markets, n_states, 1)
+    )
+    return compact_trajectories_from_tables(
+        transition_tables=transition_tables,
+        head_int_states=head_int_states,
+        n_periods=parameter_deviation["total_periods"],
+        state_to_price_indices=state_to_price_indices,
+        possible_prices=possible_prices,
+    )
 
 
 if __name__ == "__main__":
     N_AGENTS = sys.argv[1]
+    OUTPUT_TYPE = sys.argv[2]
 
     with open(
         ppj("IN_SIMULATION_PARAMETER", f"parameter_super_star_{N_AGENTS}_agent.json")
@@ -87,19 +262,49 @@ if __name__ == "__main__":
     with open(ppj("IN_MODEL_SPECS", "deviation_simulation.json")) as f:
         PARAMETER_DEVIATION = json.load(f)
 
-    with open(ppj("OUT_DATA", f"all_super_stars_{N_AGENTS}_agents.pickle"), "rb") as f:
-        super_star_tuples = pickle.load(f)
+    super_star_tuples = load_super_star_tuples(
+        archive_path=ppj("OUT_DATA", f"super_star_archive_{N_AGENTS}_agents.npz")
+    )
 
     _, all_super_star_markets = zip(*super_star_tuples)
 
-    array_all_state_simulations_results = play_from_all_states(
-        super_star_markets=all_super_star_markets,
-        n_agents=int(N_AGENTS),
-        parameter_deviation=PARAMETER_DEVIATION,
-        parameter_market=PARAMETER_MARKET,
-    )
-    with open(
-        ppj("OUT_ANALYSIS", f"array_all_state_simulations_{N_AGENTS}_agents.pickle"),
-        "wb",
-    ) as f:
-        pickle.dump(array_all_state_simulations_results, f)
+    if OUTPUT_TYPE == "graph":
+        state_graph_results = analyse_all_states(
+            super_star_markets=all_super_star_markets,
+            parameter_market=PARAMETER_MARKET,
+            n_workers=PARAMETER_DEVIATION["n_workers"],
+        )
+        with open(
+            ppj("OUT_ANALYSIS", f"all_state_graphs_{N_AGENTS}_agents.pickle"), "wb"
+        ) as f:
+            pickle.dump(state_graph_results, f)
+    elif PARAMETER_DEVIATION["compact_storage"]:
+        compact_all_state_simulations_results = play_from_all_states_compact(
+            super_star_markets=all_super_star_markets,
+            parameter_deviation=PARAMETER_DEVIATION,
+            parameter_market=PARAMETER_MARKET,
+            n_workers=PARAMETER_DEVIATION["n_workers"],
+        )
+        with open(
+            ppj(
+                "OUT_ANALYSIS", f"array_all_state_simulations_{N_AGENTS}_agents.pickle"
+            ),
+            "wb",
+        ) as f:
+            pickle.dump(compact_all_state_simulations_results, f)
+    else:
+        # Dense array with all simulated prices as used before.
+        array_all_state_simulations_results = play_from_all_states(
+            super_star_markets=all_super_star_markets,
+            n_agents=int(N_AGENTS),
+            parameter_deviation=PARAMETER_DEVIATION,
+            parameter_market=PARAMETER_MARKET,
+            n_workers=PARAMETER_DEVIATION["n_workers"],
+        )
+        with open(
+            ppj(
+                "OUT_ANALYSIS", f"array_all_state_simulations_{N_AGENTS}_agents.pickle"
+            ),
+            "wb",
+        ) as f:
+            pickle.dump(array_all_state_simulations_results, f)
@@ -0,0 +1,182 @@
+"""
+
+A collection of functions to compute the exact best response of each agent
+to the learned greedy strategies of the other agents.
+
+If all other agents play their greedy strategies, the next state only depends
+on the current state and the price of the best responding agent (see
+*utils_simulate_play.get_deviation_transition_tables*). Hence, the best
+response solves the Bellman equation
+
+    W*(x) = r(x) + discount_rate * max_a W*(D(x, a))
+
+with the deviation transition table D. The equation is solved for all markets
+and agents at once. A few sweeps of value iteration, which are cheap array
+operations, give a nearly optimal strategy. The strategy is then improved by
+policy iteration with the exact policy evaluation of *utils_policy_evaluation*
+until it is optimal, such that the reported values are exact.
+"""
+import numpy as np
+
+from src.analysis.utils_policy_evaluation import solve_policy_values
+
+
+def calc_continuation_values(state_values, deviation_transition_tables):
+    """
+    Look up the value of the state that is reached for each agent, state and
+    price of the agent.
+
+    Args:
+        state_values (array): Value of each agent in each state.
+                              Shape is (n_markets, n_agents, n_states).
+        deviation_transition_tables (array): Next integer state for each agent,
+                                             state and price of this agent.
+                                             Shape is
+                                             (n_markets, n_agents, n_states, n_prices).
+
+    Returns:
+        array: Continuation values. Shape is (n_markets, n_agents, n_states, n_prices).
+    """
+    n_markets, n_agents, _, _ = deviation_transition_tables.shape
+    return state_values[
+        np.arange(n_markets)[:, np.newaxis, np.newaxis, np.newaxis],
+        np.arange(n_agents)[np.newaxis, :, np.newaxis, np.newaxis],
+        deviation_transition_tables,
+    ]
+
+
+def evaluate_best_response_tables(
+    best_response_tables, deviation_transition_tables, state_rewards, discount_rate
+):
+    """
+    Calculate the exact value of each agent if the agent plays the prices in
+    *best_response_tables* and all other agents play their greedy strategies.
+
+    Args:
+        best_response_tables (array): Price index of each agent in each state.
+                                      Shape is (n_markets, n_agents, n_states).
+        deviation_transition_tables (array): Next integer state for each agent,
+                                             state and price of this agent.
+                                             Shape is
+                                             (n_markets, n_agents, n_states, n_prices).
+        state_rewards (array): Rewards in each integer state.
+                               Shape is (n_states, n_agents).
+        discount_rate (float): Discount rate
+
+    Returns:
+        array: Values. Shape is (n_markets, n_agents, n_states).
+    """
+    n_markets, n_agents, n_states, _ = deviation_transition_tables.shape
+    transition_tables = np.take_along_axis(
+        deviation_transition_tables, best_response_tables[..., np.newaxis], axis=-1
+    )[..., 0]
+
+    # Each (market, agent) pair is one block of the system with the rewards of
+    # the responding agent on the right hand side.
+    values = solve_policy_values(
+        transition_tables=transition_tables.reshape(n_markets * n_agents, n_states),
+        rewards=np.broadcast_to(
+            state_rewards.T, (n_markets, n_agents, n_states)
+        ).ravel(),
+        discount_rate=discount_rate,
+    )
+    return values.reshape(n_markets, n_agents, n_states)
+
+
+def solve_best_responses(
+    deviation_transition_tables,
+    state_rewards,
+    discount_rate,
+    initial_values=None,
+    n_value_iterations=20,
+    tolerance=1e-8,
+):
+    """
+    Calculate the best response of each agent to the greedy strategies of the
+    other agents in each market.
+
+    Value iteration is run for at most *n_value_iterations* sweeps and stopped
+    early once the greedy strategy is guaranteed to be *tolerance*-optimal.
+    Afterwards, the greedy strategy is improved by policy iteration until no
+    price is better than the chosen one by more than *tolerance*. As policy
+    iteration terminates in finitely many steps, the number of value
+    iterations only affects the run time and not the result.
+
+    Args:
+        deviation_transition_tables (array): Next integer state for each agent,
+                                             state and price of this agent.
+                                             Shape is
+                                             (n_markets, n_agents, n_states, n_prices).
+        state_rewards (array): Rewards in each integer state.
+                               Shape is (n_states, n_agents).
+        discount_rate (float): Discount rate
+        initial_values (array): Values to start the value iteration from, e.g.
+                                the values of the learned strategies.
+                                Shape is (n_markets, n_agents, n_states).
+                                Defaults to the values of receiving the
+                                reward of each state forever.
+        n_value_iterations (integer): Maximal number of value iterations
+        tolerance (float): Value differences up to this value are considered
+                           as numerical noise.
+
+    Returns:
+        dict: Dictionary with the following arrays:
+              'best_response_tables' -> Price index of the best response of
+                                        each agent in each state.
+                                        Shape is (n_markets, n_agents, n_states).
+              'values' -> Exact value of the best response of each agent in
+                          each state. Shape is (n_markets, n_agents, n_states).
+    """
+    n_markets, n_agents, n_states, _ = deviation_transition_tables.shape
+    rewards = np.broadcast_to(state_rewards.T, (n_markets, n_agents, n_states))
+    stopping_threshold = tolerance * (1 - discount_rate) / discount_rate
+
+    if initial_values is None:
+        values = rewards / (1 - discount_rate)
+    else:
+        values = initial_values
+    for _ in range(n_value_iterations):
+        continuation_values = calc_continuation_values(
+            state_values=values,
+            deviation_transition_tables=deviation_transition_tables,
+        )
+        new_values = rewards + discount_rate * continuation_values.max(axis=-1)
+        converged = np.max(np.abs(new_values - values)) < stopping_threshold
+        values = new_values
+        if converged:
+            break
+
+    best_response_tables = np.argmax(
+        calc_continuation_values(
+            state_values=values,
+            deviation_transition_tables=deviation_transition_tables,
+        ),
+        axis=-1,
+    )
+    while True:
+        values = evaluate_best_response_tables(
+            best_response_tables=best_response_tables,
+            deviation_transition_tables=deviation_transition_tables,
+            state_rewards=state_rewards,
+            discount_rate=discount_rate,
+        )
+        continuation_values = calc_continuation_values(
+            state_values=values,
+            deviation_transition_tables=deviation_transition_tables,
+        )
+        current_continuation_values = np.take_along_axis(
+            continuation_values, best_response_tables[..., np.newaxis], axis=-1
+        )[..., 0]
+        improvable = (
+            continuation_values.max(axis=-1) > current_continuation_values + tolerance
+        )
+        if not np.any(improvable):
+            break
+        best_response_tables = np.where(
+            improvable, np.argmax(continuation_values, axis=-1), best_response_tables
+        )
+
+    out_dict = {}
+    out_dict["best_response_tables"] = best_response_tables
+    out_dict["values"] = values
+    return out_dict
@@ -0,0 +1,211 @@
+"""
+
+A module to simulate the market play under a batch of exogenous deviation
+scenarios at once.
+
+A deviation scenario is a dict with the following keys:
+
+    periods_before_deviation (integer): Number of periods played after the state
+                                        of convergence before the first deviation.
+    deviating_agents (list): Indices of the agents that deviate together.
+                             Defaults to [0].
+    deviation_periods (integer): Number of consecutive periods in which the agents
+                                 deviate. Defaults to 1.
+    deviation_step (integer): Number of price steps below the price the agent
+                              would have played. Negative values are price
+                              increases. Prices are clipped to the price grid.
+                              Defaults to 1.
+    deviation_price (float): Price the deviating agents play instead. Overrides
+                             *deviation_step* and must be part of the price grid.
+
+The scenario {"periods_before_deviation": p} is the deviation of
+*play_with_deviation*.
+"""
+import numpy as np
+
+from src.analysis.utils_simulate_play import int_states_to_prices
+from src.library.utils_state_encoding import prices_to_price_indices
+
+
+def scenarios_to_arrays(scenarios, n_agents, possible_prices):
+    """
+    Transform a list of deviation scenarios to arrays.
+
+    Args:
+        scenarios (list): List of deviation scenario dicts as described in the
+                          module docstring.
+        n_agents (integer): Number of agents in the market
+        possible_prices (array): Array of possible prices in the market
+
+    Returns:
+        dict: Dictionary with arrays of length n_scenarios:
+              'first_period' -> Period of the first deviation
+              'last_period' -> Period of the last deviation
+              'agent_mask' -> Bool array of shape (n_scenarios, n_agents)
+              'deviation_step' -> Price steps below the intended price
+              'deviation_price_index' -> Price index to play or -1 if the
+                                         deviation is given by a step.
+    """
+    n_scenarios = len(scenarios)
+    scenario_arrays = {}
+    scenario_arrays["first_period"] = np.empty(n_scenarios, dtype=int)
+    scenario_arrays["last_period"] = np.empty(n_scenarios, dtype=int)
+    scenario_arrays["agent_mask"] = np.zeros((n_scenarios, n_agents), dtype=bool)
+    scenario_arrays["deviation_step"] = np.zeros(n_scenarios, dtype=int)
+    scenario_arrays["deviation_price_index"] = np.full(n_scenarios, -1, dtype=int)
+
+    for ix_scenario, scenario in enumerate(scenarios):
+        if "deviation_step" in scenario and "deviation_price" in scenario:
+            raise ValueError(
+                "A scenario can either have a deviation_step or a deviation_price."
+            )
+        # The state of convergence is period 0, hence the first deviation is
+        # played in period periods_before_deviation + 1.
+        first_period = scenario["periods_before_deviation"] + 1
+        scenario_arrays["first_period"][ix_scenario] = first_period
+        scenario_arrays["last_period"][ix_scenario] = (
+            first_period + scenario.get("deviation_periods", 1) - 1
+        )
+        scenario_arrays["agent_mask"][
+            ix_scenario, scenario.get("deviating_agents", [0])
+        ] = True
+        if "deviation_price" in scenario:
+            scenario_arrays["deviation_price_index"][
+                ix_scenario
+            ] = prices_to_price_indices(
+                prices=scenario["deviation_price"], possible_prices=possible_prices
+            )
+        else:
+            scenario_arrays["deviation_step"][ix_scenario] = scenario.get(
+                "deviation_step", 1
+            )
+    return scenario_arrays
+
+
+def simulate_deviation_scenarios(
+    scenarios,
+    total_periods,
+    policy_tables,
+    state_to_price_indices,
+    price_indices_to_state,
+    possible_prices,
+    initial_int_states,
+):
+    """
+    Simulate the integer states of all markets under all deviation scenarios
+    in one vectorized pass. In each period all (scenario, market) pairs are
+    advanced at once.
+
+    Args:
+        scenarios (list): List of deviation scenario dicts as described in the
+                          module docstring.
+        total_periods (integer): Number of periods including the state of
+                                 convergence.
+        policy_tables (array): Array with the price index each agent picks in each
+                               state for each market.
+                               Shape is (n_markets, n_agents, n_states).
+        state_to_price_indices (array): Price indices for each integer state
+        price_indices_to_state (array): Mapping from price indices to integer states
+        possible_prices (array): Array of possible prices
+        initial_int_states (array): Integer states in which the simulation starts.
+                                    Shape is (n_markets,).
+
+    Returns:
+        array: Array with all simulated integer states. First state is the
+               state of convergence. Shape is
+               (n_scenarios, n_markets, total_periods).
+    """
+    n_markets, n_agents, _ = policy_tables.shape
+    n_scenarios = len(scenarios)
+    n_prices = len(possible_prices)
+    scenario_arrays = scenarios_to_arrays(
+        scenarios=scenarios, n_agents=n_agents, possible_prices=possible_prices
+    )
+
+    # Flatten (scenario, market) pairs to one batch axis.
+    market_index = np.tile(np.arange(n_markets), n_scenarios)
+    scenario_index = np.repeat(np.arange(n_scenarios), n_markets)
+    first_period = scenario_arrays["first_period"][scenario_index]
+    last_period = scenario_arrays["last_period"][scenario_index]
+    agent_mask = scenario_arrays["agent_mask"][scenario_index]
+    deviation_step = scenario_arrays["deviation_step"][scenario_index, np.newaxis]
+    deviation_price_index = scenario_arrays["deviation_price_index"][
+        scenario_index, np.newaxis
+    ]
+
+    int_states = np.empty(
+        (n_scenarios * n_markets, total_periods), dtype=price_indices_to_state.dtype
+    )
+    int_states[:, 0] = np.tile(initial_int_states, n_scenarios)
+    for period in range(1, total_periods):
+        previous_int_states = int_states[:, period - 1]
+        price_indices = policy_tables[market_index, :, previous_int_states]
+
+        # Overwrite the prices of the deviating agents in the deviation periods.
+        deviation_price_indices = np.where(
+            deviation_price_index >= 0,
+            deviation_price_index,
+            np.clip(price_indices - deviation_step, 0, n_prices - 1),
+        )
+        is_deviating = (
+            agent_mask
+            & (period >= first_period)[:, np.newaxis]
+            & (period <= last_period)[:, np.newaxis]
+        )
+        price_indices = np.where(is_deviating, deviation_price_indices, price_indices)
+
+        next_price_indices = np.concatenate(
+            (state_to_price_indices[previous_int_states, n_agents:], price_indices),
+            axis=1,
+        )
+        int_states[:, period] = price_indices_to_state[tuple(next_price_indices.T)]
+
+    return int_states.reshape((n_scenarios, n_markets, total_periods))
+
+
+def play_deviation_scenarios(
+    scenarios,
+    total_periods,
+    policy_tables,
+    state_to_price_indices,
+    price_indices_to_state,
+    possible_prices,
+    initial_int_states,
+):
+    """
+    Simulate all markets under all deviation scenarios in one vectorized pass.
+    See *simulate_deviation_scenarios*.
+
+    Args:
+        scenarios (list): List of deviation scenario dicts as described in the
+                          module docstring.
+        total_periods (integer): Number of periods including the state of
+                                 convergence.
+        policy_tables (array): Array with the price index each agent picks in each
+                               state for each market.
+                               Shape is (n_markets, n_agents, n_states).
+        state_to_price_indices (array): Price indices for each integer state
+        price_indices_to_state (array): Mapping from price indices to integer states
+        possible_prices (array): Array of possible prices
+        initial_int_states (array): Integer states in which the simulation starts.
+                                    Shape is (n_markets,).
+
+    Returns:
+        array: Array with all simulated prices states. First state is the
+               state of convergence. Shape is
+               (n_scenarios, n_markets, total_periods, n_agents).
+    """
+    int_states = simulate_deviation_scenarios(
+        scenarios=scenarios,
+        total_periods=total_periods,
+        policy_tables=policy_tables,
+        state_to_price_indices=state_to_price_indices,
+        price_indices_to_state=price_indices_to_state,
+        possible_prices=possible_prices,
+        initial_int_states=initial_int_states,
+    )
+    return int_states_to_prices(
+        int_states=int_states,
+        state_to_price_indices=state_to_price_indices,
+        possible_prices=possible_prices,
+    )
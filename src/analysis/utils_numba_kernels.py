@@ -0,0 +1,106 @@
+"""
+
+A collection of numba compiled kernels for the inner loops of the
+market play simulations and the reward calculations.
+
+The kernels only take plain arrays (policy/transition tables, reward tables
+and discount vectors). The functions in *utils_simulate_play*, *check_ic* and
+*simulate_dev_no_dev* dispatch to them if *USE_NUMBA* is True and fall back
+to the interpreted implementation otherwise. The functions that take
+QLearningAgents (e.g. *play_n_periods*) first extract the policy table of the
+market with *utils_simulate_play.get_market_tables*.
+"""
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        return lambda function: function
+
+
+else:
+    NUMBA_AVAILABLE = True
+
+# Switch to turn the compiled path off, e.g. for debugging.
+USE_NUMBA = NUMBA_AVAILABLE
+
+
+@njit(cache=True)
+def simulate_int_states_kernel(transition_table, start_int_state, n_periods):
+    """
+    Compiled version of *utils_simulate_play.simulate_int_states*.
+
+    Args:
+        transition_table (array): Next integer state for each integer state
+        start_int_state (integer): Integer state from which to simulate
+        n_periods (integer): Number of periods to simulate
+
+    Returns:
+        array: Array with all simulated integer states. Shape is (n_periods,).
+    """
+    int_states = np.empty(n_periods, dtype=transition_table.dtype)
+    int_state = start_int_state
+    for period in range(n_periods):
+        int_state = transition_table[int_state]
+        int_states[period] = int_state
+    return int_states
+
+
+@njit(cache=True)
+def simulate_int_states_batched_kernel(transition_tables, start_int_states, n_periods):
+    """
+    Compiled version of *utils_simulate_play.simulate_int_states_batched*.
+
+    Args:
+        transition_tables (array): Next integer state for each integer state
+                                   in each market. Shape is (n_markets, n_states).
+        start_int_states (array): Integer state from which to simulate in each
+                                  market. Shape is (n_markets,).
+        n_periods (integer): Number of periods to simulate
+
+    Returns:
+        array: Array with all simulated integer states.
+               Shape is (n_markets, n_periods).
+    """
+    n_markets = transition_tables.shape[0]
+    int_states = np.empty((n_markets, n_periods), dtype=transition_tables.dtype)
+    for market in range(n_markets):
+        int_state = start_int_states[market]
+        for period in range(n_periods):
+            int_state = transition_tables[market, int_state]
+            int_states[market, period] = int_state
+    return int_states
+
+
+@njit(cache=True)
+def calc_discounted_profits_kernel(profile_indices, flat_reward_table, discount_vector):
+    """
+    Look up the rewards of all agents in each period and sum them up discounted.
+    Periods are added up one after the other as in
+    *check_ic.check_single_market_agent_ic*.
+
+    Args:
+        profile_indices (array): Flat index of the price profile in each period
+                                 for each market. Shape is (n_markets, n_periods).
+        flat_reward_table (array): Reward of each agent for each price profile.
+                                   Shape is (n_profiles, n_agents).
+        discount_vector (array): Discount factor for each period.
+
+    Returns:
+        array: Discounted profits. Shape is (n_markets, n_agents).
+    """
+    n_markets, n_periods = profile_indices.shape
+    n_agents = flat_reward_table.shape[1]
+    total_profits = np.zeros((n_markets, n_agents))
+    for market in range(n_markets):
+        for t in range(n_periods):
+            for agent in range(n_agents):
+                total_profits[market, agent] = (
+                    total_profits[market, agent]
+                    + discount_vector[t]
+                    * flat_reward_table[profile_indices[market, t], agent]
+                )
+    return total_profits
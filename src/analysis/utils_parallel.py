@@ -0,0 +1,164 @@
+"""
+
+A module to run market simulations on shards of markets in parallel.
+
+Each worker process gets a contiguous shard of the markets and writes its
+results straight into memory-mapped output arrays in a temporary directory.
+Hence, results are never pickled back to the main process. As all markets are independent and
+the workers run the same code as the serial path, the output is identical
+to the serial output.
+"""
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+def get_n_workers(n_workers):
+    """
+    Get the number of worker processes to use.
+
+    Args:
+        n_workers (integer): Number of workers. If None, all available cores
+                             are used.
+
+    Returns:
+        integer: Number of worker processes
+    """
+    if n_workers is None:
+        return os.cpu_count()
+    return n_workers
+
+
+def get_shard_bounds(n_items, n_workers):
+    """
+    Split *n_items* items into *n_workers* contiguous shards of almost equal size.
+
+    Args:
+        n_items (integer): Number of items
+        n_workers (integer): Number of shards
+
+    Returns:
+        array: Position of the first item of each shard and the number of
+               items. Shape is (n_workers + 1,).
+    """
+    return np.linspace(0, n_items, n_workers + 1).astype(int)
+
+
+def _run_shard(function, items, output_specs, start, kwargs):
+    """
+    Run *function* on a shard of items in a worker process and write the
+    results to the shared output arrays.
+
+    Args:
+        function (function): Function that takes the items of the shard and
+                             *kwargs* and returns a dict of arrays whose first
+                             axis are the items.
+        items (list): Items of the shard
+        output_specs (dict): Mapping from output name to the path of the
+                             memory-mapped output array
+        start (integer): Position of the first item of the shard
+        kwargs (dict): Further keyword arguments for *function*
+    """
+    results = function(items, **kwargs)
+    for name, out_path in output_specs.items():
+        out_array = np.load(out_path, mmap_mode="r+")
+        out_array[start : start + len(items)] = results[name]
+        out_array.flush()
+        del out_array
+
+
+def run_sharded(function, items, output_shapes, n_workers, **kwargs):
+    """
+    Split *items* into contiguous shards, run *function* on each shard in a
+    pool of worker processes and collect the results in memory-mapped arrays.
+
+    Args:
+        function (function): Function that takes a list of items and *kwargs*
+                             and returns a dict of arrays whose first axis are
+                             the items. Must be importable by the workers.
+        items (list): Items (e.g. markets) to distribute
+        output_shapes (dict): Mapping from output name to
+                              (shape of the output of a single item, dtype)
+        n_workers (integer): Number of worker processes. If None, all available
+                             cores are used. With one worker *function* is
+                             called directly.
+        **kwargs: Further keyword arguments passed to *function*
+
+    Returns:
+        dict: Mapping from output name to the output array with the items on
+              the first axis.
+    """
+    items = list(items)
+    n_items = len(items)
+    n_workers = min(get_n_workers(n_workers), max(n_items, 1))
+
+    if n_workers == 1:
+        return function(items, **kwargs)
+
+    # Shared memory (multiprocessing.shared_memory) requires Python 3.8, hence
+    # the workers write to memory-mapped .npy files instead.
+    output_specs = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, (item_shape, dtype) in output_shapes.items():
+            output_specs[name] = os.path.join(tmp_dir, f"{name}.npy")
+            out_array = np.lib.format.open_memmap(
+                output_specs[name],
+                mode="w+",
+                dtype=dtype,
+                shape=(n_items,) + tuple(item_shape),
+            )
+            del out_array
+
+        shard_bounds = get_shard_bounds(n_items=n_items, n_workers=n_workers)
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            futures = [
+                executor.submit(
+                    _run_shard, function, items[start:stop], output_specs, start, kwargs
+                )
+                for start, stop in zip(shard_bounds[:-1], shard_bounds[1:])
+            ]
+            # Raise errors from the workers.
+            for future in futures:
+                future.result()
+
+        out_dict = {}
+        for name, out_path in output_specs.items():
+            out_dict[name] = np.load(out_path)
+    return out_dict
+
+
+def map_shards(function, items, n_workers, **kwargs):
+    """
+    Split *items* into contiguous shards and run *function* on each shard in a
+    pool of worker processes. In contrast to *run_sharded*, the results are
+    pickled back to the main process as they are. Hence, they do not need a
+    fixed shape, e.g. CompactTrajectories.
+
+    Args:
+        function (function): Function that takes a list of items and *kwargs*.
+                             Must be importable by the workers.
+        items (list): Items (e.g. markets) to distribute
+        n_workers (integer): Number of worker processes. If None, all available
+                             cores are used. With one worker *function* is
+                             called directly.
+        **kwargs: Further keyword arguments passed to *function*
+
+    Returns:
+        list: Result of *function* for each shard in the order of the items.
+    """
+    items = list(items)
+    n_items = len(items)
+    n_workers = min(get_n_workers(n_workers), max(n_items, 1))
+
+    if n_workers == 1:
+        return [function(items, **kwargs)]
+
+    shard_bounds = get_shard_bounds(n_items=n_items, n_workers=n_workers)
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [
+            executor.submit(function, items[start:stop], **kwargs)
+            for start, stop in zip(shard_bounds[:-1], shard_bounds[1:])
+        ]
+        return [future.result() for future in futures]
@@ -0,0 +1,96 @@
+"""
+
+A collection of functions to evaluate the joint greedy policies of the agents
+exactly by solving the Bellman equations of the policies as a linear system.
+
+If all agents play greedily, the state of the next period is a deterministic
+function of the current state. Hence, the transition matrix P of a market
+has exactly one nonzero entry per row and the values of all states solve
+(I - discount_rate * P) V = r. The systems of all markets are stacked into
+one block diagonal sparse system which is factorized once.
+"""
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import splu
+
+
+def build_transition_matrix(transition_tables):
+    """
+    Build the block diagonal sparse transition matrix of all markets.
+
+    Args:
+        transition_tables (array): Next integer state for each integer state
+                                   in each market. Shape is (n_markets, n_states).
+
+    Returns:
+        scipy.sparse.csr_matrix: Transition matrix with one block per market.
+                                 Row m * n_states + x has a one in the column
+                                 m * n_states + transition_tables[m, x].
+                                 Shape is (n_markets * n_states,) * 2.
+    """
+    n_markets, n_states = transition_tables.shape
+    n_rows = n_markets * n_states
+    market_offsets = (np.arange(n_markets) * n_states)[:, np.newaxis]
+    columns = (market_offsets + transition_tables).ravel()
+    return sparse.csr_matrix(
+        (np.ones(n_rows), (np.arange(n_rows), columns)), shape=(n_rows, n_rows)
+    )
+
+
+def solve_policy_values(transition_tables, rewards, discount_rate):
+    """
+    Solve (I - discount_rate * P) V = r for the block diagonal transition
+    matrix P of all markets.
+
+    Args:
+        transition_tables (array): Next integer state for each integer state
+                                   in each market. Shape is (n_markets, n_states).
+        rewards (array): Right hand side with the rewards of all markets stacked
+                         on top of each other.
+                         Shape is (n_markets * n_states,) or
+                         (n_markets * n_states, n_columns).
+        discount_rate (float): Discount rate
+
+    Returns:
+        array: Values with the same shape as *rewards*.
+    """
+    n_markets, n_states = transition_tables.shape
+    n_rows = n_markets * n_states
+
+    transition_matrix = build_transition_matrix(transition_tables=transition_tables)
+    system_matrix = sparse.identity(n_rows, format="csc") - discount_rate * (
+        transition_matrix.tocsc()
+    )
+    return splu(system_matrix).solve(rewards)
+
+
+def evaluate_policies(transition_tables, state_rewards, discount_rate):
+    """
+    Calculate the exact infinite horizon discounted value of starting in each
+    state of each market by solving (I - discount_rate * P) V = r.
+
+    The reward of a state is received in the period in which the state is
+    played, i.e. V(x) = r(x) + discount_rate * V(T(x)) where T(x) is the
+    next state in the transition table.
+
+    Args:
+        transition_tables (array): Next integer state for each integer state
+                                   in each market. Shape is (n_markets, n_states).
+        state_rewards (array): Reward(s) in each integer state. Shape is
+                               (n_states,) or (n_states, n_agents).
+        discount_rate (float): Discount rate
+
+    Returns:
+        array: Values of all states. Shape is
+               (n_markets,) + state_rewards.shape.
+    """
+    n_markets, n_states = transition_tables.shape
+
+    # The rewards are the same in all markets, the right hand side has one
+    # column per agent.
+    values = solve_policy_values(
+        transition_tables=transition_tables,
+        rewards=np.tile(state_rewards.reshape(n_states, -1), (n_markets, 1)),
+        discount_rate=discount_rate,
+    )
+    return values.reshape((n_markets,) + state_rewards.shape)
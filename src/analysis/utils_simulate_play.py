@@ -5,9 +5,15 @@ in super star market simulations.
 """
 import numpy as np
 
+from src.analysis import utils_numba_kernels
+from src.library.utils_dtypes import cast_checked
+from src.library.utils_dtypes import get_smallest_int_dtype
+from src.library.utils_dtypes import get_state_dtype
+from src.library.utils_state_encoding import int_states_to_price_indices
 from qpricesim.simulations.utils_simulation import (
     concatenate_new_price_state,
 )
+from qpricesim.simulations.utils_simulation import gen_possible_prices
 from qpricesim.simulations.utils_simulation import (
     price_state_to_int_state,
 )
@@ -41,7 +47,12 @@ def play_period(all_agents, possible_prices, int_state):
 
 
 def play_n_periods(
-    all_agents, possible_prices, prices_to_int_dict, n_periods, start_price_state
+    all_agents,
+    possible_prices,
+    prices_to_int_dict,
+    n_periods,
+    start_price_state,
+    price_dtype=int,
 ):
     """
     Simulate *n_periods* of market interaction starting from state *start_price_state*
@@ -56,11 +67,34 @@ def play_n_periods(
         start_price_state (array): Initial price state from which to simulate.
                                    In all consecutive rounds the respective
                                    continuation state will be used.
+        price_dtype (numpy.dtype): dtype of the returned prices, see
+                                   *utils_dtypes.get_price_dtype*. The price
+                                   states used for the dictionary lookups keep
+                                   the dtype of *possible_prices*.
 
     Returns:
         array: Array with all simulated prices states. Note that the shape of
                the array is (n_periods, n_agents).
     """
+    # Compiled path: Extract the policy table once and simulate the integer
+    # states with the kernel.
+    if utils_numba_kernels.USE_NUMBA:
+        market_tables = get_market_tables(
+            all_agents=all_agents,
+            possible_prices=possible_prices,
+            state_length=len(start_price_state),
+        )
+        simulated_price_states = play_n_periods_from_table(
+            transition_table=market_tables["transition_table"],
+            state_to_price_indices=market_tables["state_to_price_indices"],
+            possible_prices=possible_prices,
+            n_periods=n_periods,
+            start_int_state=price_state_to_int_state(
+                price_state=start_price_state, prices_to_int_dict=prices_to_int_dict
+            ),
+        )
+        return cast_checked(array=simulated_price_states, dtype=price_dtype)
+
     n_agents = len(all_agents)
 
     # Define output array
@@ -88,11 +122,16 @@ def play_n_periods(
             price_state=price_state, prices_to_int_dict=prices_to_int_dict
         )
         simulated_price_states[period, :] = price_state
-    return simulated_price_states
+    return cast_checked(array=simulated_price_states, dtype=price_dtype)
 
 
 def play_without_deviation(
-    parameter, all_agents, prices_to_int_dict, possible_prices, initial_price_state
+    parameter,
+    all_agents,
+    prices_to_int_dict,
+    possible_prices,
+    initial_price_state,
+    price_dtype=int,
 ):
     """
     Simulate the market with all agents starting from the *initial_price_state*.
@@ -104,6 +143,7 @@ def play_without_deviation(
         possible_prices (array): Array of possible prices in the market.
         initial_price_state (array): Price representation of the state of
                                      convergence.
+        price_dtype (numpy.dtype): dtype of the returned prices
 
     Returns:
         array: Array with all simulated prices states. First state is the
@@ -119,5 +159,443 @@ def play_without_deviation(
         prices_to_int_dict=prices_to_int_dict,
         possible_prices=possible_prices,
         start_price_state=initial_price_state,
+        price_dtype=price_dtype,
+    )
+    return cast_checked(
+        array=np.vstack((initial_price_state, price_seq)), dtype=price_dtype
+    )
+
+
+def gen_state_index_arrays(parameter):
+    """
+    Generate two arrays such that we can move between integer states and
+    price states by array indexing only.
+
+    Prices are represented by their index in the array of possible prices
+    (price index).
+
+    Args:
+        parameter (dict): Market specs as defined in *utils_state_encoding*
+
+    Returns:
+        tuple: - Array with the price indices for each integer state.
+                 Shape is (n_states, n_agents * k_memory).
+               - Array which maps price indices to integer states. It has one
+                 axis of length n_prices for each position in the price state,
+                 such that price_indices_to_state[tuple(price_indices)] is the
+                 integer state. Integer states are stored in the dtype of
+                 *utils_dtypes.get_state_dtype*, which is passed on to the
+                 transition tables and all simulated integer states.
+    """
+    return _gen_state_index_arrays(
+        n_prices=len(gen_possible_prices(parameter=parameter)),
+        state_length=parameter["n_agent"] * parameter["k_memory"],
+        state_dtype=get_state_dtype(parameter=parameter),
+    )
+
+
+def _gen_state_index_arrays(n_prices, state_length, state_dtype):
+    """
+    Implementation of *gen_state_index_arrays* for a given number of prices,
+    length of the price state and dtype of the integer states.
+
+    Args:
+        n_prices (integer): Number of possible prices
+        state_length (integer): Length of a price state (n_agents * k_memory)
+        state_dtype (numpy.dtype): dtype of the integer states
+
+    Returns:
+        tuple: See *gen_state_index_arrays*
+    """
+    all_int_states = np.arange(n_prices ** state_length, dtype=state_dtype)
+
+    state_to_price_indices = int_states_to_price_indices(
+        int_states=all_int_states, n_prices=n_prices, state_length=state_length
+    )
+    # The first price is the most significant digit of the integer state,
+    # which is exactly the C-order of the reshaped array.
+    price_indices_to_state = all_int_states.reshape((n_prices,) * state_length)
+    return state_to_price_indices, price_indices_to_state
+
+
+def get_policy_table(all_agents, n_states):
+    """
+    Extract the greedy policy of all agents in a market once, such that the
+    market can be simulated without calling the agents again.
+
+    Agents that carry their greedy policy as the attribute *greedy_policy*,
+    e.g. the agents from the Q-table archive, are not called for each state.
+
+    Args:
+        all_agents (list): List of QLearningAgents
+        n_states (integer): Number of states in the market
+
+    Returns:
+        array: Array with the integer action (price index) each agent picks
+               in each state. Shape is (n_agents, n_states).
+    """
+    policy_table = np.empty((len(all_agents), n_states), dtype=int)
+    for id_agent, agent in enumerate(all_agents):
+        greedy_policy = getattr(agent, "greedy_policy", None)
+        if greedy_policy is not None:
+            policy_table[id_agent] = greedy_policy[:n_states]
+            continue
+        for int_state in range(n_states):
+            policy_table[id_agent, int_state] = agent.get_best_action(int_state)
+    return policy_table
+
+
+def get_policy_tables(all_markets, n_states):
+    """
+    Stack the policy tables of several markets.
+
+    Args:
+        all_markets (list): List of markets, where each market is a list
+                            of QLearningAgents
+        n_states (integer): Number of states in the market
+
+    Returns:
+        array: Array with the policy tables of all markets.
+               Shape is (n_markets, n_agents, n_states).
+    """
+    return np.stack(
+        [
+            get_policy_table(all_agents=all_agents, n_states=n_states)
+            for all_agents in all_markets
+        ]
+    )
+
+
+def get_market_tables(all_agents, possible_prices, state_length):
+    """
+    Get all tables that are needed to simulate a market with the policy table
+    functions from the agents and the price grid alone. This is used by the
+    functions which take QLearningAgents to dispatch to the compiled path.
+
+    Args:
+        all_agents (list): List of QLearningAgents
+        possible_prices (array): Array of possible prices in the market
+        state_length (integer): Length of a price state (n_agents * k_memory)
+
+    Returns:
+        dict: Dictionary with the following entries:
+
+              'policy_table' -> See *get_policy_table*
+              'transition_table' -> See *get_transition_table*
+              'state_to_price_indices' -> See *gen_state_index_arrays*
+              'price_indices_to_state' -> See *gen_state_index_arrays*
+    """
+    n_prices = len(possible_prices)
+    n_states = n_prices ** state_length
+    state_to_price_indices, price_indices_to_state = _gen_state_index_arrays(
+        n_prices=n_prices,
+        state_length=state_length,
+        state_dtype=get_smallest_int_dtype(min_value=0, max_value=n_states - 1),
+    )
+    policy_table = get_policy_table(all_agents=all_agents, n_states=n_states)
+
+    out_dict = {}
+    out_dict["policy_table"] = policy_table
+    out_dict["transition_table"] = get_transition_table(
+        policy_table=policy_table,
+        state_to_price_indices=state_to_price_indices,
+        price_indices_to_state=price_indices_to_state,
+    )
+    out_dict["state_to_price_indices"] = state_to_price_indices
+    out_dict["price_indices_to_state"] = price_indices_to_state
+    return out_dict
+
+
+def get_transition_table(
+    policy_table, state_to_price_indices, price_indices_to_state
+):
+    """
+    Get the continuation state for each state if all agents play according to the
+    *policy_table*.
+
+    Note that the function also works for a stack of policy tables, i.e. if
+    *policy_table* has the shape (..., n_agents, n_states).
+
+    Args:
+        policy_table (array): Array with the price index each agent picks in each
+                              state. Shape is (..., n_agents, n_states).
+        state_to_price_indices (array): Price indices for each integer state
+        price_indices_to_state (array): Mapping from price indices to integer states
+
+    Returns:
+        array: Array with the next integer state for each integer state.
+               Shape is (..., n_states).
+    """
+    n_agents = policy_table.shape[-2]
+    new_price_indices = np.swapaxes(policy_table, -1, -2)
+
+    # Concatenate the old and new prices to the new price state.
+    # Note that strictly speaking this is only really relevant
+    # if the memory is greater than 1.
+    old_price_indices = np.broadcast_to(
+        state_to_price_indices[:, n_agents:],
+        new_price_indices.shape[:-1] + (state_to_price_indices.shape[1] - n_agents,),
+    )
+    next_price_indices = np.concatenate(
+        (old_price_indices, new_price_indices), axis=-1
+    )
+    return price_indices_to_state[tuple(np.moveaxis(next_price_indices, -1, 0))]
+
+
+def get_deviation_transition_tables(
+    policy_tables, state_to_price_indices, price_indices_to_state, id_agent
+):
+    """
+    Get the continuation state for each state and each price the agent *id_agent*
+    could play, while all other agents play according to their policy tables.
+
+    Args:
+        policy_tables (array): Array with the price index each agent picks in each
+                               state for each market.
+                               Shape is (n_markets, n_agents, n_states).
+        state_to_price_indices (array): Price indices for each integer state
+        price_indices_to_state (array): Mapping from price indices to integer states
+        id_agent (integer): Index of the agent that picks the price
+
+    Returns:
+        array: Array with the next integer state for each integer state and
+               price index of agent *id_agent*. Shape is
+               (n_markets, n_states, n_prices).
+    """
+    n_markets, n_agents, n_states = policy_tables.shape
+    n_prices = price_indices_to_state.shape[0]
+
+    new_price_indices = np.repeat(
+        np.swapaxes(policy_tables, -1, -2)[:, :, np.newaxis, :], n_prices, axis=2
+    )
+    new_price_indices[..., id_agent] = np.arange(n_prices)
+    old_price_indices = np.broadcast_to(
+        state_to_price_indices[:, np.newaxis, n_agents:],
+        (n_markets, n_states, n_prices, state_to_price_indices.shape[1] - n_agents),
+    )
+    next_price_indices = np.concatenate(
+        (old_price_indices, new_price_indices), axis=-1
+    )
+    return price_indices_to_state[tuple(np.moveaxis(next_price_indices, -1, 0))]
+
+
+def get_all_deviation_transition_tables(
+    policy_tables, state_to_price_indices, price_indices_to_state
+):
+    """
+    Stack the tables of *get_deviation_transition_tables* for all agents.
+
+    Args:
+        policy_tables (array): Array with the price index each agent picks in each
+                               state for each market.
+                               Shape is (n_markets, n_agents, n_states).
+        state_to_price_indices (array): Price indices for each integer state
+        price_indices_to_state (array): Mapping from price indices to integer states
+
+    Returns:
+        array: Array with the next integer state for each agent, integer state
+               and price index of this agent. Shape is
+               (n_markets, n_agents, n_states, n_prices).
+    """
+    return np.stack(
+        [
+            get_deviation_transition_tables(
+                policy_tables=policy_tables,
+                state_to_price_indices=state_to_price_indices,
+                price_indices_to_state=price_indices_to_state,
+                id_agent=id_agent,
+            )
+            for id_agent in range(policy_tables.shape[1])
+        ],
+        axis=1,
+    )
+
+
+def simulate_int_states(transition_table, start_int_state, n_periods):
+    """
+    Simulate *n_periods* of market interaction starting from the integer state
+    *start_int_state* by following the *transition_table*.
+
+    Args:
+        transition_table (array): Next integer state for each integer state
+        start_int_state (integer): Integer state from which to simulate
+        n_periods (integer): Number of periods to simulate
+
+    Returns:
+        array: Array with all simulated integer states. Note that the shape
+               is (n_periods,) and the start state is not included.
+    """
+    if utils_numba_kernels.USE_NUMBA:
+        return utils_numba_kernels.simulate_int_states_kernel(
+            transition_table, start_int_state, n_periods
+        )
+
+    int_states = np.empty(n_periods, dtype=transition_table.dtype)
+    int_state = start_int_state
+    for period in range(n_periods):
+        int_state = transition_table[int_state]
+        int_states[period] = int_state
+    return int_states
+
+
+def simulate_int_states_batched(transition_tables, start_int_states, n_periods):
+    """
+    Simulate *n_periods* of market interaction for several markets in lockstep.
+    In each period the states of all markets are advanced at once.
+
+    Args:
+        transition_tables (array): Next integer state for each integer state
+                                   in each market. Shape is (n_markets, n_states).
+        start_int_states (array): Integer state from which to simulate in each
+                                  market. Shape is (n_markets,).
+        n_periods (integer): Number of periods to simulate
+
+    Returns:
+        array: Array with all simulated integer states. Note that the shape
+               is (n_markets, n_periods) and the start states are not included.
+    """
+    if utils_numba_kernels.USE_NUMBA:
+        return utils_numba_kernels.simulate_int_states_batched_kernel(
+            transition_tables, np.asarray(start_int_states), n_periods
+        )
+
+    n_markets = transition_tables.shape[0]
+    market_index = np.arange(n_markets)
+
+    int_states = np.empty((n_markets, n_periods), dtype=transition_tables.dtype)
+    current_int_states = np.asarray(start_int_states)
+    for period in range(n_periods):
+        current_int_states = transition_tables[market_index, current_int_states]
+        int_states[:, period] = current_int_states
+    return int_states
+
+
+def int_states_to_prices(int_states, state_to_price_indices, possible_prices):
+    """
+    Transform integer states to their price state representation.
+
+    Args:
+        int_states (array): Array of integer states of arbitrary shape
+        state_to_price_indices (array): Price indices for each integer state
+        possible_prices (array): Array of possible prices in the market
+
+    Returns:
+        array: Array with the price states. The shape is
+               int_states.shape + (n_agents * k_memory,).
+    """
+    return possible_prices[state_to_price_indices[int_states]]
+
+
+def play_n_periods_from_table(
+    transition_table,
+    state_to_price_indices,
+    possible_prices,
+    n_periods,
+    start_int_state,
+):
+    """
+    Policy table counterpart to *play_n_periods*. Simulate *n_periods* of market
+    interaction starting from *start_int_state* and return all simulated prices.
+
+    Args:
+        transition_table (array): Next integer state for each integer state
+        state_to_price_indices (array): Price indices for each integer state
+        possible_prices (array): Array of possible prices
+        n_periods (integer): Number of periods to simulate
+        start_int_state (integer): Initial integer state from which to simulate
+
+    Returns:
+        array: Array with all simulated prices states. Note that the shape of
+               the array is (n_periods, n_agents).
+    """
+    int_states = simulate_int_states(
+        transition_table=transition_table,
+        start_int_state=start_int_state,
+        n_periods=n_periods,
+    )
+    return int_states_to_prices(
+        int_states=int_states,
+        state_to_price_indices=state_to_price_indices,
+        possible_prices=possible_prices,
+    )
+
+
+def play_without_deviation_from_table(
+    parameter,
+    transition_table,
+    state_to_price_indices,
+    possible_prices,
+    initial_int_state,
+):
+    """
+    Policy table counterpart to *play_without_deviation*. Simulate the market
+    starting from the *initial_int_state*.
+
+    Args:
+        parameter (dict): Dictionary with the deviation simulation parameter.
+        transition_table (array): Next integer state for each integer state
+        state_to_price_indices (array): Price indices for each integer state
+        possible_prices (array): Array of possible prices in the market.
+        initial_int_state (integer): Integer state of convergence.
+
+    Returns:
+        array: Array with all simulated prices states. First state is the
+               state of convergence.
+               Note that the array is of shape
+               (parameter["total_periods"], n_agents).
+    """
+    int_states = np.empty(parameter["total_periods"], dtype=transition_table.dtype)
+    int_states[0] = initial_int_state
+    int_states[1:] = simulate_int_states(
+        transition_table=transition_table,
+        start_int_state=initial_int_state,
+        n_periods=parameter["total_periods"] - 1,
+    )
+    return int_states_to_prices(
+        int_states=int_states,
+        state_to_price_indices=state_to_price_indices,
+        possible_prices=possible_prices,
+    )
+
+
+def play_without_deviation_batched(
+    parameter,
+    transition_tables,
+    state_to_price_indices,
+    possible_prices,
+    initial_int_states,
+):
+    """
+    Batched counterpart to *play_without_deviation_from_table*. Simulate all
+    markets in lockstep starting from their *initial_int_states*.
+
+    Args:
+        parameter (dict): Dictionary with the deviation simulation parameter.
+        transition_tables (array): Next integer state for each integer state
+                                   in each market. Shape is (n_markets, n_states).
+        state_to_price_indices (array): Price indices for each integer state
+        possible_prices (array): Array of possible prices in the market.
+        initial_int_states (array): Integer states of convergence.
+                                    Shape is (n_markets,).
+
+    Returns:
+        array: Array with all simulated prices states. First state is the
+               state of convergence.
+               Note that the array is of shape
+               (n_markets, parameter["total_periods"], n_agents).
+    """
+    n_markets = transition_tables.shape[0]
+    int_states = np.empty(
+        (n_markets, parameter["total_periods"]), dtype=transition_tables.dtype
+    )
+    int_states[:, 0] = initial_int_states
+    int_states[:, 1:] = simulate_int_states_batched(
+        transition_tables=transition_tables,
+        start_int_states=initial_int_states,
+        n_periods=parameter["total_periods"] - 1,
+    )
+    return int_states_to_prices(
+        int_states=int_states,
+        state_to_price_indices=state_to_price_indices,
+        possible_prices=possible_prices,
     )
-    return np.vstack((initial_price_state, price_seq))
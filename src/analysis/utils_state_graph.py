@@ -0,0 +1,169 @@
+"""
+
+A collection of functions to analyse the state graph of greedy market play.
+
+If all agents play greedily, each state has exactly one continuation state.
+Hence, the transition table of a market is a functional graph: Each starting
+state runs into exactly one cycle (its basin of attraction) after a number
+of transient periods. All functions work on a stack of transition tables
+such that all markets are analysed at once.
+"""
+import numpy as np
+
+
+def _compose_until_absorbed(transition_tables):
+    """
+    Apply the transition tables at least n_states times to each state. After
+    that many periods every state has reached the cycle of its basin.
+
+    Args:
+        transition_tables (array): Next integer state for each integer state
+                                   in each market. Shape is (n_markets, n_states).
+
+    Returns:
+        array: Integer state on the cycle that each state runs into.
+               Shape is (n_markets, n_states).
+    """
+    n_markets, n_states = transition_tables.shape
+    market_index = np.arange(n_markets)[:, np.newaxis]
+
+    # Repeated squaring: After k iterations this is the 2**k-fold transition.
+    int_states_on_cycle = transition_tables
+    n_steps = 1
+    while n_steps < n_states:
+        int_states_on_cycle = int_states_on_cycle[market_index, int_states_on_cycle]
+        n_steps *= 2
+    return int_states_on_cycle
+
+
+def analyse_state_graph(transition_tables):
+    """
+    Derive the basins of attraction, the cycle membership, the cycle lengths and
+    the time to absorption for all starting states in all markets.
+
+    Args:
+        transition_tables (array): Next integer state for each integer state
+                                   in each market. Shape is (n_markets, n_states).
+
+    Returns:
+        dict: Dictionary with the following arrays of shape (n_markets, n_states):
+
+              'cycle_id' -> Smallest integer state on the cycle the state runs into.
+                            States with the same cycle id share a basin of
+                            attraction.
+              'on_cycle' -> True if the state is part of a cycle.
+              'cycle_length' -> Length of the cycle the state runs into.
+              'time_to_absorption' -> Number of periods until the cycle is reached.
+
+              Furthermore, 'n_cycles' is an array of shape (n_markets,) with the
+              number of distinct cycles in each market.
+    """
+    n_markets, n_states = transition_tables.shape
+    market_index = np.arange(n_markets)[:, np.newaxis]
+    all_int_states = np.broadcast_to(np.arange(n_states), (n_markets, n_states))
+
+    int_states_on_cycle = _compose_until_absorbed(transition_tables=transition_tables)
+
+    # A state is on a cycle if it can be reached after all transients are over.
+    on_cycle = np.zeros((n_markets, n_states), dtype=bool)
+    on_cycle[market_index, int_states_on_cycle] = True
+
+    # Pointer doubling: After k iterations, *jump_tables* is the 2**k-fold
+    # transition, *min_on_path* the smallest state and *n_off_cycle* the number
+    # of states that are not on a cycle among the first 2**k states of the
+    # trajectory from each state. With 2**k >= n_states the trajectory from a
+    # state on a cycle has passed its whole cycle and the trajectory from any
+    # state has reached its cycle.
+    jump_tables = transition_tables
+    min_on_path = all_int_states.copy()
+    n_off_cycle = (~on_cycle).astype(int)
+    n_steps = 1
+    while n_steps < n_states:
+        min_on_path = np.minimum(min_on_path, min_on_path[market_index, jump_tables])
+        n_off_cycle = n_off_cycle + n_off_cycle[market_index, jump_tables]
+        jump_tables = jump_tables[market_index, jump_tables]
+        n_steps *= 2
+    cycle_id = min_on_path[market_index, int_states_on_cycle]
+    time_to_absorption = n_off_cycle
+
+    # The length of a cycle is the number of states on it.
+    states_per_cycle = np.bincount(
+        (market_index * n_states + cycle_id)[on_cycle],
+        minlength=n_markets * n_states,
+    ).reshape(n_markets, n_states)
+    cycle_length = states_per_cycle[market_index, cycle_id]
+
+    n_cycles = np.sum(on_cycle & (cycle_id == all_int_states), axis=1)
+
+    out_dict = {}
+    out_dict["cycle_id"] = cycle_id
+    out_dict["on_cycle"] = on_cycle
+    out_dict["cycle_length"] = cycle_length
+    out_dict["time_to_absorption"] = time_to_absorption
+    out_dict["n_cycles"] = n_cycles
+    return out_dict
+
+
+def simulate_all_int_states(transition_tables, n_periods):
+    """
+    Simulate all markets starting from all states in lockstep.
+
+    Args:
+        transition_tables (array): Next integer state for each integer state
+                                   in each market. Shape is (n_markets, n_states).
+        n_periods (integer): Number of periods including the initial state.
+
+    Returns:
+        array: Array with all integer states. The initial state is included.
+               Shape is (n_markets, n_states, n_periods).
+    """
+    n_markets, n_states = transition_tables.shape
+    market_index = np.arange(n_markets)[:, np.newaxis]
+
+    int_states = np.empty(
+        (n_markets, n_states, n_periods), dtype=transition_tables.dtype
+    )
+    current_int_states = np.broadcast_to(np.arange(n_states), (n_markets, n_states))
+    int_states[:, :, 0] = current_int_states
+    for period in range(1, n_periods):
+        current_int_states = transition_tables[market_index, current_int_states]
+        int_states[:, :, period] = current_int_states
+    return int_states
+
+
+def advance_int_states(transition_tables, int_states, n_periods):
+    """
+    Get the integer states after *n_periods* periods of play in all markets
+    without simulating the periods in between.
+
+    The transition tables are composed by repeated squaring, hence the cost
+    grows only with the logarithm of *n_periods*.
+
+    Args:
+        transition_tables (array): Next integer state for each integer state
+                                   in each market. Shape is (n_markets, n_states).
+        int_states (array): Integer states from which to start. The first axis
+                            is the market, e.g. (n_markets,) or (n_markets, n).
+        n_periods (integer): Number of periods to advance
+
+    Returns:
+        array: Integer states after *n_periods*. Same shape as *int_states*.
+    """
+    market_index = np.arange(transition_tables.shape[0]).reshape(
+        (-1,) + (1,) * (np.ndim(int_states) - 1)
+    )
+    market_index_tables = np.arange(transition_tables.shape[0])[:, np.newaxis]
+
+    current_int_states = np.asarray(int_states)
+    power_transition_tables = transition_tables
+    remaining_periods = n_periods
+    while remaining_periods > 0:
+        if remaining_periods % 2 == 1:
+            current_int_states = power_transition_tables[
+                market_index, current_int_states
+            ]
+        power_transition_tables = power_transition_tables[
+            market_index_tables, power_transition_tables
+        ]
+        remaining_periods //= 2
+    return current_int_states
@@ -0,0 +1,304 @@
+"""
+
+A collection of functions to describe the deterministic market play
+of greedy agents as a transient followed by a cycle.
+
+As the agents play greedily and the state space is finite, each trajectory
+ends up in a cycle after a (possibly empty) transient. Once both are known,
+the state and value of any period can be calculated without simulating all
+periods in between.
+"""
+import numpy as np
+
+from src.analysis.utils_simulate_play import int_states_to_prices
+from src.analysis.utils_state_graph import analyse_state_graph
+from src.library.utils_compact_trajectories import CompactTrajectories
+from src.library.utils_dtypes import cast_checked
+
+
+def find_transient_and_cycle(transition_table, start_int_state):
+    """
+    Follow the *transition_table* from *start_int_state* until a state is
+    visited for the second time and split the trajectory into the transient
+    and the cycle.
+
+    The trajectory is x_0 = *start_int_state*, x_(t+1) = transition_table[x_t].
+
+    Args:
+        transition_table (array): Next integer state for each integer state
+        start_int_state (integer): Integer state from which to start
+
+    Returns:
+        tuple: - Array with the transient integer states (x_0, ..., x_(m-1))
+               - Array with the integer states of the cycle (x_m, ..., x_(m+L-1))
+    """
+    n_states = transition_table.shape[0]
+    first_visit = np.full(n_states, -1, dtype=int)
+
+    trajectory = []
+    int_state = start_int_state
+    while first_visit[int_state] < 0:
+        first_visit[int_state] = len(trajectory)
+        trajectory.append(int_state)
+        int_state = transition_table[int_state]
+
+    trajectory = np.array(trajectory, dtype=int)
+    cycle_start = first_visit[int_state]
+    return trajectory[:cycle_start], trajectory[cycle_start:]
+
+
+def get_int_states_in_periods(transient_int_states, cycle_int_states, periods):
+    """
+    Get the integer states of a trajectory for arbitrary periods.
+
+    Args:
+        transient_int_states (array): Transient integer states of the trajectory
+        cycle_int_states (array): Integer states of the cycle of the trajectory
+        periods (array): Periods (t in x_t) for which we want the state.
+
+    Returns:
+        array: Integer states in the given periods. Same shape as *periods*.
+    """
+    periods = np.asarray(periods)
+    n_transient = transient_int_states.shape[0]
+    cycle_length = cycle_int_states.shape[0]
+
+    trajectory = np.concatenate((transient_int_states, cycle_int_states))
+    position = np.where(
+        periods < n_transient,
+        periods,
+        n_transient + (periods - n_transient) % cycle_length,
+    )
+    return trajectory[position]
+
+
+def calc_discounted_value(
+    transient_rewards, cycle_rewards, discount_rate, n_periods=None
+):
+    """
+    Calculate the discounted sum of rewards of a trajectory in closed form.
+    The reward in period t is discounted with discount_rate ** t.
+
+    Args:
+        transient_rewards (array): Rewards in the transient periods. The first axis
+                                   is the period, further axes (e.g. agents) are
+                                   kept.
+        cycle_rewards (array): Rewards in the periods of one pass through the cycle
+        discount_rate (float): Discount rate
+        n_periods (integer): Number of periods (t = 0, ..., n_periods - 1) to
+                             consider. If None, the infinite horizon value
+                             is returned.
+
+    Returns:
+        array: Discounted value. The shape is transient_rewards.shape[1:].
+    """
+    n_transient = transient_rewards.shape[0]
+    cycle_length = cycle_rewards.shape[0]
+
+    if n_periods is not None and n_periods <= n_transient:
+        discount_vector = discount_rate ** np.arange(n_periods)
+        return np.tensordot(discount_vector, transient_rewards[:n_periods], axes=1)
+
+    discount_vector = discount_rate ** np.arange(max(n_transient, cycle_length))
+    value_transient = np.tensordot(
+        discount_vector[:n_transient], transient_rewards, axes=1
+    )
+    value_one_cycle = np.tensordot(
+        discount_vector[:cycle_length], cycle_rewards, axes=1
+    )
+    discount_cycle = discount_rate ** cycle_length
+
+    if n_periods is None:
+        value_all_cycles = value_one_cycle / (1 - discount_cycle)
+    else:
+        n_full_cycles, n_remaining = divmod(n_periods - n_transient, cycle_length)
+        value_full_cycles = (
+            value_one_cycle
+            * (1 - discount_cycle ** n_full_cycles)
+            / (1 - discount_cycle)
+        )
+        value_remaining = np.tensordot(
+            discount_vector[:n_remaining], cycle_rewards[:n_remaining], axes=1
+        )
+        value_all_cycles = (
+            value_full_cycles + discount_cycle ** n_full_cycles * value_remaining
+        )
+
+    return value_transient + discount_rate ** n_transient * value_all_cycles
+
+
+def calc_trajectory_value(
+    transition_table, state_rewards, discount_rate, start_int_state, n_periods=None
+):
+    """
+    Calculate the discounted value of the trajectory starting in *start_int_state*
+    without simulating it period by period.
+
+    Args:
+        transition_table (array): Next integer state for each integer state
+        state_rewards (array): Reward(s) in each integer state.
+                               Shape is (n_states,) or (n_states, n_agents).
+        discount_rate (float): Discount rate
+        start_int_state (integer): Integer state from which to start
+        n_periods (integer): Number of periods to consider. If None, the
+                             infinite horizon value is returned.
+
+    Returns:
+        array: Discounted value. The shape is state_rewards.shape[1:].
+    """
+    transient_int_states, cycle_int_states = find_transient_and_cycle(
+        transition_table=transition_table, start_int_state=start_int_state
+    )
+    return calc_discounted_value(
+        transient_rewards=state_rewards[transient_int_states],
+        cycle_rewards=state_rewards[cycle_int_states],
+        discount_rate=discount_rate,
+        n_periods=n_periods,
+    )
+
+
+def play_without_deviation_from_cycle(
+    parameter,
+    transition_table,
+    state_to_price_indices,
+    possible_prices,
+    initial_int_state,
+    first_period=0,
+):
+    """
+    Cycle based counterpart to *play_without_deviation_from_table*. Returns the
+    same prices, but the cost does not depend on the number of periods to
+    simulate, apart from writing the output. Hence, *parameter["total_periods"]*
+    can be arbitrarily large.
+
+    Args:
+        parameter (dict): Dictionary with the deviation simulation parameter.
+        transition_table (array): Next integer state for each integer state
+        state_to_price_indices (array): Price indices for each integer state
+        possible_prices (array): Array of possible prices in the market.
+        initial_int_state (integer): Integer state of convergence.
+        first_period (integer): First period to return. Allows to only get the
+                                last periods of a very long horizon.
+
+    Returns:
+        array: Array with the prices states in the periods
+               first_period, ..., parameter["total_periods"] - 1 where
+               period 0 is the state of convergence.
+    """
+    transient_int_states, cycle_int_states = find_transient_and_cycle(
+        transition_table=transition_table, start_int_state=initial_int_state
+    )
+    int_states = get_int_states_in_periods(
+        transient_int_states=transient_int_states,
+        cycle_int_states=cycle_int_states,
+        periods=np.arange(first_period, parameter["total_periods"]),
+    )
+    return int_states_to_prices(
+        int_states=int_states,
+        state_to_price_indices=state_to_price_indices,
+        possible_prices=possible_prices,
+    )
+
+
+def calc_compact_trajectory_values(trajectories, state_rewards, discount_rate):
+    """
+    Calculate the discounted value over all *trajectories.n_periods* periods of
+    each stored trajectory with *calc_discounted_value*. Hence, the cost does not
+    grow with the number of periods.
+
+    Args:
+        trajectories (CompactTrajectories): Trajectories stored as prefix plus cycle
+        state_rewards (array): Reward(s) in each integer state.
+                               Shape is (n_states,) or (n_states, n_agents).
+        discount_rate (float): Discount rate
+
+    Returns:
+        array: Discounted values. The shape is
+               trajectories.batch_shape + state_rewards.shape[1:].
+    """
+    n_trajectories = trajectories.prefix_lengths.shape[0]
+    values = np.empty((n_trajectories,) + state_rewards.shape[1:])
+    for trajectory_id in range(n_trajectories):
+        start = trajectories.offsets[trajectory_id]
+        stop = trajectories.offsets[trajectory_id + 1]
+        cycle_start = start + trajectories.prefix_lengths[trajectory_id]
+        values[trajectory_id] = calc_discounted_value(
+            transient_rewards=state_rewards[trajectories.int_states[start:cycle_start]],
+            cycle_rewards=state_rewards[trajectories.int_states[cycle_start:stop]],
+            discount_rate=discount_rate,
+            n_periods=trajectories.n_periods,
+        )
+    return values.reshape(trajectories.batch_shape + state_rewards.shape[1:])
+
+
+def compact_trajectories_from_tables(
+    transition_tables, head_int_states, n_periods, state_to_price_indices, possible_prices
+):
+    """
+    Store trajectories that follow the transition tables after a given head of
+    states as prefix plus cycle, without simulating all *n_periods*.
+
+    The head allows to store trajectories with exogenous deviations: Only the
+    states up to the last deviation have to be simulated, afterwards the
+    trajectory follows the transition table of its market.
+
+    Args:
+        transition_tables (array): Next integer state for each integer state
+                                   in each market. Shape is (n_markets, n_states).
+        head_int_states (array): First integer states of each trajectory. The
+                                 first axis is the market and the last axis the
+                                 period, e.g. (n_markets, n_head) or
+                                 (n_markets, n_states, n_head).
+        n_periods (integer): Number of periods of each trajectory
+        state_to_price_indices (array): Price indices for each integer state
+        possible_prices (array): Array of possible prices in the market.
+
+    Returns:
+        CompactTrajectories: Trajectories with batch shape
+                             head_int_states.shape[:-1].
+    """
+    batch_shape = head_int_states.shape[:-1]
+    market_index = np.arange(transition_tables.shape[0]).reshape(
+        (-1,) + (1,) * (len(batch_shape) - 1)
+    )
+
+    # The graph analysis tells for each state after how many periods the cycle
+    # is reached and how long it is.
+    state_graph = analyse_state_graph(transition_tables=transition_tables)
+    last_head_int_states = head_int_states[..., -1]
+    n_transient = state_graph["time_to_absorption"][
+        market_index, last_head_int_states
+    ]
+    cycle_length = state_graph["cycle_length"][market_index, last_head_int_states]
+
+    n_free_periods = np.max(n_transient + cycle_length)
+    free_int_states = np.empty(
+        batch_shape + (n_free_periods,), dtype=transition_tables.dtype
+    )
+    current_int_states = last_head_int_states
+    for period in range(n_free_periods):
+        free_int_states[..., period] = current_int_states
+        current_int_states = transition_tables[market_index, current_int_states]
+
+    # Keep the head and one pass through the cycle of each trajectory.
+    all_int_states = np.concatenate(
+        (
+            cast_checked(array=head_int_states[..., :-1], dtype=free_int_states.dtype),
+            free_int_states,
+        ),
+        axis=-1,
+    )
+    prefix_lengths = head_int_states.shape[-1] - 1 + n_transient
+    trajectory_lengths = prefix_lengths + cycle_length
+    is_stored = (
+        np.arange(all_int_states.shape[-1]) < trajectory_lengths[..., np.newaxis]
+    )
+
+    return CompactTrajectories(
+        int_states=all_int_states[is_stored],
+        offsets=np.concatenate(([0], np.cumsum(trajectory_lengths.ravel()))),
+        prefix_lengths=prefix_lengths.ravel(),
+        state_prices=possible_prices[state_to_price_indices],
+        n_periods=n_periods,
+        batch_shape=batch_shape,
+    )
@@ -6,16 +6,31 @@ A module to clean the data from the experiments with humans.
 import pandas as pd
 import numpy as np
 import json
+from functools import partial
 
 from bld.project_paths import project_paths as pp
 from bld.project_paths import project_paths_join as ppj
 
-from src.data_management.utils_experimental_data import app_to_sg
-from src.data_management.utils_experimental_data import split_column
-from src.data_management.utils_experimental_data import merge_new_column
+from src.data_management.utils_experimental_data import parse_otree_columns
+from src.data_management.utils_experimental_data import otree_wide_to_long
 from src.data_management.utils_experimental_data import merge_new_column_non_repeating
 from src.data_management.utils_experimental_data import add_super_group_id
 from src.data_management.utils_experimental_data import check_if_collusive
+from src.data_management.utils_experimental_data import iter_sessions
+from src.data_management.utils_experimental_data import select_session_columns
+
+# Get the round specific data for each super game
+# Note that the maximal round number  for each super game is hardcoded.
+LENGTH_FIRST_SUPER_GAME = 25
+LENGTH_SECOND_SUPER_GAME = 17
+LENGTH_THIRD_SUPER_GAME = 11
+MAX_ROUNDS = {'bertrand': LENGTH_FIRST_SUPER_GAME,
+              'bertrand_SG_2': LENGTH_SECOND_SUPER_GAME,
+              'bertrand_SG_3': LENGTH_THIRD_SUPER_GAME}
+ROUND_SPECIFIC_VARIABLES = ['winning_price', 'price', 'price_algorithm', 'id_in_group']
+
+# Columns that are not round specific
+SESSION_COLUMNS = ['participant.code', 'introduction.1.group.group_treatment']
 
 
 def clean_session(session_data, super_group_ids, data_identifier):
@@ -25,69 +40,15 @@ def clean_session(session_data, super_group_ids, data_identifier):
     experiment session at a time. We merge them together in a later step.
     """
 
-    # Get all variable names for melt command
-    # *participant.code* is used as an identifier and thus removed here.
-    val_vars = list(session_data)
-    val_vars.remove('participant.code')
-
-    # Melt data to get it in long format
-    data_long = pd.melt(frame=session_data,
-                        id_vars=['participant.code'],
-                        value_vars=val_vars,
-                        value_name='value',
-                        var_name='variable_long')
-
-    # Split the long variable names as they have been saved by otree
-    data_long['app'], data_long['round'], data_long['otree_object'], data_long['variable'] = zip(
-        *data_long['variable_long'].apply(lambda x: split_column(x)))
-    data_long = data_long[['participant.code', 'app',
-                           'round', 'variable', 'otree_object', 'value']].copy()
-
-    # Get the super game indicator
-    data_long['super_game'] = data_long['app'].transform(
-        lambda x: app_to_sg(x))
-
-    # Round is float given it is missing for some due to how otree works
-    data_long['round'] = data_long['round'].astype(float)
-
-    # We only need the group and player objects from otree
-    data_long = data_long.loc[data_long['otree_object'].isin(
-        ['group', 'player'])].copy()
-
-    # Add the super game (App) specific group ID
-    group_id_df = data_long.loc[data_long['variable'] == 'id_in_subsession'][[
-        'participant.code', 'app', 'value']].copy()
-    group_id_df.rename({'value': 'group_id'}, inplace=True, axis=1)
-    group_id_df = group_id_df.drop_duplicates().copy()
-    data_long = data_long.merge(
-        group_id_df, how='left', on=[
-            'participant.code', 'app'])
-
-    # Get the round specific data for each super game
-    # Note that the maximal round number  for each super game is hardcoded.
-    LENGTH_FIRST_SUPER_GAME = 25
-    LENGTH_SECOND_SUPER_GAME = 17
-    LENGTH_THIRD_SUPER_GAME = 11
-    data_round_specific = data_long.loc[((data_long['app'] == 'bertrand') &
-                                         (data_long['round'] <= LENGTH_FIRST_SUPER_GAME))
-                                        |
-                                        ((data_long['app'] == 'bertrand_SG_2') &
-                                         (data_long['round'] <= LENGTH_SECOND_SUPER_GAME))
-                                        |
-                                        ((data_long['app'] == 'bertrand_SG_3') &
-                                         (data_long['round'] <= LENGTH_THIRD_SUPER_GAME))
-                                        ].copy()
-
-    # Create a DataFrame which we will merge other variables onto
-    data_merge_on = data_round_specific[[
-        'participant.code', 'round', 'super_game', 'group_id']].drop_duplicates().copy()
-
-    # Add some round specific values as columns
-    for var in ['winning_price', 'price', 'price_algorithm', 'id_in_group']:
-        data_merge_on = merge_new_column(data_merge_on=data_merge_on,
-                                         data_merge_from=data_round_specific,
-                                         var_name=var)
-        data_merge_on[var] = data_merge_on[var].astype(float)
+    # Parse the long variable names as they have been saved by otree
+    schema = parse_otree_columns(columns=session_data.columns)
+
+    # Create a DataFrame with one row per participant, round and super game
+    # and add some round specific values as columns
+    data_merge_on = otree_wide_to_long(session_data=session_data,
+                                       schema=schema,
+                                       var_names=ROUND_SPECIFIC_VARIABLES,
+                                       max_rounds=MAX_ROUNDS)
 
     # Add the data identifier
     # This will usually be the session date/time as the dict in key in the session data
@@ -164,13 +125,17 @@ if __name__ == '__main__':
         4: [10, 11, 12]
     }
 
-    data_list = []
-    for session_id, session_info in SESSION_INFO.items():
-        current_data = pd.read_csv(ppj("IN_DATA", session_info['path']))
-        current_data_clean = clean_session(session_data=current_data,
-                                           super_group_ids=SUPER_GROUP_IDS,
-                                           data_identifier=session_id)
-        data_list.append(current_data_clean)
+    # Read and clean all sessions concurrently. Only the columns that are
+    # used in *clean_session* are parsed.
+    SESSION_PATHS = {session_id: ppj("IN_DATA", session_info['path'])
+                     for session_id, session_info in SESSION_INFO.items()}
+    data_list = list(iter_sessions(
+        session_paths=SESSION_PATHS,
+        select_columns=partial(select_session_columns,
+                               max_rounds=MAX_ROUNDS,
+                               var_names=ROUND_SPECIFIC_VARIABLES,
+                               extra_columns=SESSION_COLUMNS),
+        process_session=partial(clean_session, super_group_ids=SUPER_GROUP_IDS)))
     data_all = pd.concat(data_list)
 
     # Reset index 
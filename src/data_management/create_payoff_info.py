@@ -11,13 +11,35 @@ import numpy as np
 import pandas as pd
 import pickle
 import json
+from functools import partial
 
+from src.data_management.utils_experimental_data import iter_sessions
 
 
-def load_raw_data():
+def select_columns(columns, needed_columns):
+    """
+    
+    Select the *needed_columns* that exist in a session, keeping their order
+    in the session data.
+    """
+    return [column for column in columns if column in needed_columns]
+
+def add_session_id(session_data, data_identifier):
+    """
+    
+    Add the session ID as a column to the raw session data.
+    """
+    session_data['session_id'] = data_identifier
+    return session_data
+
+def load_raw_data(columns=None):
     """
     
     Loads entire data from the experiments.
+    The sessions are read concurrently.
+
+    Args:
+        columns (list): Columns to read. If None, all columns are read.
 
     Returns:
         DataFrame: Raw data from the experiments
@@ -30,11 +52,13 @@ def load_raw_data():
         SESSION_INFO = json.load(f)
 
     # Load all sessions data and add them together
-    data_list = []
-    for session_id, session_info in SESSION_INFO.items():
-        current_data = pd.read_csv(ppj("IN_DATA", session_info['path']))
-        current_data['session_id'] = session_id
-        data_list.append(current_data)
+    session_paths = {session_id: ppj("IN_DATA", session_info['path'])
+                     for session_id, session_info in SESSION_INFO.items()}
+    data_list = list(iter_sessions(
+        session_paths=session_paths,
+        select_columns=None if columns is None else partial(
+            select_columns, needed_columns=set(columns)),
+        process_session=add_session_id))
     data_all = pd.concat(data_list)
     return data_all
 
@@ -151,7 +175,11 @@ if __name__ == '__main__':
 
     # Create and save the dataframe with the payments for the participants 
     # that used an algorithm.
-    DATA_RAW = load_raw_data()
+    # Only the columns used for the payments are read
+    DATA_RAW = load_raw_data(
+        columns=['participant.payoff', 'bertrand.1.group.group_treatment']
+        + list(INFO_DICT['relevant_payoff_field_by_sg'].values())
+        + list(INFO_DICT['grouping_field_by_sg'].values()))
     payment_df = get_payment_info_for_algorithms(data = DATA_RAW,
                                                  info_dict = INFO_DICT,
                                                  conversion_rate = CONVERSION_RATE,
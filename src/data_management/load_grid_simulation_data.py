@@ -2,20 +2,72 @@
 
 A module to load the data from the Monte Carlo
 simulation
+
+The super star agents in each file are not deserialized, as only the
+metrics are stored. The data is ingested incrementally: An ingestion manifest records for each
+file its seed, size, modification time, content hash and position in the
+metric store. A rebuild only loads new or changed files.
+
+Note that the runs in the metric store are ordered by the time of ingestion
+and not by seed. Use the seeds in the ingestion manifest to map a run to its
+simulation file.
 """
 import json
-import pickle
+import os
 import sys
+import warnings
 from copy import copy
 
 import numpy as np
 
 from bld.project_paths import project_paths as pp
 from bld.project_paths import project_paths_join as ppj
-from src.data_management.utils_load_data import load_folder_files
+from src.data_management.utils_load_data import check_seeds
+from src.data_management.utils_load_data import find_files_to_ingest
+from src.data_management.utils_load_data import iter_files
+from src.data_management.utils_load_data import list_folder_files
+from src.data_management.utils_load_data import read_ingestion_manifest
+from src.data_management.utils_load_data import write_ingestion_manifest
+from src.library.utils_metric_store import append_to_metric_store
+from src.library.utils_metric_store import get_manifest_path
+from src.library.utils_metric_store import read_manifest
+from src.library.utils_metric_store import replace_in_metric_store
+from src.library.utils_metric_store import write_metric_store
+
+# Metrics in the order in which they are stored in each simulation file. The
+# super star agents follow as the last entry.
+GRID_METRICS = (
+    "state_profitability",
+    "weighted_profitability",
+    "best_response_share",
+    "avg_profit",
+    "avg_price",
+    "nash_equilibrium",
+)
+
+
+def list_grid_files(file_path):
+    """
+    List all files of the grid search simulation in the order of their seeds.
+    Missing seeds are reported as a warning.
+
+    Args:
+        file_path (string): Path to the simulation files
+
+    Returns:
+        tuple: all_paths, missing_seeds
+
+    Raises:
+        ValueError: If two files have the same seed.
+    """
+    all_paths = list_folder_files(file_path=file_path)
+    missing_seeds = check_seeds(all_paths=all_paths)
+    if missing_seeds:
+        warnings.warn(f"Seeds {missing_seeds} are missing in {file_path}.")
+    return all_paths, missing_seeds
 
 
-def load_grid_simulation_data(file_path):
+def load_grid_simulation_data(file_path, skip_agents=False):
     """
     Load all files from the grid search simulation which are stored in the
     directory *file_path* and write them to a list of lists.
@@ -24,6 +76,10 @@ def load_grid_simulation_data(file_path):
 
     Args:
         file_path (string): Path to the simulation files
+        skip_agents (bool): Do not deserialize the super star agents, which
+                            are the largest part of each file. They are
+                            replaced by placeholders and *qpricesim* is not
+                            imported.
 
     Returns:
         list: list of list with the outcome arrays
@@ -38,61 +94,171 @@ def load_grid_simulation_data(file_path):
               list[5]: Array with the Nash equilibria
               list[6]: All super star agents in the grid search
     """
-    # Get all files
-    simulation_results = load_folder_files(file_path=file_path)
-
-    # Unroll the dictionaries
-    all_dicts = [d.values() for d in simulation_results]
+    # Load all files in the order of the seeds and unroll the dictionaries
+    all_paths, _ = list_grid_files(file_path=file_path)
+    all_dicts = [
+        d.values() for d in iter_files(all_paths=all_paths, skip_objects=skip_agents)
+    ]
 
-    # TODO: Add a check here that all simulations are used and the seeds are all
-    # unique
     # TODO: Similar Code used in simulation part which is NOT in waf
     # Should be refactored!
     return all_dicts
 
 
-def sim_results_to_dict(file_path):
+def sim_results_to_dict(file_path, metrics=GRID_METRICS):
     """
 
     Returns the simulation results arrays.
+    The super star agents are never deserialized.
 
 
     Args:
         file_path (string): Path to the simulation files
+        metrics (tuple): Metrics to return
+
+    Returns:
+        dict: Dict with the simulation results arrays of the wanted metrics
+    """
+    return simulation_dicts_to_arrays(
+        all_simulation_dicts=load_grid_simulation_data(
+            file_path=file_path, skip_agents=True
+        ),
+        metrics=metrics,
+    )
+
+
+def simulation_dicts_to_arrays(all_simulation_dicts, metrics=GRID_METRICS):
+    """
+    Sort the unrolled simulation results by metric.
+
+    Args:
+        all_simulation_dicts (list): List with the unrolled dictionary of
+                                     each simulation file as returned by
+                                     *load_grid_simulation_data*.
+        metrics (tuple): Metrics to return
 
     Returns:
-        dict: Dict with all simulation results arrays
+        dict: Dict with the simulation results arrays of the wanted metrics
+
+    Raises:
+        KeyError: If a metric is not in *GRID_METRICS*.
     """
-    all_simulation_dicts = load_grid_simulation_data(file_path=file_path)
+    unknown_metrics = set(metrics) - set(GRID_METRICS)
+    if unknown_metrics:
+        raise KeyError(
+            f"Metrics {sorted(unknown_metrics)} are not in the simulation files. "
+            f"Available metrics are {list(GRID_METRICS)}."
+        )
 
     # Dropping the super star tuple here.
-    (
-        state_profitability_array,
-        weighted_profitability_array,
-        best_response_share_array,
-        avg_profit_array,
-        avg_price_array,
-        nash_equilibrium_array,
-        _,
-    ) = zip(*all_simulation_dicts)
-
-    all_arrays = {}
-    all_arrays["state_profitability"] = state_profitability_array
-    all_arrays["weighted_profitability"] = weighted_profitability_array
-    all_arrays["best_response_share"] = best_response_share_array
-    all_arrays["avg_profit"] = avg_profit_array
-    all_arrays["avg_price"] = avg_price_array
-    all_arrays["nash_equilibrium"] = nash_equilibrium_array
-
-    return all_arrays
+    all_metric_arrays = dict(
+        zip(GRID_METRICS, list(zip(*all_simulation_dicts))[: len(GRID_METRICS)])
+    )
+    return {metric: all_metric_arrays[metric] for metric in metrics}
+
+
+def get_ingestion_manifest_path(store_prefix):
+    """
+    Get the path of the ingestion manifest of a metric store.
+
+    Args:
+        store_prefix (string): Path of the metric store without file ending
+
+    Returns:
+        string: Path of the ingestion manifest
+    """
+    return f"{store_prefix}_ingestion.json"
+
+
+def ingest_grid_simulation_data(file_path, store_prefix):
+    """
+    Bring the metric store up to date with the simulation files in the
+    directory *file_path*.
+
+    New files are appended to the store and changed files overwrite their
+    runs in place. If ingested files were removed or the store does not
+    match the ingestion manifest, the store is rebuilt from all files.
+    Note that the runs in the store are ordered by the time of ingestion.
+
+    Args:
+        file_path (string): Path to the simulation files
+        store_prefix (string): Path of the metric store without file ending
+
+    Raises:
+        ValueError: If there are no simulation files or two files have the
+                    same seed.
+    """
+    all_paths, missing_seeds = list_grid_files(file_path=file_path)
+    if not all_paths:
+        raise ValueError(f"There are no simulation files in {file_path}.")
+
+    ingestion_manifest_path = get_ingestion_manifest_path(store_prefix=store_prefix)
+    store_manifest_path = get_manifest_path(store_prefix=store_prefix)
+    ingested_files = read_ingestion_manifest(manifest_path=ingestion_manifest_path)
+
+    # Runs of removed files cannot be dropped in place.
+    all_file_names = {os.path.basename(in_path) for in_path in all_paths}
+    if (
+        not os.path.exists(store_manifest_path)
+        or not set(ingested_files) <= all_file_names
+        or any(
+            metric_info["shape"][0] != len(ingested_files)
+            for metric_info in read_manifest(store_manifest_path)["metrics"].values()
+        )
+    ):
+        ingested_files = {}
+
+    new_paths, changed_paths, file_records = find_files_to_ingest(
+        all_paths=all_paths, ingested_files=ingested_files
+    )
+
+    if changed_paths:
+        replace_in_metric_store(
+            store_prefix=store_prefix,
+            runs=[
+                file_records[os.path.basename(in_path)]["run"]
+                for in_path in changed_paths
+            ],
+            metric_arrays=simulation_dicts_to_arrays(
+                all_simulation_dicts=[
+                    d.values()
+                    for d in iter_files(all_paths=changed_paths, skip_objects=True)
+                ]
+            ),
+        )
+
+    if new_paths:
+        new_metric_arrays = simulation_dicts_to_arrays(
+            all_simulation_dicts=[
+                d.values()
+                for d in iter_files(all_paths=new_paths, skip_objects=True)
+            ]
+        )
+        if ingested_files:
+            first_new_run = append_to_metric_store(
+                store_prefix=store_prefix, metric_arrays=new_metric_arrays
+            )
+        else:
+            write_metric_store(
+                store_prefix=store_prefix, metric_arrays=new_metric_arrays
+            )
+            first_new_run = 0
+        for ix_new, in_path in enumerate(new_paths):
+            file_records[os.path.basename(in_path)]["run"] = first_new_run + ix_new
+
+    write_ingestion_manifest(
+        manifest_path=ingestion_manifest_path,
+        ingested_files=file_records,
+        missing_seeds=missing_seeds,
+    )
 
 
 if __name__ == "__main__":
     n_agents = sys.argv[1]
 
-    # Load all data from project path
-    OUT_ARRAYS = sim_results_to_dict(pp[f"IN_SIMULATION_GRID_{n_agents}_AGENT"])
-
-    # Write it to OUT_DATA
-    with open(ppj("OUT_DATA", f"grid_{n_agents}_agents.pickle"), "wb") as outfile:
-        pickle.dump(OUT_ARRAYS, outfile)
+    # Ingest new and changed files from the project path into the metric
+    # store in OUT_DATA
+    ingest_grid_simulation_data(
+        file_path=pp[f"IN_SIMULATION_GRID_{n_agents}_AGENT"],
+        store_prefix=ppj("OUT_DATA", f"grid_{n_agents}_agents"),
+    )
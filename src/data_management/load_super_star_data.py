@@ -4,15 +4,22 @@ A module to load the data from the
 super star simulations and write it
 to a single file.
 """
+import os
 import pickle
 import sys
+import warnings
 
 from bld.project_paths import project_paths as pp
 from bld.project_paths import project_paths_join as ppj
-from src.data_management.utils_load_data import load_folder_files
+from src.data_management.utils_load_data import check_seeds
+from src.data_management.utils_load_data import get_seed
+from src.data_management.utils_load_data import iter_files
+from src.data_management.utils_load_data import list_folder_files
+from src.library.utils_q_table_archive import write_q_table_archive
+from src.library.utils_super_star_catalog import write_super_star_catalog
 
 
-def load_and_write_super_star_data(in_path, out_path):
+def load_and_write_super_star_data(in_path, out_path, catalog_prefix, archive_path):
     """
     A function to load all raw super star simulation data
     which is spread across different files and store
@@ -20,20 +27,57 @@ def load_and_write_super_star_data(in_path, out_path):
     It is assumed that all raw simulation files can be found
     under the *in_path* and are pickle.
 
+    Additionally, the markets are written to an indexed catalog
+    (see *utils_super_star_catalog*) from which single markets can
+    be loaded by their seed and the Q-tables are packed into an
+    archive (see *utils_q_table_archive*), from which the analysis
+    loads the markets.
+
     Args:
         in_path (string): File path under which the files are stored
         out_path (string): Path to the file we write the list of
                            super star simulation outputs to.
+        catalog_prefix (string): Path of the super star catalog without
+                                 file ending
+        archive_path (string): Path of the Q-table archive
+
+    Raises:
+        ValueError: If two files have the same seed or a file has no seed.
     """
-    list_all_super_stars = load_folder_files(file_path=in_path)
+    all_paths = list_folder_files(file_path=in_path)
+
+    # The catalog and the archive identify the markets by their seed.
+    missing_seeds = check_seeds(all_paths=all_paths)
+    if missing_seeds:
+        warnings.warn(f"Seeds {missing_seeds} are missing in {in_path}.")
+    list_all_super_stars = list(iter_files(all_paths=all_paths))
 
     with open(out_path, "wb") as outfile:
         pickle.dump(list_all_super_stars, outfile)
 
+    all_seeds = [get_seed(file_name=os.path.basename(path)) for path in all_paths]
+    write_super_star_catalog(
+        super_star_tuples=list_all_super_stars,
+        seeds=all_seeds,
+        catalog_prefix=catalog_prefix,
+    )
+    write_q_table_archive(
+        super_star_tuples=list_all_super_stars,
+        seeds=all_seeds,
+        archive_path=archive_path,
+    )
+
 
 if __name__ == "__main__":
     n_agents = sys.argv[1]
 
     IN_PATH = pp[f"IN_SIMULATION_SUPER_STARS_{n_agents}_AGENT"]
     OUT_FILE_PATH = ppj("OUT_DATA", f"all_super_stars_{n_agents}_agents.pickle")
-    load_and_write_super_star_data(in_path=IN_PATH, out_path=OUT_FILE_PATH)
+    CATALOG_PREFIX = ppj("OUT_DATA", f"super_star_catalog_{n_agents}_agents")
+    ARCHIVE_PATH = ppj("OUT_DATA", f"super_star_archive_{n_agents}_agents.npz")
+    load_and_write_super_star_data(
+        in_path=IN_PATH,
+        out_path=OUT_FILE_PATH,
+        catalog_prefix=CATALOG_PREFIX,
+        archive_path=ARCHIVE_PATH,
+    )
@@ -9,57 +9,10 @@ import numpy as np
 import json
 import pickle
 from bld.project_paths import project_paths_join as ppj
+from src.library.utils_grid_index import GridIndex
+from src.library.utils_metric_store import load_metric
 
 
-
-def recreate_grids(grid_info):
-    """
-    A function to create the simulation grid to retrieve the relevant indices 
-    that ended up being the super star agents.
-
-
-    Args:
-        grid_info (dict): Information over the used grid
-
-    Returns:
-        tuple: beta_grid, alpha_grid
-    """
-    # Recreate the grid to retrieve the avg prices upon convergence which are of interest to us
-    alpha_grid = list(
-        np.linspace(
-            grid_info['alpha_min'],
-            grid_info['alpha_max'],
-            grid_info['grid_points'],
-        )
-    )
-    beta_grid = list(
-        np.linspace(
-            grid_info['beta_min'],
-            grid_info['beta_max'],
-            grid_info['grid_points'],
-        )
-    )
-
-    return beta_grid, alpha_grid
-
-def get_indices(parameter_super_star, beta_grid, alpha_grid):
-    """
-    
-    Retrieve the indices of alpha and beta in the respective grids
-    for the super star agents.
-
-    Args:
-        parameter_super_star (dict): Super star dict with infos about learning rate and decay
-        beta_grid (array): Array with all betas used as in the simulation study
-        alpha_grid (array): Array with all alphas used as in the simulation study
-
-    Returns:
-        tuple: beta_index, alpha_index
-    """
-    beta_index = beta_grid.index(parameter_super_star['beta_decay'])
-    alpha_index = alpha_grid.index(parameter_super_star['learning_rate'])
-    return beta_index, alpha_index
-
 def create_and_save_subsets(n_agents):
     """
     
@@ -73,24 +26,27 @@ def create_and_save_subsets(n_agents):
         n_agents (int): Number of firms in the market
     """
 
-    with open(ppj("OUT_DATA", f"grid_{n_agents}_agents.pickle"), "rb") as f:
-        all_output_grids = pickle.load(f)
-
     with open(ppj("IN_SIMULATION_PARAMETER", f"parameter_super_star_{n_agents}_agent.json"), "r") as f:
         PARAMETER_SUPER_STAR = json.load(f)
 
-    with open(ppj("IN_SIMULATION_PARAMETER", f"parameter_{n_agents}_agent_cases.json"), "r") as f:
-        GRID_INFO = json.load(f)
-
-    beta_grid_recreated, alpha_grid_recreated = recreate_grids(grid_info=GRID_INFO)
-    BETA_INDEX, ALPHA_INDEX = get_indices(parameter_super_star = PARAMETER_SUPER_STAR,
-                                          beta_grid = beta_grid_recreated,
-                                          alpha_grid = alpha_grid_recreated)
-    avg_price_grid = np.array(all_output_grids['avg_price'])
+    grid_index = GridIndex.from_parameter_file(
+        parameter_path=ppj(
+            "IN_SIMULATION_PARAMETER", f"parameter_{n_agents}_agent_cases.json"
+        )
+    )
+    # Only the average prices are read and they are memory mapped
+    avg_price_grid = load_metric(
+        manifest_path=ppj("OUT_DATA", f"grid_{n_agents}_agents_manifest.json"),
+        metric="avg_price",
+    )
 
     # First position is the observation, second the alpha, third the beta 
     # as it has been implemented in the simulation study
-    super_star_avg_prices = avg_price_grid[:, ALPHA_INDEX, BETA_INDEX]
+    super_star_avg_prices = grid_index.cells(
+        metric_array=avg_price_grid,
+        alphas=PARAMETER_SUPER_STAR["learning_rate"],
+        betas=PARAMETER_SUPER_STAR["beta_decay"],
+    )
 
     # Dimension 1 and 2 are alpha and beta, dimension zero is the Monte Carlo 
     # repetition.
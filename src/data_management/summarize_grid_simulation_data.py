@@ -0,0 +1,85 @@
+"""
+
+Summarize the metrics of the grid search simulation per (alpha, beta) cell.
+
+The runs of each metric are streamed from the metric store in chunks and
+aggregated with the running statistics from *utils_streaming_stats*. Hence,
+the memory needed does not grow with the number of runs. The summary holds
+the mean, variance, approximate quantiles and threshold exceedance shares of
+each cell as specified in *grid_summary.json*.
+"""
+import json
+import pickle
+import sys
+
+from bld.project_paths import project_paths_join as ppj
+from src.library.utils_metric_store import load_metric
+from src.library.utils_metric_store import read_manifest
+from src.library.utils_streaming_stats import finalize_running_stats
+from src.library.utils_streaming_stats import init_running_stats
+from src.library.utils_streaming_stats import update_running_stats
+
+
+def summarize_metric(metric_array, metric_spec, chunk_size, quantiles):
+    """
+    Summarize the runs of a single metric in one pass.
+
+    Args:
+        metric_array (array): Array of the metric, usually memory mapped.
+                              Shape is (n_runs, grid_points, grid_points).
+        metric_spec (dict): Histogram range, number of bins and thresholds
+                            of the metric
+        chunk_size (integer): Number of runs read at once
+        quantiles (list): Quantiles to approximate
+
+    Returns:
+        dict: Summary statistics as returned by *finalize_running_stats*
+    """
+    running_stats = init_running_stats(
+        cell_shape=metric_array.shape[1:],
+        bin_range=metric_spec["bin_range"],
+        n_bins=metric_spec["n_bins"],
+        thresholds=metric_spec["thresholds"],
+    )
+    for ix_start in range(0, metric_array.shape[0], chunk_size):
+        running_stats = update_running_stats(
+            running_stats=running_stats,
+            runs=metric_array[ix_start : ix_start + chunk_size],
+        )
+    return finalize_running_stats(running_stats=running_stats, quantiles=quantiles)
+
+
+def summarize_grid_simulation_data(manifest_path, summary_spec):
+    """
+    Summarize all metrics of a metric store.
+
+    Args:
+        manifest_path (string): Path of the manifest of the metric store
+        summary_spec (dict): Specification as in *grid_summary.json*
+
+    Returns:
+        dict: Mapping from metric to its summary statistics
+    """
+    all_summaries = {}
+    for metric in read_manifest(manifest_path=manifest_path)["metrics"]:
+        all_summaries[metric] = summarize_metric(
+            metric_array=load_metric(manifest_path=manifest_path, metric=metric),
+            metric_spec=summary_spec["metrics"][metric],
+            chunk_size=summary_spec["chunk_size"],
+            quantiles=summary_spec["quantiles"],
+        )
+    return all_summaries
+
+
+if __name__ == "__main__":
+    n_agents = sys.argv[1]
+
+    with open(ppj("IN_MODEL_SPECS", "grid_summary.json")) as f:
+        SUMMARY_SPEC = json.load(f)
+
+    all_summaries = summarize_grid_simulation_data(
+        manifest_path=ppj("OUT_DATA", f"grid_{n_agents}_agents_manifest.json"),
+        summary_spec=SUMMARY_SPEC,
+    )
+    with open(ppj("OUT_DATA", f"grid_{n_agents}_agents_summary.pickle"), "wb") as f:
+        pickle.dump(all_summaries, f)
@@ -10,15 +10,13 @@ import json
 import pickle
 import sys
 
+import numpy as np
+
 from bld.project_paths import project_paths as pp
 from bld.project_paths import project_paths_join as ppj
+from src.library.utils_state_encoding import get_n_states
+from src.library.utils_state_encoding import int_states_to_price_states
 from qpricesim.simulations.utils_simulation import gen_possible_prices
-from qpricesim.simulations.utils_simulation import (
-    gen_price_combination_byte_mappings,
-)
-from qpricesim.simulations.utils_simulation import (
-    int_state_to_price_state,
-)
 
 
 def create_best_response_dict(super_star, parameter):
@@ -29,26 +27,26 @@ def create_best_response_dict(super_star, parameter):
 
     Args:
         super_star (QLearningAgent): The best-performing agent from the grid search
-        parameter (dict): Parameter dict as explained somewhere else TODO
+        parameter (dict): Market specs as defined in *utils_state_encoding*
 
     Returns:
         dict: Dictionary which maps price state to picked price actions from the
               super star agent.
     """
-    _, int_to_prices_dict = gen_price_combination_byte_mappings(parameter=parameter)
-    all_int_states = int_to_prices_dict.keys()
+    n_states = get_n_states(parameter=parameter)
+    all_price_states = int_states_to_price_states(
+        int_states=np.arange(n_states), parameter=parameter
+    )
     price_array = gen_possible_prices(parameter=parameter)
     agent_br_dict = {}
 
     # For each integer state get the best response (price) of the
     # agent and the corresponding price state representation
     # and add it to a dict.
-    for int_state in all_int_states:
+    for int_state in range(n_states):
         br_int_action = super_star.get_best_action(int_state)
         br_price_action = price_array[br_int_action]
-        price_state = int_state_to_price_state(
-            int_state=int_state, int_to_prices_dict=int_to_prices_dict
-        )
+        price_state = all_price_states[int_state]
 
         # Make price state immutable (e.g. to tuple) such that it can act as a
         # key
@@ -68,15 +66,12 @@ def int_state_of_convergence_to_prices(int_state, parameter):
         int_state (integer): Integer/index representation of
                              the state of convergence of the
                              super star agent.
-        parameter (dict): Explained somewhere else TODO
+        parameter (dict): Market specs as defined in *utils_state_encoding*
 
     Returns:
         array: Array of prices, which are the state of convergence.
     """
-    _, int_to_prices_dict = gen_price_combination_byte_mappings(parameter=parameter)
-    price_state = int_state_to_price_state(
-        int_state=int_state, int_to_prices_dict=int_to_prices_dict
-    )
+    price_state = int_states_to_price_states(int_states=int_state, parameter=parameter)
     return tuple(price_state)
 
 
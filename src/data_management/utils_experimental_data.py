@@ -3,8 +3,13 @@
 A collection of function that are used for data cleaning.
 """
 
+import csv
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import pandas as pd
+from pyarrow import csv as pa_csv
 
 def split_column(x):
     """
@@ -35,36 +40,146 @@ def app_to_sg(x):
     else:
         return np.nan
     
-def make_data_column_long(data_in, var_name):
+def parse_otree_columns(columns):
+    """
+    
+    Parse the column names of a wide oTree export once into a DataFrame
+    with the columns app, round, otree_object and variable and one row per
+    column in the order of *columns*.
+    """
+    schema = pd.DataFrame([split_column(x) for x in columns],
+                          columns=['app', 'round', 'otree_object', 'variable'])
+    schema['column'] = list(columns)
+    schema['round'] = schema['round'].astype(float)
+    return schema
+
+def otree_wide_to_long(session_data, schema, var_names, max_rounds):
     """
     
-    Takes a specfic variable from the raw oTree data
-    and takes the subset of this data for each participant
-    round and super game.
+    Reshape the round specific variables *var_names* of the group and player
+    objects from the wide oTree data to a long panel with one row per
+    participant, round and super game.
+
+    Only the columns of the apps in *max_rounds* up to their maximal round
+    are selected from *session_data* using the parsed column names in
+    *schema*. The panel is ordered by the first column of each app and round
+    and the participants within, which is the order of the melted data.
+    The group ID is the ID of the group within the subsession in the
+    respective app. It is taken from the first round of each app for all
+    rounds (the melted data got one row per distinct group ID if the ID
+    changed between rounds). It is a float if all group and player columns
+    of *session_data* are numeric and an object otherwise, as the value
+    column of the melted data. All variables are returned as floats and are
+    missing if they do not exist in a round.
     """
-    data_out = data_in.loc[data_in['variable'] == var_name][['participant.code', 'round', 'super_game', 'value']].copy()
-    data_out.rename({'value': var_name}, inplace=True, axis=1)
+    schema = schema.loc[schema['otree_object'].isin(['group', 'player'])]
+    participants = session_data['participant.code']
+    n_participants = len(participants)
+
+    # The group ID is taken from the first round of each app
+    group_id_columns = schema.loc[schema['variable'] == 'id_in_subsession']
+    group_id_columns = group_id_columns.drop_duplicates(subset=['app']).set_index('app')['column']
+
+    # Cells of the panel
+    schema_round_specific = schema.loc[schema['app'].isin(list(max_rounds)) &
+                                       (schema['round'] <= schema['app'].map(max_rounds))]
+    panel_cells = schema_round_specific[['app', 'round']].drop_duplicates().reset_index(drop=True)
+    n_cells = len(panel_cells)
+
+    data_out = pd.DataFrame({
+        'participant.code': np.tile(participants.to_numpy(), n_cells),
+        'round': np.repeat(panel_cells['round'].to_numpy(), n_participants),
+        'super_game': np.repeat(panel_cells['app'].map(app_to_sg).to_numpy(dtype=float),
+                                n_participants),
+    })
+    data_out['participant.code'] = data_out['participant.code'].astype(participants.dtype)
+
+    is_numeric = session_data[schema['column']].dtypes.map(pd.api.types.is_numeric_dtype)
+    group_id_dtype = float if is_numeric.all() else object
+    group_ids = np.full((n_cells, n_participants), np.nan, dtype=group_id_dtype)
+    for ix_cell, app in enumerate(panel_cells['app']):
+        if app in group_id_columns:
+            group_ids[ix_cell] = session_data[group_id_columns[app]].astype(
+                group_id_dtype).to_numpy()
+    data_out['group_id'] = pd.Series(group_ids.ravel(), dtype=group_id_dtype)
+
+    # Position of the column of each variable in each cell of the panel
+    cell_columns = schema_round_specific.loc[schema_round_specific['variable'].isin(var_names)]
+    if cell_columns.duplicated(subset=['app', 'round', 'variable']).any():
+        raise ValueError('A variable exists in the group and the player object.')
+    cell_columns = cell_columns.merge(panel_cells.reset_index(), on=['app', 'round'])
+
+    for var_name in var_names:
+        var_columns = cell_columns.loc[cell_columns['variable'] == var_name]
+        var_values = np.full((n_cells, n_participants), np.nan)
+        var_values[var_columns['index'].to_numpy()] = session_data[
+            var_columns['column']].astype(float).to_numpy().T
+        data_out[var_name] = var_values.ravel()
     return data_out
 
-def merge_new_column(data_merge_on, data_merge_from, var_name):
+def select_session_columns(columns, max_rounds, var_names, extra_columns=()):
     """
     
-    A function that looks for the variable *var_name* in the raw otree dataframe 
-    *data_merge_from* and merges it to the dataframe *data_merge_on* in the long format.
+    Select the columns of a wide oTree export that are needed to reshape the
+    round specific variables *var_names* with *otree_wide_to_long*, i.e.
+    those variables up to the maximal round of each app in *max_rounds* and
+    the group IDs, and the *extra_columns*. The columns keep their order.
+    """
+    schema = parse_otree_columns(columns=columns)
+    is_app_column = (schema['otree_object'].isin(['group', 'player']) &
+                     schema['app'].isin(list(max_rounds)))
+    is_needed = is_app_column & ((schema['variable'] == 'id_in_subsession') |
+                                 (schema['variable'].isin(var_names) &
+                                  (schema['round'] <= schema['app'].map(max_rounds))))
+    return schema.loc[is_needed | schema['column'].isin(extra_columns), 'column'].tolist()
+
+def read_session_csv(in_path, select_columns=None):
+    """
     
-    This function is used for variables that are repeated across rounds and super games.
+    Read the wide oTree export of a session with the pyarrow CSV reader.
+    If *select_columns* is given, it is called with the column names of the
+    header and only the returned columns are parsed.
     """
+    convert_options = None
+    if select_columns is not None:
+        with open(in_path, newline='') as f:
+            header = next(csv.reader(f))
+        convert_options = pa_csv.ConvertOptions(
+            include_columns=select_columns(columns=header))
+    return pa_csv.read_csv(in_path, convert_options=convert_options).to_pandas()
 
-    # Create the new dataframe from the split-up but raw otree data
-    # Note that this dataframe includes the columns
-    # participant.code, round, super_game and var_name.
-    data_new_column = make_data_column_long(data_in = data_merge_from,
-                                            var_name = var_name)
+def load_session(session_id, in_path, select_columns=None, process_session=None):
+    """
     
-    # Merge the new column to the clean data frame
-    data_out = data_merge_on.merge(data_new_column, how= 'left', on=['participant.code', 'round', 'super_game'])
-    return data_out.copy()
+    Read a single session and process it with *process_session*, which is
+    called with the session data and the session ID as *data_identifier*.
+    """
+    session_data = read_session_csv(in_path=in_path, select_columns=select_columns)
+    if process_session is None:
+        return session_data
+    return process_session(session_data=session_data, data_identifier=session_id)
 
+def iter_sessions(session_paths, select_columns=None, process_session=None,
+                  n_workers=None, use_processes=True):
+    """
+    
+    Read and process all sessions concurrently and yield the results in the
+    order of *session_paths*, a dict from session ID to the path of the
+    session CSV. See *load_session* for the other arguments.
+
+    The sessions are handled by a pool of processes as the processing is
+    mostly pure Python. *select_columns* and *process_session* must then be
+    picklable, e.g. module level functions or *functools.partial* of them.
+    """
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    all_session_ids = list(session_paths)
+    with executor_class(max_workers=n_workers) as executor:
+        yield from executor.map(
+            load_session,
+            all_session_ids,
+            [session_paths[session_id] for session_id in all_session_ids],
+            [select_columns] * len(all_session_ids),
+            [process_session] * len(all_session_ids))
 
 def add_super_group_id(individual_group_id, super_group_ids, treatment):
     """
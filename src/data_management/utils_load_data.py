@@ -4,35 +4,362 @@ Collection of utility function
 used in different data management
 scripts.
 """
+import hashlib
+import json
+import os
 import pickle
-from os import walk
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
 
+SEED_PATTERN = re.compile(r"_seed_(\d+)\.pickle$")
 
-def load_folder_files(file_path):
+# Modules whose classes are still created when objects are skipped.
+KEPT_MODULES = ("builtins", "collections", "copyreg", "numpy")
+
+
+def get_seed(file_name):
+    """
+    Get the seed of a simulation file from its name, e.g. 17 for
+    *simulated_arrays_2_agents_seed_17.pickle*.
+
+    Args:
+        file_name (string): Name of the file
+
+    Returns:
+        integer: Seed of the file or None if the name contains no seed.
+    """
+    match = SEED_PATTERN.search(file_name)
+    if match is None:
+        return None
+    return int(match.group(1))
+
+
+def list_folder_files(file_path):
+    """
+    List all files in a given directory (without subdirectories) in the
+    order of their seeds. Files without a seed in their name come last,
+    ordered by name.
+
+    Args:
+        file_path (string): Path to the files
+
+    Returns:
+        list: List of the full paths of the files
+    """
+    with os.scandir(file_path) as entries:
+        all_files = [entry.name for entry in entries if entry.is_file()]
+
+    def sort_key(file_name):
+        seed = get_seed(file_name=file_name)
+        return (seed is None, seed if seed is not None else 0, file_name)
+
+    return [
+        os.path.join(file_path, file_name)
+        for file_name in sorted(all_files, key=sort_key)
+    ]
+
+
+class SkippedObject:
+    """
+    Placeholder for an object that was not deserialized. All arguments and
+    the state of the original object are discarded.
+    """
+
+    def __new__(cls, *args, **kwargs):
+        return super().__new__(cls)
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __setstate__(self, state):
+        pass
+
+
+class SkippingUnpickler(pickle.Unpickler):
+    """
+    Unpickler that replaces instances of classes outside of *KEPT_MODULES*,
+    e.g. the QLearningAgents of *qpricesim*, by a *SkippedObject*. Hence,
+    those objects are neither built nor is their package imported.
+    """
+
+    def find_class(self, module, name):
+        if module.split(".")[0] in KEPT_MODULES:
+            return super().find_class(module, name)
+        return SkippedObject
+
+
+def load_pickle(in_path, skip_objects=False):
+    """
+    Load a single pickle file.
+
+    Args:
+        in_path (string): Path to the file
+        skip_objects (bool): Replace instances of classes that are not
+                             builtin or from numpy by a *SkippedObject*.
+
+    Returns:
+        object: Object stored in the file
+    """
+    with open(in_path, "rb") as f:
+        if skip_objects:
+            return SkippingUnpickler(f).load()
+        return pickle.load(f)
+
+
+def iter_files(
+    all_paths, n_workers=None, use_processes=False, verbose=True, skip_objects=False
+):
+    """
+    Load pickle files concurrently and yield their contents in the order of
+    *all_paths*.
+
+    Files are loaded by a pool of threads, which overlaps the reading of the
+    files. With *use_processes* the unpickling itself runs in parallel,
+    but each result is pickled once more to send it back to the main process.
+
+    At most 2 * n_workers files are loaded ahead of the consumer, hence the
+    memory does not grow with the number of files if the consumer is slower
+    than the pool. If the generator is closed early, the files that are not
+    loaded yet are cancelled.
+
+    Args:
+        all_paths (list): Paths of the files
+        n_workers (integer): Number of workers. If None, the number of CPUs
+                             (plus four for threads, at most 32) is used as
+                             in *concurrent.futures*.
+        use_processes (bool): Load the files in a pool of processes instead
+                              of threads.
+        verbose (bool): Print the throughput after all files are loaded.
+        skip_objects (bool): Skip instances of classes that are not builtin
+                             or from numpy (see *load_pickle*).
+
+    Yields:
+        object: Element that was stored in the next pickle file
+    """
+    if n_workers is None:
+        n_cpus = os.cpu_count() or 1
+        n_workers = n_cpus if use_processes else min(32, n_cpus + 4)
+    executor_class = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    load_file = partial(load_pickle, skip_objects=skip_objects)
+
+    start_time = time.perf_counter()
+    remaining_paths = iter(all_paths)
+    pending_futures = deque()
+    executor = executor_class(max_workers=n_workers)
+    try:
+        for in_path in islice(remaining_paths, 2 * n_workers):
+            pending_futures.append(executor.submit(load_file, in_path))
+        while pending_futures:
+            loaded_object = pending_futures.popleft().result()
+            # Keep the window full while the consumer handles the result.
+            for in_path in islice(remaining_paths, 1):
+                pending_futures.append(executor.submit(load_file, in_path))
+            yield loaded_object
+    finally:
+        # Files that are not loaded yet are cancelled before the pool is shut
+        # down (*cancel_futures* of *shutdown* requires Python 3.9).
+        for future in pending_futures:
+            future.cancel()
+        executor.shutdown(wait=True)
+    elapsed_time = time.perf_counter() - start_time
+
+    if verbose:
+        n_megabytes = sum(os.path.getsize(in_path) for in_path in all_paths) / 1e6
+        print(
+            f"Loaded {len(all_paths)} files ({n_megabytes:.1f} MB) "
+            f"in {elapsed_time:.1f}s "
+            f"({len(all_paths) / max(elapsed_time, 1e-9):.0f} files/s, "
+            f"{n_megabytes / max(elapsed_time, 1e-9):.1f} MB/s)."
+        )
+
+
+def iter_folder_files(file_path, n_workers=None, use_processes=False, verbose=True):
+    """
+    Load all files in a given directory concurrently and yield their contents
+    in the order of the seeds (see *list_folder_files* and *iter_files*).
+    Note that its assumed that in the folder all files are pickle files.
+
+    Args:
+        file_path (string): Path to the files
+        n_workers (integer): Number of workers. If None, the default of
+                             *concurrent.futures* is used.
+        use_processes (bool): Load the files in a pool of processes instead
+                              of threads.
+        verbose (bool): Print the throughput after all files are loaded.
+
+    Yields:
+        object: Element that was stored in the next pickle file
+    """
+    yield from iter_files(
+        all_paths=list_folder_files(file_path=file_path),
+        n_workers=n_workers,
+        use_processes=use_processes,
+        verbose=verbose,
+    )
+
+
+def load_folder_files(file_path, n_workers=None, use_processes=False):
     """
     A function to load all files in a given
     directory and return it as a list.
     Note that its assumed that in the folder
     all files are pickle files.
 
+    The files are loaded concurrently and the list
+    is ordered by the seeds in the file names
+    (see *iter_folder_files*).
+
     Args:
         file_path (string): Path to the files
+        n_workers (integer): Number of workers. If None, the default of
+                             *concurrent.futures* is used.
+        use_processes (bool): Load the files in a pool of processes instead
+                              of threads.
 
     Returns:
         list: List of elements that were stored in the
               the pickle files.
     """
-    # Get all files
-    all_files = []
-    for (dirpath, dirnames, filenames) in walk(file_path):
-        all_files.extend(filenames)
-        break
+    return list(
+        iter_folder_files(
+            file_path=file_path, n_workers=n_workers, use_processes=use_processes
+        )
+    )
+
+
+def hash_file(in_path, chunk_size=2 ** 20):
+    """
+    Calculate the SHA-256 hash of the content of a file.
 
-    # Load the files
-    out_results = []
-    for file in all_files:
-        in_path = file_path + "\\" + file
-        with open(in_path, "rb") as f:
-            out_results.append(pickle.load(f))
+    Args:
+        in_path (string): Path to the file
+        chunk_size (integer): Number of bytes read at once
+
+    Returns:
+        string: Hex digest of the hash
+    """
+    file_hash = hashlib.sha256()
+    with open(in_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def check_seeds(all_paths):
+    """
+    Check the seeds of simulation files for duplicates and gaps.
+
+    Args:
+        all_paths (list): Paths of the files
+
+    Returns:
+        list: Seeds between one and the largest seed for which no file exists
+
+    Raises:
+        ValueError: If two files have the same seed or a file has no seed.
+    """
+    all_seeds = {}
+    for in_path in all_paths:
+        seed = get_seed(file_name=os.path.basename(in_path))
+        if seed is None:
+            raise ValueError(f"{in_path} has no seed in its name.")
+        if seed in all_seeds:
+            raise ValueError(f"Seed {seed} is used by {all_seeds[seed]} and {in_path}.")
+        all_seeds[seed] = in_path
+
+    if not all_seeds:
+        return []
+    return sorted(set(range(1, max(all_seeds) + 1)) - set(all_seeds))
+
+
+def read_ingestion_manifest(manifest_path):
+    """
+    Read the ingestion manifest, which records for each ingested file its
+    seed, size, modification time, content hash and position in the
+    consolidated store.
+
+    Args:
+        manifest_path (string): Path of the ingestion manifest
+
+    Returns:
+        dict: Mapping from file name to its record. Empty if nothing has been
+              ingested yet.
+    """
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)["files"]
+
+
+def write_ingestion_manifest(manifest_path, ingested_files, missing_seeds):
+    """
+    Write the ingestion manifest.
+
+    Args:
+        manifest_path (string): Path of the ingestion manifest
+        ingested_files (dict): Mapping from file name to its record
+        missing_seeds (list): Seeds for which no file exists
+    """
+    with open(manifest_path, "w") as f:
+        json.dump(
+            {"missing_seeds": missing_seeds, "files": ingested_files}, f, indent=4
+        )
+
+
+def find_files_to_ingest(all_paths, ingested_files):
+    """
+    Compare the files in a folder with the ingested files.
+
+    A file whose size and modification time match its record is considered
+    unchanged. Otherwise, its content hash decides whether it has changed,
+    such that files that were only touched are not ingested again.
+
+    Args:
+        all_paths (list): Paths of the files
+        ingested_files (dict): Mapping from file name to its record as in
+                               *read_ingestion_manifest*
+
+    Returns:
+        tuple: new_paths, changed_paths, file_records
+
+               new_paths (list): Paths of files that were not ingested yet
+               changed_paths (list): Paths of ingested files whose content
+                                     has changed
+               file_records (dict): Mapping from file name to its updated
+                                    record. The position in the store is
+                                    only set for ingested files.
+    """
+    new_paths = []
+    changed_paths = []
+    file_records = {}
+    for in_path in all_paths:
+        file_name = os.path.basename(in_path)
+        file_stat = os.stat(in_path)
+        record = {
+            "seed": get_seed(file_name=file_name),
+            "size": file_stat.st_size,
+            "mtime_ns": file_stat.st_mtime_ns,
+        }
+        old_record = ingested_files.get(file_name)
+        if (
+            old_record is not None
+            and old_record["size"] == record["size"]
+            and old_record["mtime_ns"] == record["mtime_ns"]
+        ):
+            record["sha256"] = old_record["sha256"]
+        else:
+            record["sha256"] = hash_file(in_path=in_path)
 
-    return out_results
+        if old_record is None:
+            new_paths.append(in_path)
+        else:
+            record["run"] = old_record["run"]
+            if old_record["sha256"] != record["sha256"]:
+                changed_paths.append(in_path)
+        file_records[file_name] = record
+    return new_paths, changed_paths, file_records
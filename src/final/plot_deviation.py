@@ -22,7 +22,8 @@ def make_plot(devation_array, parameter_deviation, parameter_market, out_path):
     A function to make the deviation plots.
 
     Args:
-        devation_array (array): Array with the price sequences with a deviation
+        devation_array (array): Array or CompactTrajectories with the price
+                                sequences with a deviation
         parameter_deviation (dict): Parameters for the deviation simulation
         parameter_market (dict): Parameters that describe the market environment
         number_of_firms (integer): Number of firms in the market
@@ -42,9 +43,8 @@ def make_plot(devation_array, parameter_deviation, parameter_market, out_path):
 
     x_axis = np.arange(1, periods_to_consider - cut_first_periods + 1)
 
-    array_to_plot = np.array(devation_array)[
-        :, cut_first_periods:periods_to_consider, :
-    ]
+    # Only expand the periods we plot if the trajectories are stored compactly.
+    array_to_plot = devation_array[:, cut_first_periods:periods_to_consider, :]
 
     prices_std = np.std(np.array(array_to_plot), axis=0)
     prices_mean = np.mean(np.array(array_to_plot), axis=0)
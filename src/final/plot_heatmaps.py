@@ -23,7 +23,8 @@ def set_ticks_heatmap(axis_in, parameter_cases):
 
     Args:
         axis_in (matplotlib.axis.Axis): Axis element of the heatmap
-        parameter_cases (dict): Parameter cases as used in the simulation TODO:Explain somwhere
+        parameter_cases (dict): Grid of the simulation with the keys alpha_min,
+                                alpha_max, beta_min, beta_max and grid_points
 
     Returns:
         matplotlib.axis.Axis: Axis element with added ticks and labels.
@@ -64,16 +65,16 @@ def set_ticks_heatmap(axis_in, parameter_cases):
     return axis_in
 
 
-def value_function_heatmap(array_list, fun, n_agents, parameter_cases):
+def value_function_heatmap(cell_values, n_agents, parameter_cases):
     """
-    A function to plot the heatmap using the aggregation level provided by
-    the *fun* argument, which is ideally a numpy funcion like np.mean().
+    A function to plot the heatmap of the aggregated values of a value
+    function metric.
 
     Args:
-        array_list (list): List of arrays from a specific metric from the Monte Carlo simulation
-        fun (function): Aggregation function used on the array list
+        cell_values (array): Aggregated value of a specific metric from the Monte Carlo simulation in each cell of the grid
         n_agent (integer): Number of agents in the market
-        parameter_cases (dict): Parameter cases as used in the simulation TODO:Explain somewhere
+        parameter_cases (dict): Grid of the simulation with the keys alpha_min,
+                                alpha_max, beta_min, beta_max and grid_points
 
     Returns:
         tuple: Figure and Axis element (matplotlib) of the heatmap
@@ -85,7 +86,7 @@ def value_function_heatmap(array_list, fun, n_agents, parameter_cases):
     # Numpy Axis is always zero
     if n_agents == "3":
         # Flip up-down to have the smallest value in the bottom left corner
-        sns.heatmap(np.flipud(fun(array_list, axis=0)), ax=ax, vmin=0, vmax=1600)
+        sns.heatmap(np.flipud(cell_values), ax=ax, vmin=0, vmax=1600)
         # Add title
         ax.set_title("0H3A")
 
@@ -103,7 +104,7 @@ def value_function_heatmap(array_list, fun, n_agents, parameter_cases):
 
     elif n_agents == "2":
         # Flip up-down to have the smallest value in the bottom left corner
-        sns.heatmap(np.flipud(fun(array_list, axis=0)), ax=ax, vmin=0, vmax=2400)
+        sns.heatmap(np.flipud(cell_values), ax=ax, vmin=0, vmax=2400)
 
         # Add title
         ax.set_title("0H2A")
@@ -132,22 +133,22 @@ def value_function_heatmap(array_list, fun, n_agents, parameter_cases):
     return fig, ax
 
 
-def zero_one_heatmap(array_list, fun, n_agents, parameter_cases):
+def zero_one_heatmap(cell_values, n_agents, parameter_cases):
     """
     Generate a heatmap where the values are bound by zero and one.
 
     Args:
-        array_list (list): List of arrays from a specific metric from the Monte Carlo simulation.
-        fun (function): Aggregation function used on the array list
+        cell_values (array): Aggregated value of a specific metric from the Monte Carlo simulation in each cell of the grid
         n_agent (integer): Number of agents in the market
-        parameter_cases (dict): Parameter cases as used in the simulation TODO:Explain somewhere
+        parameter_cases (dict): Grid of the simulation with the keys alpha_min,
+                                alpha_max, beta_min, beta_max and grid_points
 
     Returns:
         tuple: Figure and Axis element (matplotlib) of the heatmap
     """
     fig, ax = plt.subplots(figsize=(2.5,1.8))
     # Flip up-down to have the smallest value in the bottom left corner
-    sns.heatmap(np.flipud(fun(array_list, axis=0)), ax=ax, vmin=0, vmax=1)
+    sns.heatmap(np.flipud(cell_values), ax=ax, vmin=0, vmax=1)
     cbar = ax.collections[0].colorbar
     cbar.set_ticks([0, 0.5, 1])
     cbar.set_ticklabels(["0", "0.5", "1"])
@@ -163,23 +164,23 @@ def zero_one_heatmap(array_list, fun, n_agents, parameter_cases):
     return fig, ax
 
 
-def price_heatmap(array_list, fun, n_agents, parameter_cases):
+def price_heatmap(cell_values, n_agents, parameter_cases):
     """
     Generate a heatmap where the values are bound by the minimal and
     maximal price.
 
     Args:
-        array_list (list): List of arrays from a specific metric from the Monte Carlo simulation.
-        fun (function): Aggregation function used on the array list
+        cell_values (array): Aggregated value of a specific metric from the Monte Carlo simulation in each cell of the grid
         n_agent (integer): Number of agents in the market
-        parameter_cases (dict): Parameter cases as used in the simulation TODO:Explain somewhere
+        parameter_cases (dict): Grid of the simulation with the keys alpha_min,
+                                alpha_max, beta_min, beta_max and grid_points
 
     Returns:
         tuple: Figure and Axis element (matplotlib) of the heatmap
     """
     fig, ax = plt.subplots(figsize=(2.5,1.8))
     # Flip up-down to have the smallest value in the bottom left corner
-    sns.heatmap(np.flipud(fun(array_list, axis=0)), ax=ax, vmin=0, vmax=5)
+    sns.heatmap(np.flipud(cell_values), ax=ax, vmin=0, vmax=5)
     cbar = ax.collections[0].colorbar
     cbar.set_ticks([0, 1, 2, 3, 4, 5])
     cbar.set_ticklabels(["0", "$p^{NE}=$1", "2", "3", "$p^{M}=$4", "5"])
@@ -213,27 +214,25 @@ if __name__ == "__main__":
     ) as f:
         PARAMETER_CASES = json.load(f)
 
-    with open(ppj("OUT_DATA", f"grid_{N_AGENTS}_agents.pickle"), "rb") as f:
-        DICT_GRID_VALUES = pickle.load(f)
+    # The cell means are aggregated in a single pass over the runs
+    with open(ppj("OUT_DATA", f"grid_{N_AGENTS}_agents_summary.pickle"), "rb") as f:
+        CELL_MEANS = pickle.load(f)[METRIC]["mean"]
 
     if METRIC == "best_response_share" or METRIC == "nash_equilibrium":
         current_fig, current_axis = zero_one_heatmap(
-            array_list=DICT_GRID_VALUES[METRIC],
-            fun=np.mean,
+            cell_values=CELL_MEANS,
             n_agents=N_AGENTS,
             parameter_cases=PARAMETER_CASES,
         )
     elif METRIC == "avg_price":
         current_fig, current_axis = price_heatmap(
-            array_list=DICT_GRID_VALUES[METRIC],
-            fun=np.mean,
+            cell_values=CELL_MEANS,
             n_agents=N_AGENTS,
             parameter_cases=PARAMETER_CASES,
         )
     else:
         current_fig, current_axis = value_function_heatmap(
-            array_list=DICT_GRID_VALUES[METRIC],
-            fun=np.mean,
+            cell_values=CELL_MEANS,
             n_agents=N_AGENTS,
             parameter_cases=PARAMETER_CASES,
         )
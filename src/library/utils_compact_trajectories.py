@@ -0,0 +1,191 @@
+"""
+
+A compact storage format for the deterministic market play trajectories.
+
+Once the agents play greedily without exogenous deviations, every trajectory
+runs into a cycle of states. Hence, a trajectory over an arbitrary number of
+periods is fully described by its prefix (all states before the cycle is
+entered) and a single pass through the cycle. *CompactTrajectories* stores
+only those states and expands prices for any period range on demand.
+"""
+import numpy as np
+
+
+class CompactTrajectories:
+    """
+    Array-like collection of trajectories stored as prefix plus cycle.
+
+    The states of all trajectories are stored back to back in one flat array
+    (prefix followed by one pass through the cycle) together with the offset
+    of each trajectory in the flat array and the length of its prefix.
+
+    Indexing works like indexing the dense price array of shape
+    batch_shape + (n_periods, state_length), e.g.
+    *trajectories[:, 9:20, :]*, but only the selected entries are computed.
+    *np.asarray(trajectories)* gives the dense array.
+
+    Args:
+        int_states (array): Flat array with the integer states of all
+                            trajectories.
+        offsets (array): Position of the first state of each trajectory in
+                         *int_states*. Shape is (n_trajectories + 1,).
+        prefix_lengths (array): Number of states before the cycle of each
+                                trajectory. Shape is (n_trajectories,).
+        state_prices (array): Price state for each integer state.
+                              Shape is (n_states, state_length).
+        n_periods (integer): Number of periods of each trajectory
+        batch_shape (tuple): Shape of the trajectory axes, e.g. (n_markets,)
+    """
+
+    def __init__(
+        self, int_states, offsets, prefix_lengths, state_prices, n_periods, batch_shape
+    ):
+        self.int_states = int_states
+        self.offsets = offsets
+        self.prefix_lengths = prefix_lengths
+        self.state_prices = state_prices
+        self.n_periods = n_periods
+        self.batch_shape = tuple(batch_shape)
+
+    @property
+    def shape(self):
+        return self.batch_shape + (self.n_periods, self.state_prices.shape[1])
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def dtype(self):
+        return self.state_prices.dtype
+
+    def __len__(self):
+        return self.batch_shape[0]
+
+    def get_int_states(self, trajectory_ids, periods):
+        """
+        Get the integer states of some trajectories in some periods.
+
+        Args:
+            trajectory_ids (array): Flat positions of the trajectories
+            periods (array): Periods. Is broadcasted against *trajectory_ids*.
+
+        Returns:
+            array: Integer states. Shape is the broadcasted shape of the inputs.
+        """
+        prefix_lengths = self.prefix_lengths[trajectory_ids]
+        cycle_lengths = (
+            self.offsets[trajectory_ids + 1]
+            - self.offsets[trajectory_ids]
+            - prefix_lengths
+        )
+        position = np.where(
+            periods < prefix_lengths,
+            periods,
+            prefix_lengths + (periods - prefix_lengths) % cycle_lengths,
+        )
+        return self.int_states[self.offsets[trajectory_ids] + position]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(single_key is Ellipsis for single_key in key):
+            raise IndexError("Ellipsis indexing is not supported.")
+
+        n_batch_axes = len(self.batch_shape)
+        trajectory_ids = np.arange(np.prod(self.batch_shape, dtype=int)).reshape(
+            self.batch_shape
+        )[key[:n_batch_axes]]
+        periods = np.arange(self.n_periods)[
+            key[n_batch_axes] if len(key) > n_batch_axes else slice(None)
+        ]
+        trajectory_ids = np.reshape(
+            trajectory_ids, np.shape(trajectory_ids) + (1,) * periods.ndim
+        )
+
+        prices = self.state_prices[
+            self.get_int_states(trajectory_ids=trajectory_ids, periods=periods)
+        ]
+        return prices[(Ellipsis,) + key[n_batch_axes + 1 :]]
+
+    def expand(self, first_period=0, last_period=None):
+        """
+        Expand the prices of all trajectories in a range of periods.
+
+        Args:
+            first_period (integer): First period to expand
+            last_period (integer): Period after the last period to expand.
+                                   Defaults to *n_periods*.
+
+        Returns:
+            array: Dense prices. Shape is
+                   batch_shape + (last_period - first_period, state_length).
+        """
+        key = (slice(None),) * len(self.batch_shape) + (
+            slice(first_period, last_period),
+        )
+        return self[key]
+
+    def __array__(self, dtype=None, copy=None):
+        dense_prices = self.expand()
+        if dtype is not None:
+            return dense_prices.astype(dtype)
+        return dense_prices
+
+
+def concatenate_trajectories(all_trajectories):
+    """
+    Concatenate CompactTrajectories along the first batch axis, e.g. the
+    trajectories of several shards of markets.
+
+    Args:
+        all_trajectories (list): List of CompactTrajectories with the same
+                                 number of periods, price states and batch
+                                 axes apart from the first one.
+
+    Returns:
+        CompactTrajectories: Concatenated trajectories
+
+    Raises:
+        ValueError: If the trajectories cannot be concatenated.
+    """
+    first_trajectories = all_trajectories[0]
+    for trajectories in all_trajectories[1:]:
+        if (
+            trajectories.n_periods != first_trajectories.n_periods
+            or trajectories.batch_shape[1:] != first_trajectories.batch_shape[1:]
+            or not np.array_equal(
+                trajectories.state_prices, first_trajectories.state_prices
+            )
+        ):
+            raise ValueError(
+                "Only trajectories with the same number of periods, price "
+                "states and batch axes apart from the first can be concatenated."
+            )
+
+    # The offsets of each part are shifted by the states of all parts before.
+    n_states_before = np.cumsum(
+        [0] + [len(trajectories.int_states) for trajectories in all_trajectories]
+    )
+    offsets = np.concatenate(
+        [first_trajectories.offsets[:1]]
+        + [
+            trajectories.offsets[1:] + n_states_before[ix_part]
+            for ix_part, trajectories in enumerate(all_trajectories)
+        ]
+    )
+    return CompactTrajectories(
+        int_states=np.concatenate(
+            [trajectories.int_states for trajectories in all_trajectories]
+        ),
+        offsets=offsets,
+        prefix_lengths=np.concatenate(
+            [trajectories.prefix_lengths for trajectories in all_trajectories]
+        ),
+        state_prices=first_trajectories.state_prices,
+        n_periods=first_trajectories.n_periods,
+        batch_shape=(
+            sum(trajectories.batch_shape[0] for trajectories in all_trajectories),
+        )
+        + first_trajectories.batch_shape[1:],
+    )
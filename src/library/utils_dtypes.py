@@ -0,0 +1,115 @@
+"""
+
+A collection of functions that define the dtypes in which simulated prices
+and integer states are stored.
+
+Prices and states are small integers, hence storing them as int64 wastes most
+of the memory. The functions here pick the smallest signed integer type that
+fits the values implied by the parameter file. Signed types are used such that
+price differences (e.g. a deviation to a lower price) do not wrap around.
+
+Note that the mapping dictionaries of qpricesim use the bytes of int64 price
+states as keys. Hence, price states that are looked up in those dictionaries
+must keep the dtype of *gen_possible_prices*.
+"""
+import numpy as np
+
+from src.library.utils_state_encoding import get_n_states
+from qpricesim.simulations.utils_simulation import gen_possible_prices
+
+INTEGER_DTYPES = (np.int8, np.int16, np.int32, np.int64)
+
+
+def get_smallest_int_dtype(min_value, max_value):
+    """
+    Get the smallest signed integer type that can hold all values between
+    *min_value* and *max_value*.
+
+    Args:
+        min_value (integer): Smallest value to store
+        max_value (integer): Largest value to store
+
+    Returns:
+        numpy.dtype: Smallest fitting integer type
+
+    Raises:
+        OverflowError: If the values do not fit into int64.
+    """
+    for dtype in INTEGER_DTYPES:
+        int_info = np.iinfo(dtype)
+        if int_info.min <= min_value and max_value <= int_info.max:
+            return np.dtype(dtype)
+    raise OverflowError(f"Values up to {max_value} do not fit into int64.")
+
+
+def get_price_dtype(parameter):
+    """
+    Get the dtype in which prices of the market are stored. If the price grid
+    only contains integers, this is the smallest fitting integer type.
+    Otherwise, the dtype of the price grid is kept.
+
+    Args:
+        parameter (dict): Market specs as defined in *utils_state_encoding*
+
+    Returns:
+        numpy.dtype: dtype for prices
+    """
+    possible_prices = gen_possible_prices(parameter=parameter)
+    if not np.all(np.mod(possible_prices, 1) == 0):
+        return possible_prices.dtype
+    return get_smallest_int_dtype(
+        min_value=possible_prices.min(), max_value=possible_prices.max()
+    )
+
+
+def get_state_dtype(parameter):
+    """
+    Get the smallest integer type that can hold all integer states of the market.
+
+    Args:
+        parameter (dict): Market specs as defined in *utils_state_encoding*
+
+    Returns:
+        numpy.dtype: dtype for integer states
+    """
+    return get_smallest_int_dtype(
+        min_value=0, max_value=get_n_states(parameter=parameter) - 1
+    )
+
+
+def cast_checked(array, dtype):
+    """
+    Cast *array* to *dtype* and make sure that no value changes.
+
+    Args:
+        array (array): Array to cast
+        dtype (numpy.dtype): Target dtype
+
+    Returns:
+        array: Array with the target dtype
+
+    Raises:
+        OverflowError: If a value does not fit into *dtype*.
+    """
+    array = np.asarray(array)
+    cast_array = array.astype(dtype, copy=False)
+    if not np.array_equal(cast_array, array):
+        raise OverflowError(f"Values do not fit into {np.dtype(dtype)}.")
+    return cast_array
+
+
+def get_possible_prices(parameter):
+    """
+    Counterpart to *gen_possible_prices* with the prices in the dtype of
+    *get_price_dtype*. Arrays indexed from it inherit the narrow dtype.
+
+    Args:
+        parameter (dict): Market specs as defined in *utils_state_encoding*
+
+    Returns:
+        array: Array of possible prices in the market
+    """
+    return cast_checked(
+        array=gen_possible_prices(parameter=parameter),
+        dtype=get_price_dtype(parameter=parameter),
+    )
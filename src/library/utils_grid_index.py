@@ -0,0 +1,178 @@
+"""
+
+An index of the (alpha, beta) grid of the grid search simulation.
+
+The grid is defined in *parameter_{n}_agent_cases.json* by the bounds of the
+learning rate alpha and the exploration decay beta and the number of grid
+points, which are spaced as in *np.linspace*. The metric arrays of the grid
+search have the shape (n_runs, alpha, beta).
+
+A *GridIndex* maps batches of parameter values to cell indices and extracts
+cells, rectangles and neighborhoods from metric arrays. As the grid is
+regular, the index of a value is computed directly from its distance to the
+lower bound. A value matches a cell if it is within *tolerance* grid steps of
+it, such that floats which are rounded differently than the regenerated grid
+are still found.
+"""
+import json
+
+import numpy as np
+
+
+class GridIndex:
+    """
+    Index of a regular (alpha, beta) grid.
+
+    Args:
+        alpha_min (float): Smallest learning rate
+        alpha_max (float): Largest learning rate
+        beta_min (float): Smallest exploration decay
+        beta_max (float): Largest exploration decay
+        grid_points (integer): Number of grid points of each parameter
+        tolerance (float): Largest distance of a value to its cell as a
+                           share of the grid step
+    """
+
+    def __init__(
+        self, alpha_min, alpha_max, beta_min, beta_max, grid_points, tolerance=1e-6
+    ):
+        self.grid_points = grid_points
+        self.tolerance = tolerance
+        self.alpha_grid = np.linspace(alpha_min, alpha_max, grid_points)
+        self.beta_grid = np.linspace(beta_min, beta_max, grid_points)
+
+    @classmethod
+    def from_grid_info(cls, grid_info, tolerance=1e-6):
+        """
+        Create the index from the grid information as in
+        *parameter_{n}_agent_cases.json*.
+
+        Args:
+            grid_info (dict): Information over the used grid
+            tolerance (float): Largest distance of a value to its cell as a
+                               share of the grid step
+
+        Returns:
+            GridIndex: Index of the grid
+        """
+        return cls(
+            alpha_min=grid_info["alpha_min"],
+            alpha_max=grid_info["alpha_max"],
+            beta_min=grid_info["beta_min"],
+            beta_max=grid_info["beta_max"],
+            grid_points=grid_info["grid_points"],
+            tolerance=tolerance,
+        )
+
+    @classmethod
+    def from_parameter_file(cls, parameter_path, tolerance=1e-6):
+        """
+        Create the index from a *parameter_{n}_agent_cases.json* file.
+
+        Args:
+            parameter_path (string): Path to the parameter file
+            tolerance (float): Largest distance of a value to its cell as a
+                               share of the grid step
+
+        Returns:
+            GridIndex: Index of the grid
+        """
+        with open(parameter_path) as f:
+            return cls.from_grid_info(grid_info=json.load(f), tolerance=tolerance)
+
+    def _lookup(self, grid, values, name):
+        values = np.asarray(values, dtype=float)
+        step = grid[1] - grid[0] if len(grid) > 1 else 1.0
+        indices = np.clip(np.rint((values - grid[0]) / step), 0, len(grid) - 1)
+        indices = indices.astype(np.int64)
+        off_grid = np.abs(grid[indices] - values) > self.tolerance * abs(step)
+        if np.any(off_grid):
+            raise ValueError(
+                f"Values {values[off_grid].tolist()} of {name} are not on the grid."
+            )
+        return indices
+
+    def lookup(self, alphas, betas):
+        """
+        Get the cell indices of batches of parameter values.
+
+        Args:
+            alphas (array_like): Learning rates
+            betas (array_like): Exploration decays with the same shape as
+                                *alphas*
+
+        Returns:
+            tuple: alpha_indices, beta_indices
+
+        Raises:
+            ValueError: If a value is not on the grid.
+        """
+        return (
+            self._lookup(grid=self.alpha_grid, values=alphas, name="alpha"),
+            self._lookup(grid=self.beta_grid, values=betas, name="beta"),
+        )
+
+    def cells(self, metric_array, alphas, betas):
+        """
+        Extract the runs of some cells from a metric array.
+
+        Args:
+            metric_array (array): Metric array of shape (n_runs, alpha, beta),
+                                  e.g. memory mapped from the metric store
+            alphas (array_like): Learning rates of the cells
+            betas (array_like): Exploration decays of the cells
+
+        Returns:
+            array: Runs of the cells. Shape is (n_runs,) + shape of *alphas*.
+        """
+        alpha_indices, beta_indices = self.lookup(alphas=alphas, betas=betas)
+        return np.asarray(metric_array[:, alpha_indices, beta_indices])
+
+    def rectangle(self, metric_array, alpha_bounds, beta_bounds):
+        """
+        Extract all cells whose parameters lie within the bounds. The bounds
+        are inclusive and do not need to be on the grid.
+
+        Args:
+            metric_array (array): Metric array of shape (n_runs, alpha, beta)
+            alpha_bounds (tuple): Lower and upper bound of the learning rate
+            beta_bounds (tuple): Lower and upper bound of the exploration decay
+
+        Returns:
+            array: Runs of the cells. Shape is (n_runs, n_alphas, n_betas).
+        """
+        alpha_slice = self._bounds_to_slice(grid=self.alpha_grid, bounds=alpha_bounds)
+        beta_slice = self._bounds_to_slice(grid=self.beta_grid, bounds=beta_bounds)
+        return np.asarray(metric_array[:, alpha_slice, beta_slice])
+
+    def _bounds_to_slice(self, grid, bounds):
+        step = abs(grid[1] - grid[0]) if len(grid) > 1 else 0.0
+        lower, upper = bounds
+        return slice(
+            np.searchsorted(grid, lower - self.tolerance * step, side="left"),
+            np.searchsorted(grid, upper + self.tolerance * step, side="right"),
+        )
+
+    def neighborhood(self, metric_array, alpha, beta, radius=1):
+        """
+        Extract the cells within *radius* grid steps of a cell. The
+        neighborhood is cut at the borders of the grid.
+
+        Args:
+            metric_array (array): Metric array of shape (n_runs, alpha, beta)
+            alpha (float): Learning rate of the center cell
+            beta (float): Exploration decay of the center cell
+            radius (integer): Number of grid steps in each direction
+
+        Returns:
+            array: Runs of the cells. Shape is (n_runs, n_alphas, n_betas)
+                   with at most 2 * radius + 1 cells in each direction.
+        """
+        alpha_index, beta_index = self.lookup(alphas=alpha, betas=beta)
+        return np.asarray(
+            metric_array[
+                :,
+                max(alpha_index - radius, 0) : alpha_index + radius + 1,
+                max(beta_index - radius, 0) : beta_index + radius + 1,
+            ]
+        )
@@ -0,0 +1,319 @@
+"""
+
+A columnar store for the metrics of the grid search simulations.
+
+Each metric is stored as one contiguous *.npy* file of shape
+(n_runs, grid_points, grid_points) next to a JSON manifest that lists all
+metrics with their files, shapes and dtypes. Readers open single metrics
+with *np.load(mmap_mode="r")*, such that only the slices that are actually
+used are read from disk and the other metrics are never touched.
+
+For a store with the prefix *grid_2_agents* the files are
+*grid_2_agents_manifest.json* and *grid_2_agents_{metric}.npy*.
+
+Runs can be appended to an existing store. The header of a *.npy* file is
+written by this module and padded by *HEADER_GROWTH* spaces, such that the
+length of the first axis can grow without changing the size of the header.
+Hence, new runs are written to the end of each file and only the header is
+rewritten.
+"""
+import json
+import os
+import struct
+
+import numpy as np
+
+# Number of spaces by which the header of each *.npy* file is padded, which
+# is enough for the first axis to grow to any length.
+HEADER_GROWTH = 21
+
+# Length of the header of a *.npy* file is a multiple of this value.
+HEADER_ALIGNMENT = 64
+
+
+def get_manifest_path(store_prefix):
+    """
+    Get the path of the manifest of a metric store.
+
+    Args:
+        store_prefix (string): Path of the store without file ending
+
+    Returns:
+        string: Path of the manifest
+    """
+    return f"{store_prefix}_manifest.json"
+
+
+def get_metric_path(store_prefix, metric):
+    """
+    Get the path of the *.npy* file of a metric.
+
+    Args:
+        store_prefix (string): Path of the store without file ending
+        metric (string): Name of the metric
+
+    Returns:
+        string: Path of the metric file
+    """
+    return f"{store_prefix}_{metric}.npy"
+
+
+def _make_npy_header(shape, dtype, header_length=None):
+    """
+    Make the version 1.0 header of a *.npy* file.
+
+    Args:
+        shape (tuple): Shape of the array
+        dtype (dtype): Data type of the array
+        header_length (integer): Length of the header in bytes. If None, the
+                                 header is padded by *HEADER_GROWTH* spaces
+                                 and aligned to *HEADER_ALIGNMENT* bytes.
+
+    Returns:
+        bytes: Header including the magic string
+
+    Raises:
+        ValueError: If the header does not fit into *header_length* bytes.
+    """
+    header = repr(
+        {
+            "descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+            "fortran_order": False,
+            "shape": tuple(int(axis_length) for axis_length in shape),
+        }
+    ).encode("latin1")
+    # The header consists of the magic string (8 bytes), its length (2 bytes),
+    # the dictionary, the padding and a newline.
+    n_fixed_bytes = 8 + 2 + len(header) + 1
+    if header_length is None:
+        n_blocks = -(-(n_fixed_bytes + HEADER_GROWTH) // HEADER_ALIGNMENT)
+        header_length = n_blocks * HEADER_ALIGNMENT
+    if n_fixed_bytes > header_length:
+        raise ValueError(
+            f"The header for the shape {tuple(shape)} does not fit into "
+            f"{header_length} bytes."
+        )
+    return (
+        np.lib.format.magic(1, 0)
+        + struct.pack("<H", header_length - 10)
+        + header
+        + b" " * (header_length - n_fixed_bytes)
+        + b"\n"
+    )
+
+
+def write_metric_store(store_prefix, metric_arrays):
+    """
+    Write the arrays of all runs for each metric to the store.
+
+    The runs are copied one by one into the memory mapped output file,
+    such that the stacked array is never held in memory. The manifest is
+    written last, hence a store with a manifest is always complete.
+
+    Args:
+        store_prefix (string): Path of the store without file ending
+        metric_arrays (dict): Mapping from metric name to a sequence with the
+                              array of each run. All arrays of a metric must
+                              have the same shape.
+    """
+    manifest = {"metrics": {}}
+    for metric, all_runs in metric_arrays.items():
+        first_run = np.asarray(all_runs[0])
+        shape = (len(all_runs),) + first_run.shape
+        metric_path = get_metric_path(store_prefix=store_prefix, metric=metric)
+
+        header = _make_npy_header(shape=shape, dtype=first_run.dtype)
+        with open(metric_path, "wb") as f:
+            f.write(header)
+            f.truncate(len(header) + int(np.prod(shape)) * first_run.dtype.itemsize)
+        out_array = np.memmap(
+            metric_path,
+            dtype=first_run.dtype,
+            mode="r+",
+            offset=len(header),
+            shape=shape,
+        )
+        for ix_run, run in enumerate(all_runs):
+            out_array[ix_run] = run
+        out_array.flush()
+        del out_array
+
+        manifest["metrics"][metric] = {
+            "file": os.path.basename(metric_path),
+            "shape": list(shape),
+            "dtype": first_run.dtype.str,
+        }
+
+    with open(get_manifest_path(store_prefix=store_prefix), "w") as f:
+        json.dump(manifest, f, indent=4)
+
+
+def _read_npy_header(f):
+    """
+    Read the header of an open *.npy* file.
+
+    Args:
+        f (file): File opened in binary mode at position zero
+
+    Returns:
+        tuple: shape, dtype, position of the first data byte
+    """
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+    else:
+        shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+    return shape, dtype, f.tell()
+
+
+def _append_runs_to_npy(metric_path, new_runs):
+    """
+    Append runs along the first axis of a *.npy* file in place.
+
+    Args:
+        metric_path (string): Path of the metric file
+        new_runs (array): Runs to append. Shape is (n_new_runs,) + run shape.
+
+    Returns:
+        tuple: Shape of the array after appending
+
+    Raises:
+        ValueError: If the shape of the runs does not fit the stored array or
+                    if the header cannot be rewritten in place.
+    """
+    with open(metric_path, "r+b") as f:
+        shape, dtype, data_offset = _read_npy_header(f)
+        if tuple(new_runs.shape[1:]) != tuple(shape[1:]):
+            raise ValueError(
+                f"Runs of shape {new_runs.shape[1:]} cannot be appended to "
+                f"{metric_path} with runs of shape {shape[1:]}."
+            )
+        new_shape = (shape[0] + new_runs.shape[0],) + tuple(shape[1:])
+
+        try:
+            new_header = _make_npy_header(
+                shape=new_shape, dtype=dtype, header_length=data_offset
+            )
+        except ValueError:
+            raise ValueError(
+                f"The header of {metric_path} cannot be extended in place."
+            )
+
+        # Write the data first such that the header never claims more runs
+        # than the file contains.
+        f.seek(0, os.SEEK_END)
+        f.write(np.ascontiguousarray(new_runs, dtype=dtype).tobytes())
+        f.seek(0)
+        f.write(new_header)
+    return new_shape
+
+
+def append_to_metric_store(store_prefix, metric_arrays):
+    """
+    Append runs to all metrics of a store. If the store does not exist yet,
+    it is created with *write_metric_store*.
+
+    Args:
+        store_prefix (string): Path of the store without file ending
+        metric_arrays (dict): Mapping from metric name to a sequence with the
+                              array of each new run. Must contain all metrics
+                              of the store.
+
+    Returns:
+        integer: Position of the first appended run on the first axis
+
+    Raises:
+        ValueError: If the metrics do not match the metrics of the store.
+    """
+    manifest_path = get_manifest_path(store_prefix=store_prefix)
+    if not os.path.exists(manifest_path):
+        write_metric_store(store_prefix=store_prefix, metric_arrays=metric_arrays)
+        return 0
+
+    manifest = read_manifest(manifest_path=manifest_path)
+    if set(manifest["metrics"]) != set(metric_arrays):
+        raise ValueError(
+            f"Metrics {sorted(metric_arrays)} do not match the metrics "
+            f"{sorted(manifest['metrics'])} of the store."
+        )
+
+    first_new_run = None
+    for metric, all_runs in metric_arrays.items():
+        metric_info = manifest["metrics"][metric]
+        new_runs = np.stack([np.asarray(run) for run in all_runs])
+        new_shape = _append_runs_to_npy(
+            metric_path=os.path.join(
+                os.path.dirname(manifest_path), metric_info["file"]
+            ),
+            new_runs=new_runs,
+        )
+        first_new_run = new_shape[0] - new_runs.shape[0]
+        metric_info["shape"] = list(new_shape)
+
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=4)
+    return first_new_run
+
+
+def replace_in_metric_store(store_prefix, runs, metric_arrays):
+    """
+    Overwrite some runs of all metrics of a store.
+
+    Args:
+        store_prefix (string): Path of the store without file ending
+        runs (list): Positions of the runs to overwrite on the first axis
+        metric_arrays (dict): Mapping from metric name to a sequence with the
+                              new array of each run in *runs*.
+    """
+    manifest_path = get_manifest_path(store_prefix=store_prefix)
+    for metric, all_runs in metric_arrays.items():
+        metric_array = load_metric(
+            manifest_path=manifest_path, metric=metric, mmap_mode="r+"
+        )
+        for run, new_run in zip(runs, all_runs):
+            metric_array[run] = new_run
+        metric_array.flush()
+        del metric_array
+
+
+def read_manifest(manifest_path):
+    """
+    Read the manifest of a metric store.
+
+    Args:
+        manifest_path (string): Path of the manifest
+
+    Returns:
+        dict: Manifest with the file, shape and dtype of each metric
+              under the key 'metrics'.
+    """
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def load_metric(manifest_path, metric, mmap_mode="r"):
+    """
+    Open the array of a single metric from a metric store.
+
+    Args:
+        manifest_path (string): Path of the manifest
+        metric (string): Name of the metric
+        mmap_mode (string): Memory map mode passed to *np.load*. With None,
+                            the whole array is read into memory.
+
+    Returns:
+        array: Array of the metric. Shape is (n_runs, grid_points, grid_points).
+
+    Raises:
+        KeyError: If the store contains no metric with this name.
+    """
+    all_metrics = read_manifest(manifest_path=manifest_path)["metrics"]
+    if metric not in all_metrics:
+        raise KeyError(
+            f"Metric '{metric}' not in the store. "
+            f"Available metrics are {sorted(all_metrics)}."
+        )
+    metric_path = os.path.join(
+        os.path.dirname(manifest_path), all_metrics[metric]["file"]
+    )
+    return np.load(metric_path, mmap_mode=mmap_mode)
@@ -0,0 +1,150 @@
+"""
+
+A packed archive of the Q-tables of the super star markets.
+
+Unpickling the super star markets creates thousands of QLearningAgent
+objects and requires *qpricesim* to be importable, while the analysis only
+needs the Q-values, the epsilons and the greedy policies. The archive stores
+those as plain arrays in an uncompressed *.npz* file:
+
+    qvalues                (n_markets, n_agents, n_states, n_actions)
+    greedy_policies        (n_markets, n_agents, n_states)
+    epsilons               (n_markets, n_agents)
+    states_of_convergence  (n_markets,)
+    seeds                  (n_markets,)
+
+The Q-values are stored as float32 by default. To make sure that this does
+not change the behaviour of the agents, the greedy policies are taken from
+the original agents and stored separately.
+
+*ArchivedQLearningAgent* is a thin adapter with the interface of a
+QLearningAgent that is used by the analysis, such that all functions that
+take super star tuples run from the archive alone.
+"""
+import numpy as np
+
+from src.library.utils_dtypes import get_smallest_int_dtype
+
+
+class ArchivedQLearningAgent:
+    """
+    Read-only stand-in for a QLearningAgent from the Q-table archive.
+
+    Args:
+        qvalues (array): Q-values. Shape is (n_states, n_actions).
+        epsilon (float): Exploration rate of the agent
+        greedy_policy (array): Integer action the agent picks in each state.
+                               Shape is (n_states,).
+    """
+
+    def __init__(self, qvalues, epsilon, greedy_policy):
+        self._qvalues = qvalues
+        self.epsilon = epsilon
+        self.greedy_policy = greedy_policy
+
+    def get_best_action(self, state):
+        return int(self.greedy_policy[state])
+
+
+def write_q_table_archive(
+    super_star_tuples, seeds, archive_path, qvalue_dtype=np.float32
+):
+    """
+    Write the Q-tables of all super star markets to an archive.
+
+    Args:
+        super_star_tuples (list): List of tuples, where each tuple is one
+                                  market upon convergence.
+                                  (state of convergence,
+                                  List with QLearningAgents)
+        seeds (list): Seed of each market
+        archive_path (string): Path of the *.npz* archive
+        qvalue_dtype (numpy.dtype): dtype in which the Q-values are stored
+    """
+    all_states_of_conv, all_markets = zip(*super_star_tuples)
+    qvalues = np.array(
+        [[agent._qvalues for agent in all_agents] for all_agents in all_markets],
+        dtype=qvalue_dtype,
+    )
+    n_markets, n_agents, n_states, n_actions = qvalues.shape
+
+    greedy_policies = np.empty(
+        (n_markets, n_agents, n_states),
+        dtype=get_smallest_int_dtype(min_value=0, max_value=n_actions - 1),
+    )
+    for ix_market, all_agents in enumerate(all_markets):
+        for id_agent, agent in enumerate(all_agents):
+            greedy_policies[ix_market, id_agent] = [
+                agent.get_best_action(int_state) for int_state in range(n_states)
+            ]
+
+    np.savez(
+        archive_path,
+        qvalues=qvalues,
+        greedy_policies=greedy_policies,
+        epsilons=np.array(
+            [[agent.epsilon for agent in all_agents] for all_agents in all_markets],
+            dtype=float,
+        ),
+        states_of_convergence=np.array(all_states_of_conv, dtype=int),
+        seeds=np.array(seeds, dtype=int),
+    )
+
+
+def load_q_table_archive(archive_path):
+    """
+    Load all arrays of a Q-table archive.
+
+    Args:
+        archive_path (string): Path of the *.npz* archive
+
+    Returns:
+        dict: Mapping from array name to array, see the module docstring.
+    """
+    with np.load(archive_path) as archive:
+        return {name: archive[name] for name in archive.files}
+
+
+def archive_to_super_star_tuples(archive):
+    """
+    Adapt the arrays of a Q-table archive to super star tuples.
+
+    Args:
+        archive (dict): Arrays of the archive as returned by
+                        *load_q_table_archive*
+
+    Returns:
+        list: List of tuples, where each tuple is one market upon convergence.
+              (state of convergence, List with ArchivedQLearningAgents)
+    """
+    n_markets, n_agents = archive["epsilons"].shape
+    return [
+        (
+            int(archive["states_of_convergence"][ix_market]),
+            [
+                ArchivedQLearningAgent(
+                    qvalues=archive["qvalues"][ix_market, id_agent],
+                    epsilon=archive["epsilons"][ix_market, id_agent],
+                    greedy_policy=archive["greedy_policies"][ix_market, id_agent],
+                )
+                for id_agent in range(n_agents)
+            ],
+        )
+        for ix_market in range(n_markets)
+    ]
+
+
+def load_super_star_tuples(archive_path):
+    """
+    Load the super star markets from a Q-table archive.
+
+    Args:
+        archive_path (string): Path of the *.npz* archive
+
+    Returns:
+        list: List of tuples, where each tuple is one market upon convergence.
+              (state of convergence, List with ArchivedQLearningAgents)
+    """
+    return archive_to_super_star_tuples(
+        archive=load_q_table_archive(archive_path=archive_path)
+    )
@@ -0,0 +1,144 @@
+"""
+
+A collection of functions to encode price states as integer states and back
+without materializing mapping dictionaries.
+
+A price state consists of n_agent * k_memory prices from the price grid.
+Each price is represented by its index in the price grid and the price
+indices are read as the digits of a number in base n_prices, where the
+first position is the most significant digit. This is the same ordering
+in which *gen_price_combination_byte_mappings* enumerates the price
+combinations (itertools.product), so the integer states coincide with
+the states used in the Q-matrices of the agents.
+
+Throughout the project, the market specs are passed as a dict (usually
+*parameter* or *parameter_market*) as in *parameter_super_star_{n}_agent.json*.
+The following keys are used:
+
+    n_agent            Number of firms in the market
+    k_memory           Number of past periods in a state
+    min_price          Lowest price of the price grid
+    max_price          Highest price of the price grid
+    step               Distance between two prices of the price grid
+    discount_rate      Discount rate of the firms
+    reservation_price  Highest price at which the consumers buy
+    m_consumer         Number of consumers
+"""
+import numpy as np
+
+from qpricesim.simulations.utils_simulation import gen_possible_prices
+
+
+def get_n_states(parameter):
+    """
+    Number of states in the market.
+
+    Args:
+        parameter (dict): Market specs as defined in the module docstring
+
+    Returns:
+        integer: Number of possible price states
+    """
+    n_prices = len(gen_possible_prices(parameter=parameter))
+    return n_prices ** (parameter["n_agent"] * parameter["k_memory"])
+
+
+def prices_to_price_indices(prices, possible_prices):
+    """
+    Transform prices to their index in the price grid.
+
+    Args:
+        prices (array): Array of prices with arbitrary shape
+        possible_prices (array): Array of possible prices in the market
+
+    Returns:
+        array: Array with the price indices. Same shape as *prices*.
+
+    Raises:
+        ValueError: If a price is not part of the price grid.
+    """
+    prices = np.asarray(prices)
+    price_indices = np.searchsorted(possible_prices, prices)
+    price_indices = np.minimum(price_indices, len(possible_prices) - 1)
+    if not np.all(possible_prices[price_indices] == prices):
+        raise ValueError("Prices must be part of the price grid.")
+    return price_indices
+
+
+def price_indices_to_int_states(price_indices, n_prices):
+    """
+    Encode price index states as integer states.
+
+    Args:
+        price_indices (array): Array with price indices. The last axis is the
+                               position in the price state.
+        n_prices (integer): Number of possible prices
+
+    Returns:
+        array: Integer states. Shape is price_indices.shape[:-1].
+    """
+    price_indices = np.asarray(price_indices)
+    int_states = np.zeros(price_indices.shape[:-1], dtype=int)
+    for position in range(price_indices.shape[-1]):
+        int_states = int_states * n_prices + price_indices[..., position]
+    return int_states
+
+
+def int_states_to_price_indices(int_states, n_prices, state_length):
+    """
+    Decode integer states to price index states.
+
+    Args:
+        int_states (array): Array of integer states with arbitrary shape
+        n_prices (integer): Number of possible prices
+        state_length (integer): Number of prices in a state (n_agent * k_memory)
+
+    Returns:
+        array: Price indices. Shape is int_states.shape + (state_length,).
+    """
+    remaining = np.array(int_states, dtype=int)
+    price_indices = np.empty(remaining.shape + (state_length,), dtype=int)
+    for position in reversed(range(state_length)):
+        remaining, price_indices[..., position] = np.divmod(remaining, n_prices)
+    return price_indices
+
+
+def price_states_to_int_states(price_states, parameter):
+    """
+    Vectorized counterpart to *price_state_to_int_state*.
+
+    Args:
+        price_states (array): Array with price states. The last axis is the
+                              position in the price state.
+        parameter (dict): Market specs as defined in the module docstring
+
+    Returns:
+        array: Integer states. Shape is price_states.shape[:-1].
+    """
+    possible_prices = gen_possible_prices(parameter=parameter)
+    price_indices = prices_to_price_indices(
+        prices=price_states, possible_prices=possible_prices
+    )
+    return price_indices_to_int_states(
+        price_indices=price_indices, n_prices=len(possible_prices)
+    )
+
+
+def int_states_to_price_states(int_states, parameter):
+    """
+    Vectorized counterpart to *int_state_to_price_state*.
+
+    Args:
+        int_states (array): Array of integer states with arbitrary shape
+        parameter (dict): Market specs as defined in the module docstring
+
+    Returns:
+        array: Price states. Shape is int_states.shape + (n_agent * k_memory,).
+    """
+    possible_prices = gen_possible_prices(parameter=parameter)
+    price_indices = int_states_to_price_indices(
+        int_states=int_states,
+        n_prices=len(possible_prices),
+        state_length=parameter["n_agent"] * parameter["k_memory"],
+    )
+    return possible_prices[price_indices]
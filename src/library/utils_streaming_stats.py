@@ -0,0 +1,221 @@
+"""
+
+Streaming statistics for the cells of the grid search.
+
+The runs of a metric are processed in chunks and only a fixed size state is
+kept per (alpha, beta) cell, hence the memory does not grow with the number
+of runs. The state holds
+
+    n_runs       number of runs seen so far
+    mean, m2     running mean and sum of squared deviations (Welford)
+    histogram    counts in fixed bins, used as a quantile sketch
+    exceedances  number of runs above each threshold
+
+All parts of the state can be merged, such that partial states of different
+chunks, files or workers can be combined in any order with
+*merge_running_stats* (the mean and m2 are merged with the formula of Chan
+et al.).
+"""
+import numpy as np
+
+
+def init_running_stats(cell_shape, bin_range, n_bins, thresholds=()):
+    """
+    Create an empty state.
+
+    Args:
+        cell_shape (tuple): Shape of the grid of one run
+        bin_range (tuple): Lower and upper bound of the histogram. Values
+                           outside are counted in the first or last bin.
+        n_bins (integer): Number of histogram bins
+        thresholds (tuple): Thresholds for which the share of runs above the
+                            threshold is counted
+
+    Returns:
+        dict: Empty state
+    """
+    cell_shape = tuple(cell_shape)
+    running_stats = {}
+    running_stats["n_runs"] = 0
+    running_stats["mean"] = np.zeros(cell_shape)
+    running_stats["m2"] = np.zeros(cell_shape)
+    running_stats["bin_edges"] = np.linspace(bin_range[0], bin_range[1], n_bins + 1)
+    running_stats["histogram"] = np.zeros((n_bins,) + cell_shape, dtype=np.int64)
+    running_stats["thresholds"] = np.array(thresholds, dtype=float)
+    running_stats["exceedances"] = np.zeros(
+        (len(thresholds),) + cell_shape, dtype=np.int64
+    )
+    return running_stats
+
+
+def merge_running_stats(running_stats_a, running_stats_b):
+    """
+    Merge two states with the same bins and thresholds.
+
+    Args:
+        running_stats_a (dict): First state
+        running_stats_b (dict): Second state
+
+    Returns:
+        dict: State of all runs of both states
+    """
+    n_runs_a = running_stats_a["n_runs"]
+    n_runs_b = running_stats_b["n_runs"]
+    n_runs = n_runs_a + n_runs_b
+    if n_runs_a == 0:
+        return {key: np.copy(value) for key, value in running_stats_b.items()}
+    if n_runs_b == 0:
+        return {key: np.copy(value) for key, value in running_stats_a.items()}
+
+    delta = running_stats_b["mean"] - running_stats_a["mean"]
+    merged_stats = {}
+    merged_stats["n_runs"] = n_runs
+    merged_stats["mean"] = running_stats_a["mean"] + delta * n_runs_b / n_runs
+    merged_stats["m2"] = (
+        running_stats_a["m2"]
+        + running_stats_b["m2"]
+        + delta ** 2 * n_runs_a * n_runs_b / n_runs
+    )
+    merged_stats["bin_edges"] = running_stats_a["bin_edges"]
+    merged_stats["histogram"] = (
+        running_stats_a["histogram"] + running_stats_b["histogram"]
+    )
+    merged_stats["thresholds"] = running_stats_a["thresholds"]
+    merged_stats["exceedances"] = (
+        running_stats_a["exceedances"] + running_stats_b["exceedances"]
+    )
+    return merged_stats
+
+
+def calc_chunk_stats(runs, bin_edges, thresholds):
+    """
+    Calculate the state of a chunk of runs.
+
+    Args:
+        runs (array): Runs. Shape is (n_runs,) + cell_shape.
+        bin_edges (array): Edges of the histogram bins
+        thresholds (array): Thresholds for the exceedance counts
+
+    Returns:
+        dict: State of the chunk
+    """
+    runs = np.asarray(runs, dtype=float)
+    n_runs = runs.shape[0]
+    cell_shape = runs.shape[1:]
+    n_cells = int(np.prod(cell_shape, dtype=int))
+    n_bins = len(bin_edges) - 1
+
+    bin_indices = np.clip(
+        np.searchsorted(bin_edges, runs, side="right") - 1, 0, n_bins - 1
+    )
+    flat_indices = bin_indices.reshape(n_runs, n_cells) * n_cells + np.arange(n_cells)
+    histogram = np.bincount(flat_indices.ravel(), minlength=n_bins * n_cells)
+
+    chunk_stats = {}
+    chunk_stats["n_runs"] = n_runs
+    chunk_stats["mean"] = runs.mean(axis=0)
+    chunk_stats["m2"] = np.sum((runs - chunk_stats["mean"]) ** 2, axis=0)
+    chunk_stats["bin_edges"] = bin_edges
+    chunk_stats["histogram"] = histogram.reshape((n_bins,) + cell_shape)
+    chunk_stats["thresholds"] = thresholds
+    chunk_stats["exceedances"] = np.sum(
+        runs[np.newaxis] > thresholds.reshape((-1,) + (1,) * runs.ndim), axis=1
+    )
+    return chunk_stats
+
+
+def update_running_stats(running_stats, runs):
+    """
+    Add a chunk of runs to a state.
+
+    Args:
+        running_stats (dict): State
+        runs (array): Runs. Shape is (n_runs,) + cell_shape.
+
+    Returns:
+        dict: Updated state
+    """
+    if len(runs) == 0:
+        return running_stats
+    return merge_running_stats(
+        running_stats_a=running_stats,
+        running_stats_b=calc_chunk_stats(
+            runs=runs,
+            bin_edges=running_stats["bin_edges"],
+            thresholds=running_stats["thresholds"],
+        ),
+    )
+
+
+def calc_histogram_quantiles(histogram, bin_edges, quantile):
+    """
+    Approximate a quantile in each cell from the histogram by linear
+    interpolation within the bin that contains the quantile. The error is at
+    most the width of one bin.
+
+    Args:
+        histogram (array): Counts. Shape is (n_bins,) + cell_shape.
+        bin_edges (array): Edges of the histogram bins
+        quantile (float): Quantile between zero and one
+
+    Returns:
+        array: Quantile of each cell. Shape is cell_shape.
+    """
+    cumulative_counts = np.cumsum(histogram, axis=0)
+    target = quantile * cumulative_counts[-1]
+    ix_bin = np.argmax(cumulative_counts >= target, axis=0)
+    counts_below = np.where(
+        ix_bin > 0,
+        np.take_along_axis(
+            cumulative_counts, np.maximum(ix_bin - 1, 0)[np.newaxis], axis=0
+        )[0],
+        0,
+    )
+    counts_in_bin = np.take_along_axis(histogram, ix_bin[np.newaxis], axis=0)[0]
+    fraction = np.divide(
+        target - counts_below,
+        counts_in_bin,
+        out=np.zeros(ix_bin.shape),
+        where=counts_in_bin > 0,
+    )
+    return bin_edges[ix_bin] + fraction * (bin_edges[ix_bin + 1] - bin_edges[ix_bin])
+
+
+def finalize_running_stats(running_stats, quantiles=(0.1, 0.5, 0.9)):
+    """
+    Derive the summary statistics of each cell from a state.
+
+    Args:
+        running_stats (dict): State
+        quantiles (tuple): Quantiles to approximate
+
+    Returns:
+        dict: Dictionary with the following entries:
+              'n_runs' -> Number of runs
+              'mean' -> Mean of each cell
+              'variance' -> Sample variance of each cell
+              'quantiles' -> Dict from quantile to the approximate quantile
+                             of each cell
+              'share_above' -> Dict from threshold to the share of runs
+                               above the threshold in each cell
+    """
+    n_runs = running_stats["n_runs"]
+    summary = {}
+    summary["n_runs"] = n_runs
+    summary["mean"] = running_stats["mean"]
+    summary["variance"] = running_stats["m2"] / max(n_runs - 1, 1)
+    summary["quantiles"] = {
+        quantile: calc_histogram_quantiles(
+            histogram=running_stats["histogram"],
+            bin_edges=running_stats["bin_edges"],
+            quantile=quantile,
+        )
+        for quantile in quantiles
+    }
+    summary["share_above"] = {
+        float(threshold): exceedances / max(n_runs, 1)
+        for threshold, exceedances in zip(
+            running_stats["thresholds"], running_stats["exceedances"]
+        )
+    }
+    return summary
@@ -0,0 +1,169 @@
+"""
+
+An indexed catalog of the super star markets.
+
+All markets are pickled one after another into a single data file. A JSON
+index maps the seed of each market to the byte offset and length of its
+pickle in the data file, its state of convergence and a hash of the greedy
+policies of its agents. Hence, single markets or subsets selected with the
+index can be loaded without unpickling all other markets.
+
+For a catalog with the prefix *super_star_catalog_2_agents* the files are
+*super_star_catalog_2_agents_index.json* and
+*super_star_catalog_2_agents.pickles*.
+"""
+import hashlib
+import json
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+
+def get_index_path(catalog_prefix):
+    """
+    Get the path of the index of a super star catalog.
+
+    Args:
+        catalog_prefix (string): Path of the catalog without file ending
+
+    Returns:
+        string: Path of the index
+    """
+    return f"{catalog_prefix}_index.json"
+
+
+def get_data_path(catalog_prefix):
+    """
+    Get the path of the data file of a super star catalog.
+
+    Args:
+        catalog_prefix (string): Path of the catalog without file ending
+
+    Returns:
+        string: Path of the data file
+    """
+    return f"{catalog_prefix}.pickles"
+
+
+def calc_policy_hash(all_agents):
+    """
+    Hash the greedy policies of all agents in a market. Markets in which all
+    agents pick the same price in every state have the same hash.
+
+    Args:
+        all_agents (list): List of QLearningAgents
+
+    Returns:
+        string: Hex digest of the SHA-256 hash
+    """
+    policy_hash = hashlib.sha256()
+    for agent in all_agents:
+        n_states = len(agent._qvalues)
+        policy = np.array(
+            [agent.get_best_action(int_state) for int_state in range(n_states)],
+            dtype=np.int64,
+        )
+        policy_hash.update(policy.tobytes())
+    return policy_hash.hexdigest()
+
+
+def write_super_star_catalog(super_star_tuples, seeds, catalog_prefix):
+    """
+    Write the super star markets to a catalog.
+
+    Args:
+        super_star_tuples (list): List of tuples, where each tuple is one
+                                  market upon convergence.
+                                  (state of convergence,
+                                  List with QLearningAgents)
+        seeds (list): Seed of each market
+        catalog_prefix (string): Path of the catalog without file ending
+    """
+    data_path = get_data_path(catalog_prefix=catalog_prefix)
+    all_records = []
+    with open(data_path, "wb") as f:
+        for seed, super_star_tuple in zip(seeds, super_star_tuples):
+            offset = f.tell()
+            pickle.dump(super_star_tuple, f, protocol=pickle.HIGHEST_PROTOCOL)
+            state_of_convergence, all_agents = super_star_tuple
+            all_records.append(
+                {
+                    "seed": int(seed),
+                    "offset": offset,
+                    "length": f.tell() - offset,
+                    "state_of_convergence": int(state_of_convergence),
+                    "policy_hash": calc_policy_hash(all_agents=all_agents),
+                }
+            )
+
+    with open(get_index_path(catalog_prefix=catalog_prefix), "w") as f:
+        json.dump(
+            {"data_file": os.path.basename(data_path), "markets": all_records},
+            f,
+            indent=4,
+        )
+
+
+def read_super_star_index(index_path):
+    """
+    Read the index of a super star catalog. The index can be used to select
+    markets, e.g. *index.loc[index["state_of_convergence"] == 35].index*.
+
+    Args:
+        index_path (string): Path of the index
+
+    Returns:
+        DataFrame: One row per market indexed by the seed with the columns
+                   offset, length, state_of_convergence and policy_hash.
+    """
+    with open(index_path) as f:
+        index = json.load(f)
+    return pd.DataFrame(index["markets"]).set_index("seed")
+
+
+def load_super_star_markets(index_path, seeds):
+    """
+    Load some markets from a super star catalog.
+
+    Args:
+        index_path (string): Path of the index
+        seeds (list): Seeds of the markets to load
+
+    Returns:
+        list: List with one tuple (state of convergence, List with
+              QLearningAgents) per seed in the order of *seeds*.
+
+    Raises:
+        KeyError: If a seed is not in the catalog.
+    """
+    with open(index_path) as f:
+        index = json.load(f)
+    offsets = {record["seed"]: record["offset"] for record in index["markets"]}
+    missing_seeds = [seed for seed in seeds if seed not in offsets]
+    if missing_seeds:
+        raise KeyError(f"Seeds {missing_seeds} are not in the catalog.")
+
+    # Read the markets in the order of the data file to avoid seeking back.
+    all_markets = {}
+    data_path = os.path.join(os.path.dirname(index_path), index["data_file"])
+    with open(data_path, "rb") as f:
+        for seed in sorted(set(seeds), key=offsets.get):
+            f.seek(offsets[seed])
+            all_markets[seed] = pickle.load(f)
+    return [all_markets[seed] for seed in seeds]
+
+
+def load_super_star_market(index_path, seed):
+    """
+    Load a single market from a super star catalog.
+
+    Args:
+        index_path (string): Path of the index
+        seed (integer): Seed of the market
+
+    Returns:
+        tuple: (state of convergence, List with QLearningAgents)
+    """
+    return load_super_star_markets(index_path=index_path, seeds=[seed])[0]